@@ -3,7 +3,7 @@ import tkinter.simpledialog
 import tkinter.font
 import numpy as np
 from typing import Any
-import matplotlib.pyplot as plt
+import sys
 import os
 import numpy as np
 
@@ -367,7 +367,9 @@ class EIS_GUI():
         Function to destroy all plots and all windows
         '''
         print("\nPROGRAM CLOSED BY USER.\n\n")
-        plt.close('all')
+        # matplotlib is only imported if a window with plots has been opened
+        if "matplotlib.pyplot" in sys.modules:
+            sys.modules["matplotlib.pyplot"].close('all')
         self.root.destroy()
 
     def log(self, message : str) -> None:
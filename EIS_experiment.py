@@ -15,6 +15,7 @@ from datetime import datetime
 import matplotlib.pyplot as plt
 from scipy.signal import butter, lfilter
 from scipy.fft import rfft, rfftfreq, next_fast_len
+from dependencies.profiling import timed
 
 class EIS_experiment():
     """
@@ -45,7 +46,8 @@ class EIS_experiment():
                     low_freq_periods    : float,
                     sleep_time          : float, 
                     time_path           : str,
-                    save_metadata       : dict[str, str]
+                    save_metadata       : dict[str, str],
+                    short_captures      : bool = False
     ) -> None:
         """
         Parameters
@@ -70,6 +72,9 @@ class EIS_experiment():
                 The date and time used to create the folder to save results from the EIS
         save_metadata : dict
                 Dictionary containing all required metadata for saving files.
+        short_captures : bool, default False
+                If True only the periods given by recommended_periods are sampled. The
+                files should then be processed with the "Sine fit" estimator.
 
         Description
         ----------
@@ -95,6 +100,7 @@ class EIS_experiment():
 
         self.save_path = time_path
         self.save_metadata = save_metadata
+        self.short_captures = short_captures
 
         self.pos = np.arange(16384, 16384 + self.num_picoscopes)     # The first picoscope is at 16384 from the manual # arange for faster creation (EDIT ELLING)
         self.c_handle = self.pos.astype(ctypes.c_int16)
@@ -155,7 +161,7 @@ class EIS_experiment():
         for frequency_index in range(self.num_freqs):
             freq = self.range_of_freqs[frequency_index]
             geis_element = AisEISGalvanostaticElement(freq, freq, 1, self.bias, self.amplitude)
-            periods = find_periods(freq, self.low_freq_periods)
+            periods = self.capture_periods(freq)
             geis_element.setMinimumCycles(int(periods + 4 * freq))
     
             experiment.appendElement(geis_element, 1) 
@@ -269,11 +275,12 @@ class EIS_experiment():
 
         print("PicoScope(s) is(are) ready")
         
+    @timed
     async def run_one_freq(self, freq : float) -> np.ndarray:
         """
         Does the sampling for a single frequency. Is called once per frequency.
         """
-        periods = find_periods(freq, self.low_freq_periods)
+        periods = self.capture_periods(freq)
 
         timebase = find_timebase(freq)
         samples = int(np.ceil(sample_time(periods, freq)/((timebase-2)*20e-9)))
@@ -333,7 +340,7 @@ class EIS_experiment():
     def plot(self) -> None:
 
         for frequency_index in range(self.num_freqs):
-            periods = find_periods(self.range_of_freqs[frequency_index])               
+            periods = self.capture_periods(self.range_of_freqs[frequency_index])               
             for picoscope_index in range(self.num_picoscopes):
                 for channel_index in range(4):
                     if self.channels[picoscope_index, channel_index]:
@@ -355,6 +362,7 @@ class EIS_experiment():
                 plt.legend()
                 plt.show()
     
+    @timed
     def saveData(self,
                     frequency_index : int,
                     freq            : float,
@@ -365,7 +373,7 @@ class EIS_experiment():
         try:
 
             lst = []
-            periods = find_periods(freq, self.low_freq_periods)
+            periods = self.capture_periods(freq)
 
             time_ax = np.linspace(0,sample_time(periods, self.range_of_freqs[frequency_index]),len(results[0,0]))
 
@@ -441,6 +449,14 @@ class EIS_experiment():
         except Exception as e:
             print(f"Exception in creating file: {e}")
 
+    def capture_periods(self, freq : float) -> float:
+        """
+        The number of periods sampled at the frequency, see find_periods and recommended_periods
+        """
+        if self.short_captures:
+            return recommended_periods(freq, self.low_freq_periods)
+        return find_periods(freq, self.low_freq_periods)
+
 #Convenience functions
 def sample_time(periods : float, freq : float) -> float:
     return periods/freq             #[s]
@@ -466,6 +482,18 @@ def find_periods(freq : float, low_freq_periods : float) -> float:
         
     return periods
 
+# The number of periods the sine fit estimator of EIS_Sample needs for the amplitude and phase
+SINE_FIT_PERIODS = 30
+
+def recommended_periods(freq : float, low_freq_periods : float) -> float:
+    """
+    The number of periods to sample when the impedance is found by a sine fit instead of
+    the fft bins. The long captures of find_periods are there to get a fine frequency
+    resolution, which the fit does not need, so SINE_FIT_PERIODS is enough. Never more
+    than find_periods, so the low frequencies are not made longer.
+    """
+    return min(find_periods(freq, low_freq_periods), SINE_FIT_PERIODS)
+
 def filter_data(data : np.ndarray, freq : float, fs : float) -> np.ndarray:
     filtered_data = data
     mean = statistics.mean(data)
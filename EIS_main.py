@@ -4,17 +4,15 @@ import tkinter as tk
 import numpy as np
 from multiprocessing import Pool
 from datetime import datetime
-from PySide6.QtWidgets import QApplication
 import sys
-import asyncio
-import qasync
 from math import log10
 
 
 import EIS_GUI
-import EIS_experiment
-import data_processor
-import dashboard_for_plotting_and_fitting as fitting_dash
+# EIS_experiment, data_processor and the fitting dashboard are imported in the methods
+# that open them. Together with the instrument libraries, PySide6, scipy, matplotlib,
+# pandas and bokeh they take seconds to import, which would all be spent before the
+# first dialog is shown.
 
 class EIS_main:
     def __init__(self) -> None:
@@ -174,6 +172,11 @@ class EIS_main:
         Creates an EIS_experiment object and waits for it to finish running perform_experiment.        
         """
 
+        import asyncio
+        import qasync
+        from PySide6.QtWidgets import QApplication
+        import EIS_experiment
+
         # Starts all loops necessary for interfacing with hardware
         app = QApplication(sys.argv)
         loop = qasync.QEventLoop(app)
@@ -206,6 +209,7 @@ class EIS_main:
                         save_path       : str,
                         save_metadata   : dict[str, str]
     ) -> None:
+        import data_processor
         
         # Loops through and gets all the active current and voltage channels
         channel_index_in_file = 1
@@ -235,6 +239,7 @@ class EIS_main:
         processor.start_processing()
 
     def open_processing(self) -> None:
+        import data_processor
         
         experiment_parameters, save_metadata = self.gui.collect_parameters()
 
@@ -286,6 +291,8 @@ class EIS_main:
         
     def open_fitting(self) -> None:
 
+        import dashboard_for_plotting_and_fitting as fitting_dash
+
         self.gui.log("Opening fitting window")
         fitting_dash.interface()
 
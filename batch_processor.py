@@ -0,0 +1,282 @@
+"""
+Batch processor
+
+Short description:
+The command line version of the data processor (data_processor.py). It processes
+one or several runs in Raw_data to impedance without opening any windows, so old
+campaigns can be reprocessed on a computer with no display. For each run the
+impedances are written to the impedance store and the merged files in
+Total_mm/<run>, the same as the data processor does. The per frequency .mmfiles
+in Save_folder/<run> are only written with --mmfiles. The results are kept in
+Processing_cache, so with --overwrite only the files or settings that changed
+are processed again.
+
+The channels, the shunt and the metadata written to Parameters.txt are read from
+the header of the raw files, but the channels and the current correction can be
+overwritten from the command line.
+
+Example:
+    python batch_processor.py Raw_data/2025-07-* --window Hann --workers 8
+
+Dependencies:
+The helper files eis_sample.py, processing_engine.py, impedance_merge.py, impedance_store.py
+and processing_cache.py
+Modules:
+    numpy
+    scipy
+    argparse
+    glob
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+from dependencies.eis_sample import EIS_Sample, ESTIMATORS
+from dependencies.processing_engine import (
+    ProcessingEngine,
+    channel_columns,
+    channel_pairs,
+)
+from dependencies.impedance_merge import ImpedanceMerger, active_channel_numbers
+from dependencies.impedance_store import ImpedanceStore
+from dependencies.processing_cache import ProcessingCache
+from dependencies.profiling import stage
+
+WINDOW_FUNCTIONS = ["Rectangle", "Hann", "Hamming", "Blackman", "Kaiser"]
+
+
+def parse_arguments(arguments=None):
+    """Returns the parsed command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Process raw picoscope runs to impedance without the GUI."
+    )
+    parser.add_argument(
+        "runs",
+        nargs="+",
+        help="Run folders in Raw_data, glob patterns are expanded (e.g. Raw_data/2025-07-*)",
+    )
+    parser.add_argument("--save-root", default="Save_folder", help="Folder for the per frequency .mmfiles")
+    parser.add_argument("--total-root", default="Total_mm", help="Folder for the merged .mmfiles")
+    parser.add_argument("--window", default="Rectangle", choices=WINDOW_FUNCTIONS, help="Window function applied before the fft")
+    parser.add_argument("--beta", type=float, default=4.2, help="Beta parameter of the Kaiser window")
+    parser.add_argument(
+        "--estimator",
+        default="FFT",
+        choices=ESTIMATORS,
+        help="How the impedance is found, Sine fit works with short captures",
+    )
+    parser.add_argument(
+        "--current-correction",
+        type=float,
+        default=None,
+        help="Current correction in Ohm, the shunt in the file header is used if not given",
+    )
+    parser.add_argument("--voltage-proportion", type=float, default=0.001)
+    parser.add_argument("--current-proportion", type=float, default=0.4)
+    parser.add_argument(
+        "--current-channels",
+        default=None,
+        help="Comma separated current columns (e.g. 1,5), found from the file header if not given",
+    )
+    parser.add_argument(
+        "--voltage-channels",
+        default=None,
+        help="Comma separated voltage columns (e.g. 2,3,4,6,7), found from the file header if not given",
+    )
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes, default is the number of cores")
+    parser.add_argument("--overwrite", action="store_true", help="Process files that are already processed")
+    parser.add_argument("--cache-root", default="Processing_cache", help="Folder for the cached processing results")
+    parser.add_argument("--no-cache", action="store_true", help="Do not use or fill the processing cache")
+    parser.add_argument(
+        "--hash-files",
+        action="store_true",
+        help="Check the cached raw files by content hash instead of size and modification time",
+    )
+    parser.add_argument("--mmfiles", action="store_true", help="Also write the per frequency .mmfiles to the save folder")
+    parser.add_argument(
+        "--memory-map",
+        action="store_true",
+        help="Convert each raw file once to a memory mapped .npy next to it, instead of parsing the text for every channel",
+    )
+    return parser.parse_args(arguments)
+
+
+def find_runs(patterns):
+    """Returns the sorted run folders matching the paths or glob patterns"""
+    runs = set()
+    for pattern in patterns:
+        matches = glob.glob(pattern) if glob.has_magic(pattern) else [pattern]
+        runs.update(os.path.normpath(match) for match in matches if os.path.isdir(match))
+    return sorted(runs)
+
+
+def progress_bar(done, total, width=40):
+    """Writes a progress bar to stderr, overwriting the previous one"""
+    filled = int(width * done / total) if total else width
+    sys.stderr.write(f"\r[{'#' * filled}{'.' * (width - filled)}] {done}/{total}")
+    if done == total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+
+def process_runs(arguments):
+    """
+    Parameters:
+    ----------
+    - arguments: argparse.Namespace
+        The parsed arguments, see parse_arguments
+
+    Does:
+    ----------
+    Finds the raw files of all the runs and sends every file and channel pair
+    to a ProcessingEngine. The results are saved as they finish and when all
+    files are done every run is merged to Total_mm. The impedances are kept in
+    memory for the merge, so only save files skipped because they already
+    existed are read back.
+    """
+    runs = find_runs(arguments.runs)
+    if len(runs) == 0:
+        print("No run folders found")
+        return
+
+    cache = None
+    if not arguments.no_cache:
+        cache = ProcessingCache(arguments.cache_root, content_hash=arguments.hash_files)
+    engine = ProcessingEngine(arguments.workers, cache=cache)
+    run_info = {}
+    jobs = 0
+    for run_path in runs:
+        raw_files = sorted(
+            os.path.join(run_path, file)
+            for file in os.listdir(run_path)
+            if file.startswith("freq") and file.endswith("Hz.txt")
+        )
+        if len(raw_files) == 0:
+            print(f"No raw files in {run_path}, skipping")
+            continue
+        # The runs are told apart by their absolute path, two runs can have the same folder name
+        run_key = os.path.abspath(run_path)
+        run_name = os.path.basename(run_key)
+        if run_key in run_info:
+            continue
+        same_name = [info["run_path"] for info in run_info.values() if info["run_name"] == run_name]
+        if len(same_name) > 0:
+            print(f"{run_path} has the same name as {same_name[0]} and would be merged into the same Total_mm folder, skipping")
+            continue
+        header = EIS_Sample.read_header(raw_files[0])
+
+        current_locs, voltage_locs = channel_columns(header["channels"])
+        if arguments.current_channels is not None:
+            current_locs = [int(loc) for loc in arguments.current_channels.split(",")]
+        if arguments.voltage_channels is not None:
+            voltage_locs = [int(loc) for loc in arguments.voltage_channels.split(",")]
+        pairs = channel_pairs(current_locs, voltage_locs)
+
+        correction = arguments.current_correction
+        if correction is None:
+            correction = float(header["shunt"])
+
+        settings = {
+            "time_loc": 0,
+            "voltage_prominence": arguments.voltage_proportion,
+            "current_prominence": arguments.current_proportion,
+            "correction_factor_current": correction,
+            "filter_apply": True,
+            "filter_type": arguments.window,
+            "beta_factor": arguments.beta,
+            "estimator": arguments.estimator,
+            "memory_map": arguments.memory_map,
+        }
+        save_folder = os.path.join(arguments.save_root, run_name)
+        if arguments.mmfiles:
+            os.makedirs(save_folder, exist_ok=True)
+        channel_numbers = active_channel_numbers(len(header["channels"]), header["channels"])
+        store = ImpedanceStore(os.path.join(arguments.total_root, run_name))
+        store.create(run_name, header, channel_numbers)
+
+        # The file and channels that are already processed, in the store or as .mmfiles
+        processed = set()
+        if not arguments.overwrite:
+            _, table = store.read()
+            processed = {
+                ImpedanceStore.mmfile_name(source, channel)
+                for source, channel in zip(table["source"], table["channel"])
+            }
+            if os.path.isdir(save_folder):
+                processed.update(os.listdir(save_folder))
+
+        submitted = 0
+        for file_path in raw_files:
+            file_pairs = [
+                (current_loc, voltage_loc)
+                for current_loc, voltage_loc in pairs
+                if ImpedanceStore.mmfile_name(file_path, voltage_loc) not in processed
+            ]
+            if len(file_pairs) > 0:
+                engine.submit_file(file_path, settings, file_pairs)
+                submitted += len(file_pairs)
+        jobs += submitted
+        run_info[run_key] = {
+            "run_path": run_path,
+            "run_name": run_name,
+            "save_folder": save_folder,
+            "header": header,
+            "store": store,
+            "channel_numbers": channel_numbers,
+            "merger": ImpedanceMerger(header["selected_frequencies"], log=lambda message: None),
+        }
+        print(f"{run_name}: {len(raw_files)} files, {len(pairs)} channels, {submitted} jobs")
+
+    start = time.time()
+    done = 0
+    failed = 0
+    progress_bar(done, jobs)
+    while engine.busy():
+        with stage("batch_processor.collect"):
+            results = engine.collect()
+        if len(results) == 0:
+            time.sleep(0.05)
+            continue
+        for result in results:
+            info = run_info[os.path.dirname(os.path.abspath(result["file_path"]))]
+            if result["error"] is not None:
+                failed += 1
+                sys.stderr.write(f"\nFailed {result['file_path']} voltage index {result['voltage_loc']}: {result['error']}\n")
+            else:
+                full_save_path = EIS_Sample.get_full_save_path(
+                    info["save_folder"], result["file_path"], result["voltage_loc"], True
+                )
+                info["store"].append_sample(result["sample"], result["voltage_loc"], result["file_path"])
+                if arguments.mmfiles:
+                    result["sample"].save_to_MMFILE(full_save_path)
+                info["merger"].add(
+                    result["voltage_loc"],
+                    result["sample"].fft_frequencies,
+                    result["sample"].impedance,
+                    save_path=full_save_path,
+                )
+            done += 1
+            progress_bar(done, jobs)
+    engine.shutdown()
+
+    for info in run_info.values():
+        run_name = info["run_name"]
+        with stage("batch_processor.merge"):
+            info["store"].add_to(info["merger"])
+            if os.path.isdir(info["save_folder"]):
+                info["merger"].add_folder(info["save_folder"])
+            info["merger"].write(
+                os.path.join(arguments.total_root, run_name),
+                run_name,
+                info["header"],
+                channel_numbers=info["channel_numbers"],
+            )
+        print(f"Merged {run_name}")
+    print(f"Processed {done - failed} of {jobs} in {time.time() - start:.2f} s, {failed} failed")
+    if cache is not None:
+        print(f"{cache.hits} taken from the processing cache")
+
+
+if __name__ == "__main__":
+    process_runs(parse_arguments())
@@ -0,0 +1,123 @@
+"""
+Import times
+
+Short description:
+----------
+Measures how long the entry modules of the program take to import, with the
+-X importtime option of Python, in a new interpreter for every measurement so
+nothing is already imported. The time before the first window is shown is mostly
+import time, so this is part of the benchmarks (see run_benchmarks.py). Run from
+the top folder to see what an entry module spends its import time on:
+
+    python -m benchmarks.import_times EIS_main --top 15
+
+Contains:
+----------
+- ENTRY_MODULES: The modules that are measured by the benchmarks
+- parse_importtime: Reads the -X importtime output
+- import_time: Measures the import of one module
+- heaviest: The packages that take the longest to import
+"""
+import os
+import sys
+import argparse
+import subprocess
+import numpy as np
+
+ENTRY_MODULES = [
+    "EIS_main",
+    "EIS_GUI",
+    "data_processor",
+    "dashboard_for_plotting_and_fitting",
+    "dependencies.processing_engine",
+    "batch_processor",
+]
+TOP_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_importtime(output):
+    """
+    Parameters:
+    ----------
+    - output: str
+        The standard error of an interpreter run with -X importtime
+
+    Returns:
+    ----------
+    A list of (module, self time [s], cumulative time [s], depth) in the order
+    they were printed, where depth is 0 for the modules imported by the code run.
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "| imported package" in line:
+            continue
+        self_time, cumulative_time, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), int(self_time) / 1e6, int(cumulative_time) / 1e6, depth))
+    return modules
+
+
+def import_time(module, repeat=3, python=sys.executable):
+    """
+    Parameters:
+    ----------
+    - module: str
+        The module to import, e.g. "EIS_main" or "dependencies.eis_sample"
+    - repeat: int, default 3
+        The number of new interpreters the import is measured in
+    - python: str, default the running interpreter
+        The interpreter that is used
+
+    Returns:
+    ----------
+    A dict with the min and median time of the import in seconds and the modules
+    of the fastest import as returned by parse_importtime. The dict has the key
+    "error" instead if the module could not be imported.
+    """
+    times = []
+    fastest = None
+    for _ in range(repeat):
+        process = subprocess.run(
+            [python, "-X", "importtime", "-c", f"import {module}"],
+            cwd=TOP_FOLDER,
+            capture_output=True,
+            text=True,
+        )
+        if process.returncode != 0:
+            return {"error": process.stderr.strip().splitlines()[-1]}
+        modules = parse_importtime(process.stderr)
+        total = sum(cumulative_time for _, _, cumulative_time, depth in modules if depth == 0)
+        times.append(total)
+        if fastest is None or total <= min(times):
+            fastest = modules
+    return {"min": min(times), "median": float(np.median(times)), "repeat": repeat, "modules": fastest}
+
+
+def heaviest(modules, top=15, exclude=()):
+    """Returns the top packages by cumulative import time, as (package, time [s]), from the output of parse_importtime"""
+    packages = {}
+    for name, _, cumulative_time, _ in modules:
+        if name.split(".")[0] in exclude:
+            continue
+        # The first import of a package has the largest time, as it includes its sub modules
+        package = name.split(".")[0]
+        packages[package] = max(packages.get(package, 0), cumulative_time)
+    ranked = sorted(packages.items(), key=lambda item: -item[1])
+    return ranked[:top]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the import time of the entry modules.")
+    parser.add_argument("modules", nargs="*", default=ENTRY_MODULES, help="The modules to import")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="The number of packages listed for each module")
+    arguments = parser.parse_args()
+
+    for module in arguments.modules:
+        result = import_time(module, arguments.repeat)
+        if "error" in result:
+            print(f"{module:40s} not importable here: {result['error']}")
+            continue
+        print(f"{module:40s}{result['min']:10.3f} s")
+        for package, time in heaviest(result["modules"], arguments.top, exclude=(module, "dependencies")):
+            print(f"    {package:36s}{time:10.3f} s")
@@ -0,0 +1,309 @@
+"""
+Run benchmarks
+
+Short description:
+----------
+Times the processing path on synthetic runs (see synthetic_run.py) of different
+sizes and stores the result as JSON, so the effect of a change can be measured
+by comparing with a baseline made before it. Run from the top folder:
+
+    python -m benchmarks.run_benchmarks --output benchmarks/results/before.json
+    python -m benchmarks.run_benchmarks --baseline benchmarks/results/before.json
+
+What is timed, for every size:
+- from_file : EIS_Sample.from_file of all the raw files of the run, and
+  from_file/memory_map with the memory mapped index already made
+- fft/<window> : EIS_Sample.fft of all the raw files for each window function,
+  and fft/<estimator> for the estimators that are not the plain fft
+- save_total_mm : Data_processor.save_total_mm, reading the impedance store and
+  the save folder and writing Total_mm. The method is called on a stand in for
+  the tkinter window, with a new ImpedanceMerger every time as if nothing was
+  processed in the session.
+- retrieve_data/store and retrieve_data/mmfiles : fitting_algorithms.retrieve_data
+  of the Total_mm folder, with and without the impedance store
+
+And once, not for every size:
+- import/<module> : The import time of the entry modules in import_times.py, in a
+  new interpreter. Modules that can not be imported here are left out.
+
+Contains:
+----------
+- SIZES: The sizes of the synthetic runs
+- time_call: Times a function
+- run_benchmarks: Runs all the benchmarks
+- compare: Makes the report comparing a result with a baseline
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+from types import SimpleNamespace
+import numpy as np
+from benchmarks.synthetic_run import make_run, parse_channels
+from benchmarks.import_times import ENTRY_MODULES, import_time
+from dependencies.eis_sample import EIS_Sample, ESTIMATORS
+from dependencies.processing_engine import channel_columns, channel_pairs, frequency_from_filename
+from dependencies.impedance_merge import ImpedanceMerger, active_channel_numbers
+from dependencies.impedance_store import ImpedanceStore
+from dependencies.fitting_algorithms import retrieve_data
+from data_processor import Data_processor
+
+WINDOW_FUNCTIONS = ["Rectangle", "Hann", "Hamming", "Blackman", "Kaiser"]
+# Number of frequencies and periods in each file of the synthetic runs
+SIZES = {
+    "small": {"frequencies": 5, "periods": 20},
+    "medium": {"frequencies": 10, "periods": 100},
+    "large": {"frequencies": 20, "periods": 500},
+}
+RUN_NAME = "2000-01-01-0000-00"
+
+
+def time_call(function, repeat):
+    """Returns the min and median wall time in seconds of calling function repeat times, after one call that is not timed"""
+    function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": float(np.median(times)), "repeat": repeat}
+
+
+class _Value:
+    """Stands in for the tkinter variables read by retrieve_data"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+def benchmark_size(size_name, size, channels, noise, repeat, work_folder):
+    """Makes a run of the size and times every stage of it, returns the results by name"""
+    frequencies = np.logspace(3, 0, size["frequencies"])
+    raw_root = os.path.join(work_folder, "Raw_data")
+    run_path, save_metadata = make_run(
+        raw_root, RUN_NAME, np.round(frequencies, 3), channels, periods=size["periods"], noise=noise
+    )
+    file_paths = sorted(os.path.join(run_path, file) for file in os.listdir(run_path))
+    current_locs, voltage_locs = channel_columns(channels)
+    pairs = channel_pairs(current_locs, voltage_locs)
+    current_loc, voltage_loc = pairs[0]
+    correction = float(save_metadata["shunt"])
+    results = {}
+
+    def load_all(**parameters):
+        return [
+            EIS_Sample.from_file(
+                file_path,
+                voltage_loc=voltage_loc,
+                current_loc=current_loc,
+                correction_factor_current=correction,
+                frequency_now=frequency_from_filename(file_path),
+                **parameters,
+            )
+            for file_path in file_paths
+        ]
+
+    results["from_file"] = time_call(load_all, repeat)
+    # The first call, which is not timed, makes the memory mapped indexes
+    results["from_file/memory_map"] = time_call(lambda: load_all(memory_map=True), repeat)
+
+    def fft_all(samples):
+        for sample in samples:
+            sample.fft()
+
+    for window in WINDOW_FUNCTIONS:
+        samples = load_all(filter_type=window)
+        results[f"fft/{window}"] = time_call(lambda: fft_all(samples), repeat)
+    for estimator in ESTIMATORS[1:]:
+        samples = load_all(filter_type="Hann", estimator=estimator)
+        results[f"fft/{estimator}"] = time_call(lambda: fft_all(samples), repeat)
+
+    # Processing all channels once, to have the files that are merged
+    total_root = os.path.join(work_folder, "Total_mm")
+    save_folder = os.path.join(work_folder, "Save_folder", RUN_NAME)
+    total_mm_folder = os.path.join(total_root, RUN_NAME)
+    os.makedirs(save_folder, exist_ok=True)
+    channel_numbers = active_channel_numbers(len(channels), channels)
+    store = ImpedanceStore(total_mm_folder)
+    store.create(RUN_NAME, save_metadata, channel_numbers)
+    for file_path in file_paths:
+        for pair_current_loc, pair_voltage_loc in pairs:
+            sample = EIS_Sample.from_file(
+                file_path,
+                voltage_loc=pair_voltage_loc,
+                current_loc=pair_current_loc,
+                correction_factor_current=correction,
+                filter_type="Hann",
+                frequency_now=frequency_from_filename(file_path),
+            )
+            sample.fft()
+            store.append_sample(sample, pair_voltage_loc, file_path)
+            sample.save_to_MMFILE(EIS_Sample.get_full_save_path(save_folder, file_path, pair_voltage_loc, True))
+
+    # The attributes of the window used by save_total_mm
+    window = SimpleNamespace(
+        log=lambda message: None,
+        store=store,
+        save_time_string=RUN_NAME,
+        total_mm_path=total_mm_folder,
+        save_metadata=save_metadata,
+        num_picoscopes=len(channels),
+        channels=channels,
+    )
+
+    def save_total_mm():
+        window.merger = ImpedanceMerger(save_metadata["selected_frequencies"], log=window.log)
+        Data_processor.save_total_mm(window)
+
+    # The save folder is relative to the working folder of the program
+    working_folder = os.getcwd()
+    os.chdir(work_folder)
+    try:
+        results["save_total_mm"] = time_call(save_total_mm, repeat)
+    finally:
+        os.chdir(working_folder)
+
+    interface = SimpleNamespace(
+        tw=SimpleNamespace(log=lambda message: None, normalize_checkbox_var=_Value(0)),
+        default_path=total_root,
+    )
+    results["retrieve_data/store"] = time_call(lambda: retrieve_data(interface), repeat)
+    os.remove(store.path)
+    results["retrieve_data/mmfiles"] = time_call(lambda: retrieve_data(interface), repeat)
+
+    samples_per_file = int(size["periods"] * 200)
+    for result in results.values():
+        result.update(
+            {
+                "size": size_name,
+                "files": len(file_paths),
+                "samples_per_file": samples_per_file,
+                "channels": len(pairs),
+            }
+        )
+    return {f"{size_name}/{name}": result for name, result in results.items()}
+
+
+def benchmark_imports(modules, repeat, log=print):
+    """Measures the import time of the modules, returns the results by name"""
+    results = {}
+    for module in modules:
+        result = import_time(module, repeat)
+        if "error" in result:
+            log(f"Not timing the import of {module}: {result['error']}")
+            continue
+        del result["modules"]
+        result.update({"size": "import"})
+        results[f"import/{module}"] = result
+    return results
+
+
+def run_benchmarks(sizes, channels, noise=0.001, repeat=3, import_modules=ENTRY_MODULES, log=print):
+    """
+    Parameters:
+    ----------
+    - sizes: list of str
+        The names of the sizes in SIZES to run
+    - channels: np.ndarray of bool with shape (num_picoscopes, 4)
+        The active channels of the synthetic runs
+    - noise: float, default 0.001
+        The noise of the synthetic runs, see synthetic_run.write_raw_file
+    - repeat: int, default 3
+        The number of times each stage is timed
+    - import_modules: list of str, default ENTRY_MODULES
+        The modules the import time is measured of
+    - log: function(str)
+        A loging function that takes a string as input
+
+    Returns:
+    ----------
+    A dict with the environment and the results by "size/stage".
+    """
+    results = benchmark_imports(import_modules, repeat, log)
+    for size_name in sizes:
+        work_folder = tempfile.mkdtemp(prefix="eis_benchmark_")
+        try:
+            log(f"Running {size_name}")
+            results.update(
+                benchmark_size(size_name, SIZES[size_name], channels, noise, repeat, work_folder)
+            )
+        finally:
+            shutil.rmtree(work_folder, ignore_errors=True)
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+        "processor": platform.processor(),
+        "results": results,
+    }
+
+
+def compare(result, baseline, threshold=0.1):
+    """
+    Returns a report with the median time of every stage in the result and the
+    baseline, and the ratio between them. Stages more than threshold slower or
+    faster are marked. Also returns True if any stage is slower.
+    """
+    lines = [f"{'stage':40s}{'baseline [s]':>14s}{'now [s]':>14s}{'ratio':>9s}"]
+    slower = False
+    for name, now in result["results"].items():
+        if name not in baseline["results"]:
+            lines.append(f"{name:40s}{'-':>14s}{now['median']:14.4f}{'new':>9s}")
+            continue
+        before = baseline["results"][name]["median"]
+        ratio = now["median"] / before if before > 0 else float("inf")
+        mark = ""
+        if ratio > 1 + threshold:
+            mark = "  slower"
+            slower = True
+        elif ratio < 1 - threshold:
+            mark = "  faster"
+        lines.append(f"{name:40s}{before:14.4f}{now['median']:14.4f}{ratio:9.2f}{mark}")
+    return "\n".join(lines), slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the processing path on synthetic runs.")
+    parser.add_argument("--sizes", default="small,medium", help=f"Comma separated sizes from {list(SIZES)}")
+    parser.add_argument("--channels", default="1111", help="Picoscope codes, comma separated (e.g. 1111,1110)")
+    parser.add_argument("--noise", type=float, default=0.001)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-imports", action="store_true", help="Do not measure the import times")
+    parser.add_argument("--output", default=None, help="JSON file the result is written to")
+    parser.add_argument("--baseline", default=None, help="JSON file of an earlier result to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change marked as slower or faster")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with 1 if a stage is slower")
+    arguments = parser.parse_args()
+
+    result = run_benchmarks(
+        arguments.sizes.split(","),
+        parse_channels(arguments.channels),
+        noise=arguments.noise,
+        repeat=arguments.repeat,
+        import_modules=[] if arguments.no_imports else ENTRY_MODULES,
+    )
+    if arguments.output is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(arguments.output)), exist_ok=True)
+        with open(arguments.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Wrote {arguments.output}")
+
+    if arguments.baseline is not None:
+        with open(arguments.baseline, "r") as f:
+            baseline = json.load(f)
+        report, slower = compare(result, baseline, arguments.threshold)
+        print(report)
+        if slower and arguments.fail_on_regression:
+            sys.exit(1)
+    else:
+        for name, timing in result["results"].items():
+            print(f"{name:40s}{timing['median']:10.4f} s")
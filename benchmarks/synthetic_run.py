@@ -0,0 +1,211 @@
+"""
+Synthetic run
+
+Short description:
+----------
+Makes runs in Raw_data with the same text layout as EIS_experiment.saveData, so the
+processing and fitting can be timed and tested without the picoscopes. The current
+is a sine on top of a DC current, written as the voltage over the shunt, and every
+voltage channel is the response of its own Randles cell, R0 + R1 / (1 + j w R1 C),
+with gaussian noise added to all channels.
+
+Example:
+    python -m benchmarks.synthetic_run Raw_data --frequencies 1000,100,10 --periods 50
+
+Contains:
+----------
+- cell_impedance: The impedance of the synthetic cell of a voltage channel
+- write_raw_file: Writes one raw file
+- make_run: Writes the raw files of all frequencies of a run
+"""
+import os
+import argparse
+import numpy as np
+
+DEFAULT_METADATA = {
+    "max_potential_channel": "20",
+    "max_potential_stack": "20",
+    "max_potential_cell": "20",
+    "area": "10",
+    "temperature": "80",
+    "pressure": "1",
+    "DC_current": "10",
+    "AC_current": "5",
+    "shunt": "1",
+}
+
+
+def cell_impedance(frequency, channel_number):
+    """Returns the impedance of the Randles cell measured by the voltage channel 4*picoscope + channel + 1"""
+    r0 = 0.01 * channel_number
+    r1 = 0.02 + 0.005 * channel_number
+    capacitance = 0.5
+    return r0 + r1 / (1 + 2j * np.pi * frequency * r1 * capacitance)
+
+
+def write_raw_file(
+    file_path,
+    frequency,
+    channels,
+    save_metadata,
+    periods=50,
+    samples_per_period=200,
+    noise=0.001,
+    rng=None,
+):
+    """
+    Parameters:
+    ----------
+    - file_path: str
+        The file to write, named freq<frequency>Hz.txt
+    - frequency: float
+        The frequency of the sine in Hertz
+    - channels: np.ndarray of bool with shape (num_picoscopes, 4)
+        The active channels of each picoscope, the first being the current
+    - save_metadata: dict
+        The metadata written to the header, as in EIS_experiment
+    - periods: float, default 50
+        The number of periods in the capture
+    - samples_per_period: int, default 200
+        The number of samples in a period
+    - noise: float, default 0.001
+        The standard deviation of the noise relative to the AC amplitude
+    - rng: np.random.Generator, default None
+        The random generator of the noise
+
+    Does:
+    ----------
+    Writes the header and the columns of time and the active channels in mV,
+    the same as EIS_experiment.saveData.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    num_samples = int(round(periods * samples_per_period))
+    time_ax = np.linspace(0, periods / frequency, num_samples)
+    dc_current = float(save_metadata["DC_current"])
+    ac_current = dc_current * float(save_metadata["AC_current"]) / 100
+    shunt = float(save_metadata["shunt"])
+    phase = 2 * np.pi * frequency * time_ax
+
+    columns = [time_ax]
+    names = []
+    for picoscope_index in range(len(channels)):
+        for channel_index in range(4):
+            if not channels[picoscope_index][channel_index]:
+                continue
+            if channel_index == 0:
+                signal = (dc_current + ac_current * np.sin(phase)) * shunt
+                names.append("Current (as voltage)")
+            else:
+                impedance = cell_impedance(frequency, 4 * picoscope_index + channel_index + 1)
+                signal = dc_current * impedance.real + ac_current * np.abs(impedance) * np.sin(
+                    phase + np.angle(impedance)
+                )
+                names.append(f"Voltage{4 * picoscope_index + channel_index}")
+            signal = signal + rng.normal(0, noise * ac_current * shunt, num_samples)
+            columns.append(1000 * signal)
+
+    picoscope_string = "".join(str(int(active)) for active in np.ravel(channels)).ljust(40, "0")
+    with open(file_path, "w") as f:
+        f.write(f"Date: \t{save_metadata['date']}\n")
+        f.write(f"Time: \t{save_metadata['time']}\n\n")
+        f.write(f"Picoscope code: \t{picoscope_string}\n\n")
+        f.write(f"Max potential (current channel) [V]: \t{save_metadata['max_potential_channel']}\n")
+        f.write(f"Max stack potential [V]: \t{save_metadata['max_potential_stack']}\n")
+        f.write(f"Max cell potential [V]: \t{save_metadata['max_potential_cell']}\n\n")
+        f.write(f"Cell numbers: \t{save_metadata['cell_numbers']}\n")
+        f.write(f"Area [cm2]: \t{save_metadata['area']}\n")
+        f.write(f"Temperature [degC]: \t{save_metadata['temperature']}\n")
+        f.write(f"Pressure [bar]: \t{save_metadata['pressure']}\n")
+        f.write(f"DC current [A]: \t{save_metadata['DC_current']}\n")
+        f.write(f"AC current [in pct of DC current]: \t{save_metadata['AC_current']}\n")
+        f.write(f"Shunt: \t{save_metadata['shunt']}\n\n")
+        f.write("Run without potentiostat [Y/N]: \tN\n")
+        f.write(f"Frequencies selected: \t{save_metadata['selected_frequencies']}\n")
+        f.write("\n")
+        f.write("Time" + "".join(f"\t{name}" for name in names) + "\n")
+        f.write("s" + "\tmV" * len(names) + "\n\n")
+        np.savetxt(f, np.column_stack(columns), fmt="%.9g", delimiter="\t")
+
+
+def make_run(
+    raw_root,
+    run_name,
+    frequencies,
+    channels,
+    periods=50,
+    samples_per_period=200,
+    noise=0.001,
+    seed=0,
+):
+    """
+    Parameters:
+    ----------
+    - raw_root: str
+        The Raw_data folder, the run is written to raw_root/run_name
+    - run_name: str
+        The name of the run, on the format YYYY-MM-DD-HHMM-SS
+    - frequencies: list of float
+        The frequencies of the run
+    - channels: np.ndarray of bool with shape (num_picoscopes, 4)
+        The active channels of each picoscope
+    - periods, samples_per_period, noise: see write_raw_file
+    - seed: int, default 0
+        The seed of the noise, so the same run is made every time
+
+    Returns:
+    ----------
+    The folder of the run and the save_metadata written to the headers.
+    """
+    channels = np.asarray(channels, dtype=bool)
+    num_voltage_channels = int(np.sum(channels[:, 1:]))
+    save_metadata = dict(DEFAULT_METADATA)
+    save_metadata["date"] = run_name[:11]
+    save_metadata["time"] = run_name[11:]
+    save_metadata["cell_numbers"] = ",".join(str(number + 1) for number in range(num_voltage_channels))
+    save_metadata["selected_frequencies"] = ",".join(str(float(frequency)) for frequency in frequencies)
+
+    run_path = os.path.join(raw_root, run_name)
+    os.makedirs(run_path, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for frequency in frequencies:
+        write_raw_file(
+            os.path.join(run_path, f"freq{float(frequency)}Hz.txt"),
+            float(frequency),
+            channels,
+            save_metadata,
+            periods=periods,
+            samples_per_period=samples_per_period,
+            noise=noise,
+            rng=rng,
+        )
+    return run_path, save_metadata
+
+
+def parse_channels(text):
+    """Returns the channels array from picoscope codes like 1111,1110"""
+    return np.array([[digit == "1" for digit in code] for code in text.split(",")], dtype=bool)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Make a synthetic run in the raw data layout.")
+    parser.add_argument("raw_root", help="The Raw_data folder")
+    parser.add_argument("--run", default="2000-01-01-0000-00", help="Name of the run")
+    parser.add_argument("--frequencies", default="1000,100,10", help="Comma separated frequencies in Hz")
+    parser.add_argument("--channels", default="1111", help="Picoscope codes, comma separated (e.g. 1111,1110)")
+    parser.add_argument("--periods", type=float, default=50)
+    parser.add_argument("--samples-per-period", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.001)
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+    run_path, _ = make_run(
+        arguments.raw_root,
+        arguments.run,
+        [float(frequency) for frequency in arguments.frequencies.split(",")],
+        parse_channels(arguments.channels),
+        periods=arguments.periods,
+        samples_per_period=arguments.samples_per_period,
+        noise=arguments.noise,
+        seed=arguments.seed,
+    )
+    print(f"Made {run_path}")
@@ -18,39 +18,16 @@ Depends on:
 '''
 import os
 import tkinter as tk
-from bokeh.io import show
-from bokeh.models import CustomJS
 import pandas as pd         # For sorting file structure
-from bokeh.plotting import output_file, save
-import dependencies.generate_bokeh as gb
 import dependencies.circuit_handler as ch  
 from dependencies.tkinter_window import tkinter_class
-from dependencies.fitting_algorithms import retrieve_data, fit_with_circuit, fit_with_DRT, predict_impedances
+from dependencies.fitting_algorithms import retrieve_data, fit_with_circuit, compare_circuits, fit_with_DRT, predict_impedances
+from dependencies.model_selection import rank_models
+from dependencies.processing_manifest import ProcessingManifest, spectrum_hashes, replace_rows, with_results
+# bokeh is imported in create_bokeh, the DRT fitting and impedance where they are
+# used, so the window opens without waiting for them
 
 import time
-from tkinter import ttk
-from tkinter import filedialog
-from shutil import rmtree
-from watchdog.observers import Observer
-from watchdog.events import PatternMatchingEventHandler
-from dependencies.eis_sample import EIS_Sample
-from bokeh.io import show, curdoc
-from datetime import date
-from bokeh.models import Button, CustomJS, CheckboxButtonGroup, CheckboxGroup, ColorPicker, ColumnDataSource, DataTable, TabPanel
-from bokeh.models import CDSView, GroupFilter, CustomJSFilter
-from bokeh.models import DateFormatter, TableColumn, DatePicker, DateRangeSlider, text, Dropdown, MultiChoice, MultiSelect, Div
-from bokeh.models import PasswordInput, RadioButtonGroup, RadioGroup, RangeSlider, Select, Slider, Span, Tabs, GridPlot, Plot, HoverTool
-from bokeh.models import LinearAxis, Range1d
-from bokeh.plotting import figure
-from bokeh.layouts import column, row, layout
-from bokeh.palettes import Cividis, Spectral, Turbo256, Plasma256, Viridis256    # Color palettes
-import numpy as np
-import math
-import copy # For doing deeper copies
-
-from datetime import datetime # For sorting dates
-from io import StringIO
-from impedance.models.circuits.circuits import CustomCircuit
 
 
 class interface():
@@ -104,6 +81,13 @@ class interface():
 
         self.bokeh_output_file_name = 'dashboard_for_plotting_and_fitting'
 
+        # Number of worker processes fitting the cells in parallel, see parallel_fitting.py
+        self.circuit_fit_workers = os.cpu_count() or 1
+
+        # The spectra processed so far, so the auto-run only processes new or changed ones, see processing_manifest.py
+        self.manifest = ProcessingManifest()
+        self.run_cells = {} # path_to_file -> (dir_name, cell_name) of the processed spectra
+
         # Variables used in normalization
         self.area_size = -1
         self.area_str = 'cm^2'
@@ -128,49 +112,6 @@ class interface():
         except:
             print('interface -> init: Unable to start tkinter window.')
 
-    def find_circuit_type(self, in_file_path, out_file_path) -> ch.BaseCircuitHandler:
-        """
-        When
-        ----------
-        Called when a Circuit should be made, from the process and load existing
-        functions.
-
-        Does
-        ----------
-        Creates a circuit handler with the circuit string taken from the stored
-        vale of circuit_string.get(). If normalize is true the circuit handler
-        vil be created with normalized data and units. Also pass the log function
-        to the circuit handler. The file paths are also passed and used when it
-        should load/save data.
-
-        Note
-        ----------
-        Errors are raised if the circuit string or the paths
-        are invalid.
-        """
-        # With normalization
-        if self.tw.normalize_checkbox_var.get() == 1 or self.tw.normalize_checkbox_var.get() == 1.0 or self.tw.normalize_checkbox_var.get() == "1" or self.tw.normalize_checkbox_var.get() == '1.0':
-            circuit_handler = ch.get_circuit_handler(self.tw.circuit_string.get())(
-                in_file_path,
-                out_file_path,
-                self.tw.log,
-                area_str=self.area_str, # Normalization input
-                area_size=float(self.area_size)  # Normalization input
-            )
-        # Without normalization
-        else:
-            # print(' Without normalization')
-            circuit_handler = ch.get_circuit_handler(self.tw.circuit_string.get())(
-                in_file_path, '', self.tw.log, area_str = 'cm^2', area_size=float(-1)
-            )
-        # Checks if the retured circuit is valid instance
-        if circuit_handler is None:
-            raise IndexError(
-                f"The circuit you are using ({self.tw.circuit_string.get()}) have not been implemented."
-            )
-        # Return the created circuit handler
-        return circuit_handler
-    
     def update_normalize_params(self):
         '''
         If data is normalized, this function makes sure that the self.area_size-variable gets updated with the correct value.        
@@ -181,10 +122,26 @@ class interface():
             self.area_size = float(-1)
         self.area_str = 'cm^2'
 
-    def process(self):
+    def processing_settings(self, algorithm):
+        """Returns the settings the results of the algorithm ("circuit", "models", "DRT" or "Z_pred") depend on"""
+        settings = {'default_path': self.default_path, 'normalize': self.tw.normalize_checkbox_var.get()}
+        if algorithm == 'circuit':
+            settings['circuit_string'] = self.tw.circuit_string.get()
+        elif algorithm == 'models':
+            # The criterion is left out, as all the spectra are ranked again after every process
+            settings['circuit_strings'] = list(ch.IMPLEMENTED_CIRCUITS.keys())
+        else:
+            prefix = 'DRT_' if algorithm == 'DRT' else 'Z_pred_'
+            settings.update({name: value for name, value in vars(self).items() if name.startswith(prefix) and not name.endswith('_df')})
+        return settings
+
+    def process(self, incremental=False):
         '''
         Function that calls other functions (most of them located in fitting_algorithm.py) in order to perform the full retrieval and fitting of the data.
 
+        If incremental is True, as in the auto-run, only the spectra that are new or changed since
+        they were processed last, or processed with other settings, are fitted and predicted. The
+        results are merged into the circuit_df, model_df, DRT_df and Z_pred_df that are already there.
         '''
         self.tw.start['state'] = tk.DISABLED
         self.tw.start['bg']    = self.tw.text_disabled_color
@@ -193,8 +150,15 @@ class interface():
         self.all_data_files         = []
         self.all_data               = {}
         self.df                     = pd.DataFrame(data={})
-        self.circuit_df             = pd.DataFrame(data={})
-        self.circuit_base_variables = []
+        if not incremental:
+            self.circuit_df                 = pd.DataFrame(data={})
+            self.impedance_from_fitting_df  = pd.DataFrame(data={})
+            self.DRT_df                     = pd.DataFrame(data={})
+            self.Z_pred_df                  = pd.DataFrame(data={})
+            self.model_df                   = pd.DataFrame(data={})
+            self.circuit_base_variables     = []
+            self.manifest.clear()
+            self.run_cells = {}
         try:
             self.df= retrieve_data(self)        #
             print(f"self.df: {self.df}")
@@ -213,21 +177,71 @@ class interface():
         except:
             self.tw.log("process -> update_normalize_params: Unable to update the area_size-parameter.")
 
+        hashes = spectrum_hashes(self.df)
+        # The run and cell of each spectrum, the DRT and predicted impedances are stored by them. Removed
+        # spectra keep theirs, so their results can be removed
+        run_cells = self.df.drop_duplicates('path_to_file').set_index('path_to_file')[['dir_name', 'cell_name']]
+        self.run_cells.update({path: (dir_name, cell_name) for path, dir_name, cell_name in run_cells.itertuples()})
+
         if self.tw.circuit_fit_checkbox_var.get()  == 1:
+            settings = self.processing_settings('circuit')
+            changed = self.manifest.changed('circuit', hashes, settings)
+            removed = self.manifest.removed('circuit', hashes)
+            if incremental:
+                self.tw.log(f"Circuit-fitting {len(changed)} new or changed out of {len(hashes)} spectra.")
             try:
-                self.circuit_df, self.impedance_from_fitting_df, self.circuit_base_variables = fit_with_circuit(self, self.df)
+                circuit_df, impedance_from_fitting_df = None, None
+                if len(changed) > 0:
+                    circuit_df, impedance_from_fitting_df, self.circuit_base_variables = fit_with_circuit(self, self.df.loc[self.df['path_to_file'].isin(changed)])
+                self.circuit_df = replace_rows(self.circuit_df, circuit_df, changed + removed, ['path_to_file'])
+                self.impedance_from_fitting_df = replace_rows(self.impedance_from_fitting_df, impedance_from_fitting_df, changed + removed, ['path_to_file'])
+                if len(self.circuit_df) > 0:
+                    # The hours are counted from the first run of all the data, not only the new
+                    dates = pd.to_datetime(self.circuit_df['date'])
+                    self.circuit_df['hours_since_first_date'] = (dates - dates.min()).dt.total_seconds() / 3600
+                self.manifest.forget('circuit', removed)
+                # The spectra that could not be fitted have NaN rows and are fitted again next time
+                self.manifest.record('circuit', hashes, settings, with_results(changed, changed, circuit_df, ['path_to_file'], 'Chivalue'))
             except: 
                 self.tw.log("process -> fit_with_circuit: Unable to perform circuit-fitting.")
+        if self.tw.compare_circuits_checkbox_var.get() == 1:
+            settings = self.processing_settings('models')
+            changed = self.manifest.changed('models', hashes, settings)
+            removed = self.manifest.removed('models', hashes)
+            try:
+                model_df = compare_circuits(self, self.df.loc[self.df['path_to_file'].isin(changed)]) if len(changed) > 0 else None
+                self.model_df = rank_models(replace_rows(self.model_df, model_df, changed + removed, ['path_to_file']), self.tw.model_criterion.get())
+                self.manifest.forget('models', removed)
+                self.manifest.record('models', hashes, settings, with_results(changed, changed, model_df, ['path_to_file'], 'chiN', count=len(ch.IMPLEMENTED_CIRCUITS)))
+            except Exception as e:
+                print(f"Unexpected {e=}, {type(e)=}")
+                self.tw.log("process -> compare_circuits: Unable to compare the circuits.")
         if self.tw.DRT_fit_checkbox_var.get() == 1:
+            settings = self.processing_settings('DRT')
+            changed = self.manifest.changed('DRT', hashes, settings)
+            removed = self.manifest.removed('DRT', hashes)
             try:
-                self.DRT_df = fit_with_DRT(self, self.df)
+                DRT_df = fit_with_DRT(self, self.df.loc[self.df['path_to_file'].isin(changed)]) if len(changed) > 0 else None
+                self.DRT_df = replace_rows(self.DRT_df, DRT_df, [self.run_cells[path] for path in changed + removed], ['dir_name', 'cell_name'])
+                self.manifest.forget('DRT', removed)
+                self.manifest.record('DRT', hashes, settings, with_results(changed, [self.run_cells[path] for path in changed], DRT_df, ['dir_name', 'cell_name'], 'gamma_vec_star'))
             except Exception as e:
                 print(f"Unexpected {e=}, {type(e)=}")
                 self.tw.log("process -> fit_with_DRT: Unable to perform DRT-fitting.")
 
 
         if self.tw.Z_pred_checkbox_var.get() == 1:
-            self.Z_pred_df = predict_impedances(self, self.df)
+            settings = self.processing_settings('Z_pred')
+            changed = self.manifest.changed('Z_pred', hashes, settings)
+            removed = self.manifest.removed('Z_pred', hashes)
+            try:
+                Z_pred_df = predict_impedances(self, self.df.loc[self.df['path_to_file'].isin(changed)]) if len(changed) > 0 else None
+                self.Z_pred_df = replace_rows(self.Z_pred_df, Z_pred_df, [self.run_cells[path] for path in changed + removed], ['dir_name', 'cell_name'])
+                self.manifest.forget('Z_pred', removed)
+                self.manifest.record('Z_pred', hashes, settings, with_results(changed, [self.run_cells[path] for path in changed], Z_pred_df, ['dir_name', 'cell_name'], 'Z_re_vec_star'))
+            except Exception as e:
+                print(f"Unexpected {e=}, {type(e)=}")
+                self.tw.log("process -> predict_impedances: Unable to predict the impedances.")
 
         self.tw.use_prev_data_alert.grid_remove()
         self.tw.save_data.configure(bg=self.tw.red_button, text="SAVE")
@@ -243,13 +257,13 @@ class interface():
         When run it coninously watches the chosen data-folder. After the spesified waiting time, it will re-process the data.
         Note
         ----------
-        Could be massively improved by ONLY processing the new files that have not been previously processed. This is currently not implemented. 
+        Only the spectra that are new or changed since the last process are fitted, see process and processing_manifest.py.
         '''
         if self.auto_run_state: # It might be a problemt that the program freezes when performing calculations. Such that it is "impossible" to uncheck the auto-run-button.
             self.tw.auto_run_update_button['state'] = tk.DISABLED
             self.tw.auto_run_update_button['bg']    = self.tw.red_button
 
-            self.process() # Run the func
+            self.process(incremental=True) # Run the func, only for the new or changed spectra
             
             # If chosen in settings, also create new bokeh-plot
             if self.auto_run_plot: 
@@ -281,6 +295,11 @@ class interface():
         Utilizes functions and classed defined in the generate_bokeh file.
         """
 
+        from bokeh.models import CustomJS
+        from bokeh.plotting import output_file, save
+        from bokeh.io import show
+        import dependencies.generate_bokeh as gb
+
         self.tw.bokeh_output_file_name_button['bg'] = self.tw.browse_button_color # Resetting the color of the button that selects the filename
 
         #### Initializing the classes and relevant varianbles ####
@@ -17,7 +17,7 @@ Change window a to tk.Toplevel-window of the main window in control_GUI_with_FFT
 be opened through the main GUI window.
 
 Dependencies:
-The helper files eis_sample.py and GUI.py
+The helper files eis_sample.py, processing_engine.py and GUI.py
 The icon file "ife.ico", located in the same folder as the program
 Modules:
     numpy
@@ -41,9 +41,16 @@ import tkinter as tk
 from shutil import rmtree
 from watchdog.observers import Observer
 from watchdog.events import PatternMatchingEventHandler
-from dependencies.eis_sample import EIS_Sample
+from dependencies.eis_sample import EIS_Sample, ESTIMATORS
+from dependencies.processing_engine import ProcessingEngine, channel_pairs, process_channel
+from dependencies.live_plots import LiveImpedancePlots
+from dependencies.impedance_merge import ImpedanceMerger, active_channel_numbers
+from dependencies.impedance_store import ImpedanceStore
+from dependencies.watch_queue import WatchQueue
+from dependencies.processing_cache import ProcessingCache
+from dependencies.profiling import timed
 import time
-import re
+import queue
 import numpy as np
 
 
@@ -71,9 +78,10 @@ class Watchdog(PatternMatchingEventHandler, Observer):
             would mean that all are acted upon.
         - logfunc: function(str)
             A loging function that takes a string as input
-        - created: function(file_path)
+        - detected_file: function(file_path)
             The function that is called when a new file is detected. Should take
-            a file_path as input.
+            a file_path as input. It is called on the observer thread, so it
+            should return quickly and not touch tkinter.
 
         """
         PatternMatchingEventHandler.__init__(self, patterns=patterns)
@@ -85,6 +93,10 @@ class Watchdog(PatternMatchingEventHandler, Observer):
     def on_created(self, event):
         self.created(event.src_path)
 
+    def on_moved(self, event):
+        # The raw files are written to a temporary file and renamed when complete
+        self.created(event.dest_path)
+
 
 class Data_processor:
     def __init__(self,
@@ -103,6 +115,12 @@ class Data_processor:
         """
         # Watch and save default values
         self.watchdog = None
+        self.watch_queue = None
+        self.engine = None
+        self.polling = False
+        # Log messages from other threads, written to the messagebox by poll_engine
+        self.messages = queue.SimpleQueue()
+        self.ENGINE_POLL_MS = 50  # How often finished jobs are collected from the workers [ms]
         self.watch_path = "."
         self.save_path = "."
         self.temp_save_path = "temp_watch_impedance"
@@ -133,6 +151,7 @@ class Data_processor:
         self.BUTTON_HEIGHT_CHARACTERS = 1
         self.BUTTON_WIDTH_CHARACTERS = 20
         self.BUTTON_PAD_EXTRA = 10  # Extra padding for buttons to not overlap
+        self.FRAME_RATE = 10  # Maximum number of figure redraws per second
 
         # Derived constants
         self.FIGL_PIXELS = self.SCREENX // 3
@@ -165,7 +184,18 @@ class Data_processor:
 
         self.save_time_string = save_path
 
-        self.save_total_mm()
+        # Keeps the impedances processed in this window until they are merged
+        self.merger = ImpedanceMerger(self.save_metadata["selected_frequencies"], log=self.log)
+        # All the impedances of the run are appended to one store in the Total_mm folder
+        self.total_mm_path = os.path.join(os.path.dirname(__file__), "Total_mm", self.save_time_string)
+        self.store = ImpedanceStore(self.total_mm_path)
+        self.store.create(
+            self.save_time_string,
+            self.save_metadata,
+            active_channel_numbers(self.num_picoscopes, self.channels),
+        )
+        # Files processed before with the same settings are taken from the cache
+        self.cache = ProcessingCache(os.path.join(os.path.dirname(__file__), "Processing_cache"))
 
     def make_canvases(self) -> None:
         """Creates the Canvases for the interface"""
@@ -191,6 +221,11 @@ class Data_processor:
             num_vertical_subplots=2,
             sharex=True,
         )
+        # The figures are updated by appending to their artists, and redrawn at most FRAME_RATE times a second
+        self.live_plots = LiveImpedancePlots(
+            self.plot_canvas_nyquist, self.plot_canvas_bode, self.plot_canvas_fft
+        )
+        self.plot_scheduler = GUI_helper.PlotScheduler(self.nroot, self.FRAME_RATE)
 
     def make_buttons(self) -> None:
         """Creates the buttons for the interface"""
@@ -318,6 +353,53 @@ class Data_processor:
 
         self.filters[0].set("4.2")
 
+        # Number of worker processes used when processing the files already in the watch path
+        self.workers_inbox = GUI_helper.InboxPlace(
+            self.nroot,
+            "Worker processes",
+            2.3 * self.FIGL_PIXELS + self.BUTTON_WIDTH_PIXELS,
+            6 * self.BUTTON_HEIGHT_PIXELS,
+            self.BUTTON_WIDTH_CHARACTERS,
+            0,
+        )
+        self.workers_inbox.set(str(os.cpu_count() or 1))
+
+        # The impedances are always saved to the impedance store, the per frequency .mmfiles are
+        # still written by default, as before the store, and can be turned off
+        self.save_mmfiles = tk.IntVar()
+        self.save_mmfiles.set(1)
+        tk.Checkbutton(
+            self.nroot,
+            text="Save per frequency .mmfiles",
+            variable=self.save_mmfiles,
+            onvalue=1,
+            offvalue=0,
+        ).place(x=2.3 * self.FIGL_PIXELS + self.BUTTON_WIDTH_PIXELS, y=8 * self.BUTTON_HEIGHT_PIXELS)
+
+        # Dropdown menu to chose how the impedance is found, the sine fit allows short captures
+        self.estimator_name = tk.Label(self.nroot, text="Impedance estimator")
+        self.estimator_name.place(x=2.3 * self.FIGL_PIXELS + self.BUTTON_WIDTH_PIXELS, y=9 * self.BUTTON_HEIGHT_PIXELS)
+        self.estimator = tk.StringVar(self.nroot)
+        self.estimator.set(ESTIMATORS[0])
+        self.estimator_menu = tk.OptionMenu(self.nroot, self.estimator, *ESTIMATORS)
+        self.estimator_menu.place(
+            x=2.3 * self.FIGL_PIXELS + self.BUTTON_WIDTH_PIXELS,
+            y=10 * self.BUTTON_HEIGHT_PIXELS,
+            height=self.BUTTON_HEIGHT_PIXELS,
+            width=self.BUTTON_WIDTH_PIXELS,
+        )
+
+        # Converting each raw file once to a memory mapped .npy, so it is not parsed for every channel
+        self.memory_map = tk.IntVar()
+        self.memory_map.set(0)
+        tk.Checkbutton(
+            self.nroot,
+            text="Memory map raw files",
+            variable=self.memory_map,
+            onvalue=1,
+            offvalue=0,
+        ).place(x=2.3 * self.FIGL_PIXELS + self.BUTTON_WIDTH_PIXELS, y=11 * self.BUTTON_HEIGHT_PIXELS)
+
     def get_inbox_values(self) -> list:
         """
         Reads the values from the inboxes and returns a list of them.
@@ -346,6 +428,27 @@ class Data_processor:
         out.append(float(self.inboxes[5].get()))
         return out
 
+    def get_processing_settings(self) -> dict:
+        """
+        Reads the inboxes and the window function settings and returns them as
+        a dict that can be sent to the worker processes, see process_channel in
+        processing_engine.py.
+        """
+        parameters = self.get_inbox_values()
+        return {
+            "time_loc": parameters[0],
+            "voltage_locs": parameters[1],
+            "current_locs": parameters[2],
+            "voltage_prominence": parameters[3],
+            "current_prominence": parameters[4],
+            "correction_factor_current": parameters[5],
+            "filter_apply": self.applyfilter.get() == 1,
+            "filter_type": self.value_inside.get(),
+            "beta_factor": self.filters[0].get(),
+            "estimator": self.estimator.get(),
+            "memory_map": self.memory_map.get() == 1,
+        }
+
     def toggleFullScreen(self, event) -> None:
         """Function for toggeling fullscreen window"""
         self.fullScreenState = not self.fullScreenState
@@ -382,10 +485,14 @@ class Data_processor:
             if self.save_path == ".":
                 self.log("No save path selected!")
                 return
+            self.start_engine()
+            # The watchdog only puts new files in the queue, the dispatcher threads
+            # of the queue submit them to the engine when they are completely written
+            self.watch_queue = WatchQueue(max_in_flight=2 * self.engine.num_workers, log=self.messages.put)
             self.watchdog = Watchdog(
                 path=self.watch_path,
-                logfunc=self.log,
-                detected_file=lambda file_path: self.detected_file(self.save_path, file_path),
+                logfunc=self.messages.put,
+                detected_file=self.watch_queue.put,
             )
             self.watchdog.start()
             self.log("Watch started")
@@ -396,18 +503,14 @@ class Data_processor:
                 if os.path.isfile(os.path.join(self.watch_path, file))
                 and file[-4:] == ".txt"
             ]
-            # Sort them if possible
-            '''try:
-                file_paths_in_watch.sort(key=lambda f: int(f.split("_")[-1][:-4]))
-            except:
-                pass'''
+            # Files that are already queued by the watchdog are not processed twice
+            file_paths_in_watch = self.watch_queue.mark_seen(file_paths_in_watch)
             self.log(
                 "Starting to process existing files present in watch path and not in save path."
             )
-            for i, file_path in enumerate(file_paths_in_watch):
-                self.detected_file(self.save_path, file_path)
-                self.log(f"Done with {i+1} of {len(file_paths_in_watch)}")
-            self.log("Finished processing existing files.")
+            self.process_backlog(file_paths_in_watch)
+            self.watch_queue.start(self.submit_watched_file)
+            self.schedule_poll()
         else:
             self.log("Watch already started")
 
@@ -436,6 +539,14 @@ class Data_processor:
             self.log("Watch stopped")
         else:
             self.log("Watch is already not running")
+        if self.watch_queue is not None:
+            self.watch_queue.stop()
+            self.watch_queue = None
+        if self.engine is not None:
+            if self.engine.busy():
+                self.log("Cancelling the files that are not yet processed")
+            self.engine.shutdown()
+            self.engine = None
 
         self.log(f"Processing complete at {time.time()}")
         self.save_total_mm()
@@ -476,6 +587,7 @@ class Data_processor:
         else:
             self.log("Watch activated, turn of to use single file.")
 
+    @timed
     def detected_file(self, save_path : str, file_path : str) -> None:
         """
         Parameters:
@@ -490,14 +602,10 @@ class Data_processor:
         Does:
         ----------
         The function is called each time a file is found and should be procesed.
-        If the file that is found already has a save file it will ask a question
-        wheater or not is should be overwritten. If the answer is yes, or no file
-        already exsists. It will call the watch_call method from eis_sample.py
-        with the parameters from the inboxes. If it detects that there are multiple
-        instanses of voltace indexes one call to watch_call will be done for each
-        and the saved files will be tagged with what index they correspond to.
-        The impedance data calculated in the watch_call will be displayed in
-        the figures (nyquist, bode and fft_spectrum).
+        It processes the file with the parameters from the inboxes, once for each
+        voltage index, and saves the result with save_sample, tagged with what
+        index it corresponds to. The impedance data calculated will be displayed
+        in the figures (nyquist, bode and fft_spectrum).
         """
         # Logging that a file is found
         self.log(f"Detected the file\n {os.path.basename(file_path)}")
@@ -507,56 +615,168 @@ class Data_processor:
         self.log(f"Frequency now is: {frequency_now} Hz")
 
         # getting the parameters from the inboxes
-        parameters = self.get_inbox_values()
-        if self.applyfilter.get() == 1:
-            self.filter_apply = True
-        else:
-            self.filter_apply = False
-
-        self.filter_type= self.value_inside.get()
-        self.beta_factor= self.filters[0].get()
+        settings = self.get_processing_settings()
 
+        # Found once for all the voltage indicies, as it may read the whole file
+        fingerprint = self.cache.fingerprint(file_path)
         # Loops through the different voltage indicies if several
-        for current_loc in parameters[2]:
-            for voltage_loc in range(current_loc+1, current_loc+4):
-                if voltage_loc in parameters[1]:
-                    self.log(f"Processing for current location: {current_loc}")
-                    self.log(f"and voltage location: {voltage_loc}")
-
-                    sample = EIS_Sample.watch_call(
-                        file_path,
-                        save_path,
-                        time_loc=parameters[0],
-                        voltage_loc=voltage_loc,
-                        current_loc=current_loc,
-                        voltage_prominence=parameters[3],
-                        current_prominence=parameters[4],
-                        correction_factor_current=parameters[5],
-                        add_loc_save=True,
-                        filter_apply=self.filter_apply,
-                        filter_type=self.filter_type,
-                        beta_factor=self.beta_factor,
-                    )
-                    # Log that this file and index is finished
-                    self.log(
-                        f"Successfully saved and processed data from voltage index {voltage_loc}."
-                    )
-                    
-                    # Plot to the different figures
-                    self.plot_canvas_nyquist.clear()
-                    sample.plot_nyquist_canvas(self.plot_canvas_nyquist)
-                    self.plot_canvas_nyquist.update()
-
-                    self.plot_canvas_bode.clear()
-                    sample.plot_bode_canvas(self.plot_canvas_bode)
-                    self.plot_canvas_bode.update()
-
-                    self.plot_canvas_fft.clear()
-                    sample.plot_fft_spectrum_canvas(self.plot_canvas_fft)
-                    self.plot_canvas_fft.update()
-                    # Update the window so all changes are visible
-                    self.nroot.update()
-                    
+        for current_loc, voltage_loc in channel_pairs(settings["current_locs"], settings["voltage_locs"]):
+            self.log(f"Processing for current location: {current_loc}")
+            self.log(f"and voltage location: {voltage_loc}")
+
+            sample = self.cache.process(file_path, settings, current_loc, voltage_loc, process_channel, fingerprint)
+            self.save_sample(save_path, file_path, voltage_loc, sample)
+            # Log that this file and index is finished
+            self.log(
+                f"Successfully saved and processed data from voltage index {voltage_loc}."
+            )
+            self.show_sample(sample, voltage_loc)
+
+        self.file_finished()
+
+    @timed
+    def save_sample(self, save_path : str, file_path : str, voltage_loc : int, sample : EIS_Sample) -> None:
+        """
+        Parameters:
+        ----------
+        - save_path: str
+            The folder the .mmfile is saved to
+        - file_path: str
+            The raw file the sample is made from
+        - voltage_loc: int
+            The voltage index of the sample
+        - sample: EIS_Sample
+            The processed sample
+
+        Does:
+        ----------
+        If the sample belongs to the run of the window it is appended to the impedance
+        store and kept for the merge, and the per frequency .mmfile is only written if
+        the checkbox is checked. Otherwise, as for single files, the .mmfile is written.
+        """
+        full_save_path = EIS_Sample.get_full_save_path(save_path, file_path, voltage_loc, True)
+        if save_path != self.save_path:
+            sample.save_to_MMFILE(full_save_path)
+            return
+        self.store.append_sample(sample, voltage_loc, file_path)
+        self.merger.add(voltage_loc, sample.fft_frequencies, sample.impedance, save_path=full_save_path)
+        if self.save_mmfiles.get() == 1:
+            sample.save_to_MMFILE(full_save_path)
+
+    def start_engine(self) -> None:
+        """
+        Makes the ProcessingEngine with the number of worker processes given in the
+        inbox, and takes a copy of the processing parameters. The copy is used for
+        all the files processed until the watch is stopped, since the inboxes can
+        only be read from the tkinter thread.
+        """
+        self.settings = self.get_processing_settings()
+        self.pairs = channel_pairs(self.settings["current_locs"], self.settings["voltage_locs"])
+        try:
+            num_workers = int(float(self.workers_inbox.get()))
+        except ValueError:
+            num_workers = None
+        if self.engine is None:
+            self.engine = ProcessingEngine(num_workers, cache=self.cache)
+        self.backlog_files = set()
+        self.backlog_size = 0
+        self.backlog_done = 0
+
+    def process_backlog(self, file_paths : list[str]) -> None:
+        """
+        Parameters:
+        ----------
+        - file_paths: list of str
+            The raw data files that should be processed
+
+        Does:
+        ----------
+        Sends the files to the ProcessingEngine, with one job per file and channel pair.
+        The results are collected by poll_engine, which is run by tkinter, so the
+        window stays responsive while the workers are busy.
+        """
+        if len(file_paths) == 0:
+            self.log("Finished processing existing files.")
+            return
+        self.log(f"Processing {len(file_paths)} files with {self.engine.num_workers} workers")
+
+        self.backlog_files = set(file_paths)
+        self.backlog_size = len(file_paths)
+        self.backlog_done = 0
+        for file_path in file_paths:
+            self.engine.submit_file(file_path, self.settings, self.pairs)
+
+    def submit_watched_file(self, file_path : str) -> None:
+        """
+        Called by the dispatcher threads of the watch queue when a new file is
+        completely written. Only submits the file to the engine, the results are
+        handled by poll_engine on the tkinter thread.
+        """
+        self.messages.put(f"Detected the file\n {os.path.basename(file_path)}")
+        self.engine.submit_file(file_path, self.settings, self.pairs)
+
+    def schedule_poll(self) -> None:
+        """Starts the poll_engine loop if it is not already running"""
+        if not self.polling:
+            self.polling = True
+            self.nroot.after(self.ENGINE_POLL_MS, self.poll_engine)
+
+    @timed
+    def poll_engine(self) -> None:
+        """
+        When
+        ----------
+        Scheduled by start_processing and by itself as long as the watch is running
+        or the engine has jobs.
+
+        Does
+        ----------
+        Writes the log messages from the other threads to the messagebox. Collects
+        the finished jobs from the engine in the order they finished, saves the
+        impedance of each and shows it in the figures.
+        """
+        self.polling = False
+        while True:
+            try:
+                message = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            self.log(message)
+        if self.engine is None:
+            return
+        for result in self.engine.collect():
+            file_name = os.path.basename(result["file_path"])
+            if result["error"] is not None:
+                self.log(f"Failed processing {file_name} for voltage index {result['voltage_loc']}: {result['error']}")
+            else:
+                self.save_sample(self.save_path, result["file_path"], result["voltage_loc"], result["sample"])
+                self.log(f"Successfully saved and processed {file_name} for voltage index {result['voltage_loc']}.")
+                self.show_sample(result["sample"], result["voltage_loc"])
+            if result["file_done"]:
+                if result["file_path"] in self.backlog_files:
+                    self.backlog_done += 1
+                    self.log(f"Done with {self.backlog_done} of {self.backlog_size}")
+                    if self.backlog_done == self.backlog_size:
+                        self.log("Finished processing existing files.")
+                elif self.watch_queue is not None:
+                    self.watch_queue.done(result["file_path"])
+                self.file_finished()
+                if self.engine is None:
+                    return
+
+        if self.engine.busy() or self.watchdog is not None:
+            self.schedule_poll()
+
+    def show_sample(self, sample : EIS_Sample, voltage_loc : int) -> None:
+        """
+        Adds a processed sample to the figures. The drawing itself is left to the
+        plot scheduler, so several samples processed close in time give one redraw.
+        """
+        self.live_plots.add_sample(sample, voltage_loc)
+        self.plot_scheduler.request("live_plots", self.live_plots.draw)
+
+    def file_finished(self) -> None:
+        """Counts a finished file and stops the processing when all frequencies are done"""
         self.files_processed += 1
         if self.files_processed ==  self.num_freqs:
             self.stop_processing()
@@ -604,119 +824,25 @@ class Data_processor:
         except Exception as e:
             print(f"Detected exception: {e}")
 
+    @timed
     def save_total_mm(self) -> None:
+        """
+        Merges the impedances of the run into Total_mm, see impedance_merge.py. The
+        impedances processed in this window are already in memory, so only the ones
+        from earlier sessions are read from the impedance store, or from the save
+        folder for runs processed before the store was used.
+        """
         merge_start = time.time()
         self.log("\nStart merging to one .mmfile.")
 
-        # Make unique folder with timestamp as filename such that all measurements can be saved when run one after the other
-        parent_dir = os.path.dirname(__file__)
-        sub_path = os.path.join(parent_dir, "Total_mm")
-        path = os.path.join(sub_path, self.save_time_string)
-        os.mkdir(path) 
-
-        
-        selected_frequencies = self.save_metadata["selected_frequencies"].split(",")
-        
-        range_of_freqs = []
-        for frequency in selected_frequencies:
-            range_of_freqs.append(float(frequency))
-
-        # Correctly identifies channels that are used for potential measurements, and not all channels
-        for picoscope_index in range(self.num_picoscopes):
-            for channel_index in range(1,4):
-                if(self.channels[picoscope_index][channel_index]):
-                    make_file = False
-                    for filename in os.listdir(f"Save_folder\\{self.save_time_string}"):
-                        num = re.findall(r'\d+', filename)
-                        #f = os.path.join("Save_folder",filename)
-                        if int(float(num[-1])) == 4*picoscope_index + channel_index + 1:
-                            make_file=True
-
-                    # If the channel is found, it will merge all files ending in the right integer into a single .mmfile. We want this corrected to sort in order from high to low.
-                    if make_file == True:    
-                        fil = open(f"Total_mm\\{self.save_time_string}\\total_mmfile_{4*picoscope_index + channel_index + 1}.mmfile", "w")
-
-                        fil.write("Frequency\tReal\tImaginary\n")
-                        data_all = []
-                        for filename in os.listdir(f"Save_folder\\{self.save_time_string}"):
-                            num = re.findall(r'\d+', filename)
-                            f = os.path.join(f"Save_folder\\{self.save_time_string}",filename)
-                            if int(float(num[-1])) == 4*picoscope_index + channel_index + 1:
-                                tiny_file = open(f,"r")
-                                lines = tiny_file.readlines()
-                                length = len(lines)
-                                if length == 2:
-                                    line = lines[-1]
-                                    data_all.append(line + "\n")
-                                    #fil.write(line + "\n")
-                                elif length == 1:
-                                    self.log(f"File {f} do not have any values.")
-                                else:
-                                    self.log(f"File {f} has more than 1 line with values. The number of peaks are {length-1}. All will be added to the merged file.")
-                                    for p in range(1,length):
-                                        line = lines[p]
-                                        data_all.append(line + "\n")
-                                        #fil.write(line + "\n")
-
-                                tiny_file.close()
-                            
-                        #contents = fil.readlines()
-                        def my_sort(line):
-                            line_fields = line.strip().split('\t')
-                            amount = float(line_fields[0])
-                            return amount
-
-                        data_all.sort(key=my_sort)
-                        f_from_FFT = []
-                        Z_values_from_FFT = []
-                        
-                        for k in range(1, len(data_all)):
-                            line_fields = data_all[k].strip().split('\t')
-                            f_from_FFT.append(float(line_fields[0]))
-                            Z_value_now = complex(float(line_fields[1]),float(line_fields[2]))
-                            Z_values_from_FFT.append(Z_value_now)
-                        
-                        # Transforming the arrays to the correctd format
-                        f_from_FFT = np.array(f_from_FFT)
-                        Z_values_from_FFT = np.array(Z_values_from_FFT)
-                        self.log("f_from_FFT is: " + str(f_from_FFT))
-                        self.log("Z_values_from_FFT is: " + str(Z_values_from_FFT))
-                        """
-                        M, mu, Z_linKK, res_real, res_imag = linKK(f_from_FFT, Z_values_from_FFT, c=.85, max_M=100, fit_type='complex', add_cap=False)
-                        print("M value is :" + str(M))
-                        print("mu value is :" + str(mu))
-                        print("Z lin kk array is :" + str(Z_linKK))
-                        print("res_real array is :" + str(res_real))
-                        print("res_imag array is :" + str(res_imag))
-                        """
-
-
-
-                        for line_index in range(len(data_all)):
-                            line = data_all[line_index]
-                            linesplit = float(line.split("\t")[0])
-                            for frequency_index in range(self.num_freqs):
-                                if abs((linesplit-float(range_of_freqs[frequency_index]))/linesplit) < 0.1: # How much do we let the frequency miss by?
-                            # Criteria for K-K, that the real residual is less than 10%. For now this function is basically turned off
-                            #if abs(res_real[p-1]) < 1:
-                                    fil.write(line)
-
-                        fil.close()
-                        self.log(f"Made .mm file for pico: {picoscope_index} channel: {channel_index}")
-            
-        # Generate the Parameters.txt file that helps for plotting
-        fil = open(f"Total_mm\\{self.save_time_string}\\Parameters.txt","w")
-
-        fil.write(f"Date:\t{self.save_time_string[:10]}\n")
-        fil.write(f"Time:\t{self.save_time_string[11:]}\n\n")
-
-        fil.write(f"Cell numbers:\t{self.save_metadata["cell_numbers"]}\n")
-        fil.write(f"Area:\t{self.save_metadata["area"]}\n")
-        fil.write(f"Temperature:\t{self.save_metadata["temperature"]}\n")
-        fil.write(f"Pressure:\t{self.save_metadata["pressure"]}\n")
-        fil.write(f"DC current:\t{self.save_metadata["DC_current"]}\n")
-        fil.write(f"AC current:\t{self.save_metadata["AC_current"]}\n")
-        fil.close()
+        self.store.add_to(self.merger)
+        self.merger.add_folder(os.path.join("Save_folder", self.save_time_string))
+        self.merger.write(
+            self.total_mm_path,
+            self.save_time_string,
+            self.save_metadata,
+            channel_numbers=active_channel_numbers(self.num_picoscopes, self.channels),
+        )
 
         self.log(f"Done creating merged .mmfile after\n\t{(time.time() - merge_start):.2f} s.\n")
 
@@ -28,8 +28,10 @@ import time
 import pandas as pd         # For sorting file structure
 import matplotlib.pyplot as plt
 import tkinter as tk
+from dependencies.profiling import timed
 
 
+@timed
 def fit_data(interface, frequencies, realvalues, imaginaryvalues): 
     '''
     Calculates the DRT-distribution using the dependencies.GP_DRT.
@@ -51,7 +53,6 @@ def fit_data(interface, frequencies, realvalues, imaginaryvalues):
     Z_exp = realvalues+1j*imaginaryvalues
 
     # define the frequency range
-    N_freqs = len(freq_vec)
     xi_vec  = np.log(freq_vec)
     tau     = 1/freq_vec
 
@@ -82,67 +83,11 @@ def fit_data(interface, frequencies, realvalues, imaginaryvalues):
     # Collect the optimized parameters
     sigma_n, sigma_f, ell = res.x
 
-    ### Compute matrices ###
-    # calculate the matrices shown in eq (18)
-    K = dependencies.GP_DRT.matrix_K(xi_vec, xi_vec, sigma_f, ell)
-    L_im_K = dependencies.GP_DRT.matrix_L_im_K(xi_vec, xi_vec, sigma_f, ell)
-    L2_im_K = dependencies.GP_DRT.matrix_L2_im_K(xi_vec, xi_vec, sigma_f, ell)
-    Sigma = (sigma_n**2)*np.eye(N_freqs)
-
-
-    ### Factorize the matrices and solve the linear equations ###
-    # the matrix $\mathcal L^2_{\rm im} \mathbf K + \sigma_n^2 \mathbf I$ whose inverse is needed
-    K_im_full = L2_im_K + Sigma
-
-    # check if the K_im_full is positive definite, otherwise, a nearest one would replace the K_im_full
-    if not dependencies.GP_DRT.is_PD(K_im_full):
-        K_im_full = dependencies.GP_DRT.nearest_PD(K_im_full)
-
-    # Cholesky factorization, L is a lower-triangular matrix
-    L = np.linalg.cholesky(K_im_full)
-
-    # solve for alpha
-    alpha = np.linalg.solve(L, Z_exp.imag)
-    alpha = np.linalg.solve(L.T, alpha)
-
-    # estimate the gamma of eq (21a)
-    # gamma_fct_est = np.dot(L_im_K, alpha)
-
-    # covariance matrix
-    inv_L = np.linalg.inv(L)
-    inv_K_im_full = np.dot(inv_L.T, inv_L)
-
-    # estimate the sigma of gamma for eq (21b)
-    # cov_gamma_fct_est = K - np.dot(L_im_K, np.dot(inv_K_im_full, L_im_K.T))
-    # sigma_gamma_fct_est = np.sqrt(np.diag(cov_gamma_fct_est))
-
     ### Predict the imaginary part of the GP-DRT and impedance ###
-    # initialize the imaginary part of impedance vector
-    Z_im_vec_star = np.empty_like(xi_vec_star)
-    Sigma_Z_im_vec_star = np.empty_like(xi_vec_star)
-
-    gamma_vec_star = np.empty_like(xi_vec_star)
-    Sigma_gamma_vec_star = np.empty_like(xi_vec_star)
-
-    # calculate the imaginary part of impedance at each $\xi$ point for the plot
-    for index, val in enumerate(xi_vec_star):
-        xi_star = np.array([val])
-
-        # compute matrices shown in eq (18), xi_star corresponds to a new point
-        # k_star = dependencies.GP_DRT.matrix_K(xi_vec, xi_star, sigma_f, ell)
-        L_im_k_star_up = dependencies.GP_DRT.matrix_L_im_K(xi_star, xi_vec, sigma_f, ell)
-        L2_im_k_star = dependencies.GP_DRT.matrix_L2_im_K(xi_vec, xi_star, sigma_f, ell)
-        k_star_star = dependencies.GP_DRT.matrix_K(xi_star, xi_star, sigma_f, ell)
-        # L_im_k_star_star = dependencies.GP_DRT.matrix_L_im_K(xi_star, xi_star, sigma_f, ell)
-        L2_im_k_star_star = dependencies.GP_DRT.matrix_L2_im_K(xi_star, xi_star, sigma_f, ell)
-
-        # compute Z_im_star mean and standard deviation using eq (26)
-        Z_im_vec_star[index] = np.dot(L2_im_k_star.T, np.dot(inv_K_im_full, Z_exp.imag))
-        Sigma_Z_im_vec_star[index] = L2_im_k_star_star - np.dot(L2_im_k_star.T, np.dot(inv_K_im_full, L2_im_k_star))
-
-        # compute gamma_star mean and standard deviation using eq (29)
-        gamma_vec_star[index] = np.dot(L_im_k_star_up, np.dot(inv_K_im_full, Z_exp.imag))
-        Sigma_gamma_vec_star[index] = k_star_star - np.dot(L_im_k_star_up, np.dot(inv_K_im_full, L_im_k_star_up.T))
+    # compute Z_im_star mean and standard deviation using eq (26), and gamma_star mean and standard deviation
+    # using eq (29), for all the points in xi_vec_star at once, see predict_star in GP_DRT.py
+    Z_im_vec_star, Sigma_Z_im_vec_star, gamma_vec_star, Sigma_gamma_vec_star = dependencies.GP_DRT.predict_star(
+        xi_vec, xi_vec_star, Z_exp, sigma_n, sigma_f, ell)
 
 
     
@@ -156,6 +101,7 @@ def fit_data(interface, frequencies, realvalues, imaginaryvalues):
     # return freq_vec_star, gamma_vec_star, Sigma_gamma_vec_star, gamma_vec_star-3*np.sqrt(abs(Sigma_gamma_vec_star)), gamma_vec_star+3*np.sqrt(abs(Sigma_gamma_vec_star))
     return freq_vec_star, gamma_vec_star, Sigma_gamma_vec_star, error_lower, error_upper
 
+@timed
 def predict_impedance_DRT_calculation(interface, frequencies, realvalues, imaginaryvalues, min_factor, max_factor, num = 100): 
     '''
     The calculation of the DRT-dist that is used in the prediction of the impedances. Called by the predict_impedance-func.
@@ -177,7 +123,6 @@ def predict_impedance_DRT_calculation(interface, frequencies, realvalues, imagin
     Z_exp = realvalues+1j*imaginaryvalues
 
     # define the frequency range
-    N_freqs = len(freq_vec)
     xi_vec  = np.log(freq_vec)
     tau     = 1/freq_vec
 
@@ -213,64 +158,11 @@ def predict_impedance_DRT_calculation(interface, frequencies, realvalues, imagin
     # Collect the optimized parameters
     sigma_n, sigma_f, ell = res.x
 
-    # calculate the matrices shown in eq (18)
-    K = dependencies.GP_DRT.matrix_K(xi_vec, xi_vec, sigma_f, ell)
-    L_im_K = dependencies.GP_DRT.matrix_L_im_K(xi_vec, xi_vec, sigma_f, ell)
-    L2_im_K = dependencies.GP_DRT.matrix_L2_im_K(xi_vec, xi_vec, sigma_f, ell)
-    Sigma = (sigma_n**2)*np.eye(N_freqs)
-
-    # the matrix $\mathcal L^2_{\rm im} \mathbf K + \sigma_n^2 \mathbf I$ whose inverse is needed
-    K_im_full = L2_im_K + Sigma
-
-    # check if the K_im_full is positive definite, otherwise, a nearest one would replace the K_im_full
-    if not dependencies.GP_DRT.is_PD(K_im_full):
-        K_im_full = dependencies.GP_DRT.nearest_PD(K_im_full)
-
-    # Cholesky factorization, L is a lower-triangular matrix
-    L = np.linalg.cholesky(K_im_full)
-
-    # solve for alpha
-    alpha = np.linalg.solve(L, Z_exp.imag)
-    alpha = np.linalg.solve(L.T, alpha)
-
-    # estimate the gamma of eq (21a)
-    gamma_fct_est = np.dot(L_im_K, alpha)
-
-    # covariance matrix
-    inv_L = np.linalg.inv(L)
-    inv_K_im_full = np.dot(inv_L.T, inv_L)
-
-    # estimate the sigma of gamma for eq (21b)
-    cov_gamma_fct_est = K - np.dot(L_im_K, np.dot(inv_K_im_full, L_im_K.T))
-    # sigma_gamma_fct_est = np.sqrt(np.diag(cov_gamma_fct_est))
-
-
-    # initialize the imaginary part of impedance vector
-    Z_im_vec_star = np.empty_like(xi_vec_star)
-    Sigma_Z_im_vec_star = np.empty_like(xi_vec_star)
-
-    gamma_vec_star = np.empty_like(xi_vec_star)
-    Sigma_gamma_vec_star = np.empty_like(xi_vec_star)
-
-    # calculate the imaginary part of impedance at each $\xi$ point for the plot
-    for index, val in enumerate(xi_vec_star):
-        xi_star = np.array([val])
-
-        # compute matrices shown in eq (18), xi_star corresponds to a new point
-        k_star = dependencies.GP_DRT.matrix_K(xi_vec, xi_star, sigma_f, ell)
-        L_im_k_star_up = dependencies.GP_DRT.matrix_L_im_K(xi_star, xi_vec, sigma_f, ell)
-        L2_im_k_star = dependencies.GP_DRT.matrix_L2_im_K(xi_vec, xi_star, sigma_f, ell)
-        k_star_star = dependencies.GP_DRT.matrix_K(xi_star, xi_star, sigma_f, ell)
-        L_im_k_star_star = dependencies.GP_DRT.matrix_L_im_K(xi_star, xi_star, sigma_f, ell)
-        L2_im_k_star_star = dependencies.GP_DRT.matrix_L2_im_K(xi_star, xi_star, sigma_f, ell)
-
-        # compute Z_im_star mean and standard deviation using eq (26)
-        Z_im_vec_star[index] = np.dot(L2_im_k_star.T, np.dot(inv_K_im_full, Z_exp.imag))
-        Sigma_Z_im_vec_star[index] = L2_im_k_star_star - np.dot(L2_im_k_star.T, np.dot(inv_K_im_full, L2_im_k_star))
+    # compute Z_im_star mean and standard deviation using eq (26), and gamma_star mean and standard deviation
+    # using eq (29), for all the points in xi_vec_star at once, see predict_star in GP_DRT.py
+    Z_im_vec_star, Sigma_Z_im_vec_star, gamma_vec_star, Sigma_gamma_vec_star = dependencies.GP_DRT.predict_star(
+        xi_vec, xi_vec_star, Z_exp, sigma_n, sigma_f, ell)
 
-        # compute gamma_star mean and standard deviation using eq (29)
-        gamma_vec_star[index] = np.dot(L_im_k_star_up, np.dot(inv_K_im_full, Z_exp.imag))
-        Sigma_gamma_vec_star[index] = k_star_star - np.dot(L_im_k_star_up, np.dot(inv_K_im_full, L_im_k_star_up.T))
 
 
 
@@ -284,6 +176,7 @@ def predict_impedance_DRT_calculation(interface, frequencies, realvalues, imagin
 
     return freq_vec_star, -Z_im_vec_star, error_lower, error_upper, min_val, max_val
 
+@timed
 def predict_impedance(interface, frequencies, realvalues, imaginaryvalues): 
     '''
     Func used when predicting the impedances. First estimates the imaginary part of the impedance using the DRT, them the real part using Kramers-kronig.
@@ -20,9 +20,12 @@ Created on Tue Dec 10 2019
 from math import exp
 from math import pi
 from math import log
-from scipy import integrate
 import numpy as np
 from numpy import linalg as la
+from scipy.linalg import solve_triangular
+from dependencies.profiling import timed
+from dependencies import kernel_quadrature
+from dependencies import kernel_tables
 
 
 # is a matrix positive definite?
@@ -73,6 +76,9 @@ def kernel(xi, xi_prime, sigma_f, ell):
     return (sigma_f**2)*exp(-0.5/(ell**2)*((xi-xi_prime)**2))
 
 
+# the integrands below are integrated by kernel_quadrature.py, which evaluates the same functions
+# for all $\Delta\xi$ at once, and they are kept here as the reference for it
+
 # the function to be integrated in eq (65) of the main text.
 # $\frac{\displaystyle e^{\Delta\xi_{mn}-\chi}}{1+\left(\displaystyle e^{\Delta\xi_{mn}-\chi}\right)^2} \frac{k(\chi)}{\sigma_f^2}$
 def integrand_L_im(x, delta_xi, sigma_f, ell):
@@ -122,84 +128,26 @@ def integrand_der_ell_L2_im(x, xi, xi_prime, sigma_f, ell):
     return numerator/denominator
 
 # assemble the covariance matrix K as shown in eq (18a), which calculates the kernel distance between $\xi_n$ and $\xi_m$
+@timed
 def matrix_K(xi_n_vec, xi_m_vec, sigma_f, ell):
-    N_n_freqs = xi_n_vec.size
-    N_m_freqs = xi_m_vec.size
-    K = np.zeros([N_n_freqs, N_m_freqs])
-
-    for n in range(0, N_n_freqs):
-        for m in range(0, N_m_freqs):
-            K[n,m] = kernel(xi_n_vec[n], xi_m_vec[m], sigma_f, ell)
-    return K
+    delta_xi = np.ravel(xi_n_vec)[:, np.newaxis] - np.ravel(xi_m_vec)[np.newaxis, :]
+    return (sigma_f**2)*np.exp(-0.5/(ell**2)*(delta_xi**2))
 
 
 # assemble the matrix of eq (18b), added the term of $\frac{1}{\sigma_f^2}$ and factor $2\pi$ before $e^{\Delta\xi_{mn}-\chi}$
+# the integrals of integrand_L_im are computed for all $\Delta\xi_{mn}$ at once, interpolated from a table, see kernel_tables.py
+@timed
 def matrix_L_im_K(xi_n_vec, xi_m_vec, sigma_f, ell):
-
-    if np.array_equal(xi_n_vec, xi_m_vec):
-        # considering the case that $\xi_n$ and $\xi_m$ are identical, i.e., the matrix is square symmetrix
-        xi_vec = xi_n_vec
-        N_freqs = xi_vec.size
-        L_im_K = np.zeros([N_freqs, N_freqs])
-
-        delta_xi = log(2*pi)
-        integral, tol = integrate.quad(integrand_L_im, -np.inf, np.inf, epsabs=1E-12, epsrel=1E-12, args=(delta_xi, sigma_f, ell))
-        np.fill_diagonal(L_im_K, -(sigma_f**2)*(integral))
-
-        for n in range(1, N_freqs):
-            delta_xi = xi_vec[n]-xi_vec[0] + log(2*pi)
-            integral, tol = integrate.quad(integrand_L_im, -np.inf, np.inf, epsabs=1E-12, epsrel=1E-12, args=(delta_xi, sigma_f, ell))
-            np.fill_diagonal(L_im_K[:, n:], -(sigma_f**2)*(integral))
-            
-            delta_xi = xi_vec[0]-xi_vec[n] + log(2*pi)
-            integral, tol = integrate.quad(integrand_L_im, -np.inf, np.inf, epsabs=1E-12, epsrel=1E-12, args=(delta_xi, sigma_f, ell))
-            np.fill_diagonal(L_im_K[n:, :], -(sigma_f**2)*(integral))
-    else:
-        N_n_freqs = xi_n_vec.size
-        N_m_freqs = xi_m_vec.size
-        L_im_K = np.zeros([N_n_freqs, N_m_freqs])
-
-        for n in range(0, N_n_freqs):
-            for m in range(0, N_m_freqs):
-
-                delta_xi = xi_m_vec[m] - xi_n_vec[n] + log(2*pi)
-                integral, tol = integrate.quad(integrand_L_im, -np.inf, np.inf, epsabs=1E-12, epsrel=1E-12, args=(delta_xi, sigma_f, ell))
-                L_im_K[n,m] = -(sigma_f**2)*(integral)
-
-    return L_im_K
+    integrals = kernel_quadrature.pairwise(kernel_tables.integrals("L_im"), xi_n_vec, xi_m_vec, ell, shift=log(2*pi))
+    return -(sigma_f**2)*integrals
 
 
 # assemble the matrix of eq (18d), added the term of $\frac{1}{\sigma_f^2}$ and factor $2\pi$ before $e^{\Delta\xi_{mn}-\chi}$
+# the integrals of integrand_L2_im are computed for all $\Delta\xi_{mn}$ at once, interpolated from a table, see kernel_tables.py
+@timed
 def matrix_L2_im_K(xi_n_vec, xi_m_vec, sigma_f, ell):
-
-    if np.array_equal(xi_n_vec, xi_m_vec):
-        # considering the case that $\xi_n$ and $\xi_m$ are identical, i.e., the matrix is square symmetric
-        xi_vec = xi_n_vec
-        N_freqs = xi_vec.size
-
-        L2_im_K = np.zeros([N_freqs, N_freqs])
-        
-        for n in range(0, N_freqs):
-            xi = xi_vec[n]
-            xi_prime = xi_vec[0]
-            integral, tol = integrate.quad(integrand_L2_im, -np.inf, np.inf, epsabs=1E-12, epsrel=1E-12, args=(xi, xi_prime, sigma_f, ell))
-            if n == 0:
-                np.fill_diagonal(L2_im_K, (sigma_f**2)*integral)
-            else:
-                np.fill_diagonal(L2_im_K[n:, :], (sigma_f**2)*integral)
-                np.fill_diagonal(L2_im_K[:, n:], (sigma_f**2)*integral)
-    else:
-        N_n_freqs = xi_n_vec.size
-        N_m_freqs = xi_m_vec.size
-        L2_im_K = np.zeros([N_n_freqs, N_m_freqs])
-
-        for n in range(0, N_n_freqs):
-            xi = xi_n_vec[n]
-            for m in range(0, N_m_freqs):
-                xi_prime = xi_m_vec[m]
-                integral, tol = integrate.quad(integrand_L2_im, -np.inf, np.inf, epsabs=1E-12, epsrel=1E-12, args=(xi, xi_prime, sigma_f, ell))
-                L2_im_K[n,m] = (sigma_f**2)*integral
-    return L2_im_K
+    integrals = kernel_quadrature.pairwise(kernel_tables.integrals("L2_im"), xi_n_vec, xi_m_vec, ell)
+    return (sigma_f**2)*integrals
 
 def compute_h_L(xi):
 
@@ -210,6 +158,7 @@ def compute_h_L(xi):
 
 
 # calculate the negative marginal log-likelihood (NMLL) of eq (31)
+@timed
 def NMLL_fct(theta, Z_exp, xi_vec):
     # load the initial value for parameters needed to optimize
     sigma_n = theta[0]
@@ -268,19 +217,11 @@ def NMLL_fct_L(theta, Z_exp, xi_vec):
 
 # assemble the matrix corresponding to the derivative of eq (18d) with respect to $\ell$, similar to the above implementation 
 def der_ell_matrix_L2_im_K(xi_vec, sigma_f, ell):
-    N_freqs = xi_vec.size
-    der_ell_L2_im_K = np.zeros([N_freqs, N_freqs])
-
-    for n in range(0, N_freqs):
-        xi = xi_vec[n]
-        xi_prime = xi_vec[0]
-        integral, tol = integrate.quad(integrand_der_ell_L2_im, -np.inf, np.inf, epsabs=1E-12, epsrel=1E-12, args=(xi, xi_prime, sigma_f, ell))
-        np.fill_diagonal(der_ell_L2_im_K[n:, :], exp(xi_prime-xi)*(sigma_f**2)/(ell**3)*integral)
-        np.fill_diagonal(der_ell_L2_im_K[:, n:], exp(xi_prime-xi)*(sigma_f**2)/(ell**3)*integral)
-
-    return der_ell_L2_im_K
+    integrals = kernel_quadrature.pairwise(kernel_tables.integrals("der_ell_L2_im"), xi_vec, xi_vec, ell)
+    return (sigma_f**2)/(ell**3)*integrals
 
 # gradient of the negative marginal log-likelihhod (NMLL) $L(\bm \theta)$
+@timed
 def grad_NMLL_fct(theta, Z_exp, xi_vec):
     # load the initial value for parameters needed to optimize
     sigma_n = theta[0] 
@@ -374,4 +315,38 @@ def grad_NMLL_fct_L(theta, Z_exp, xi_vec):
 
     grad = np.array([d_K_im_full_d_sigma_n, d_K_im_full_d_sigma_f, d_K_im_full_d_ell, d_K_im_full_d_sigma_L])
 
-    return grad
\ No newline at end of file
+    return grad
+
+# predict the mean and variance of the imaginary part of the impedance, eq (26), and of the DRT, eq (29), at all the
+# points xi_star_vec at once. The cross-covariance matrices of eq (18) are made for all the points, and one triangular
+# solve with the Cholesky factor $\mathbf L$ of $\mathbf K_{\rm im}^{\rm full}$ gives $\mathbf L^{-1} \mathbf Z^{\rm exp}_{\rm im}$
+# and $\mathbf L^{-1}$ times the cross-covariances, so that the means are products of these and the variances
+# $k_{**} - \left\|\mathbf L^{-1} \mathbf k_*\right\|^2$ are sums of their squares
+@timed
+def predict_star(xi_vec, xi_star_vec, Z_exp, sigma_n, sigma_f, ell):
+    N_freqs = xi_vec.size
+    N_star = xi_star_vec.size
+
+    K_im_full = matrix_L2_im_K(xi_vec, xi_vec, sigma_f, ell) + (sigma_n**2)*np.eye(N_freqs)
+    if not is_PD(K_im_full):
+        K_im_full = nearest_PD(K_im_full)
+    L = np.linalg.cholesky(K_im_full)
+
+    L2_im_k_star = matrix_L2_im_K(xi_vec, xi_star_vec, sigma_f, ell)            # shape (N_freqs, N_star)
+    L_im_k_star_up = matrix_L_im_K(xi_star_vec, xi_vec, sigma_f, ell)           # shape (N_star, N_freqs)
+
+    solved = solve_triangular(L, np.column_stack((Z_exp.imag, L2_im_k_star, L_im_k_star_up.T)), lower=True)
+    solved_Z_exp = solved[:, 0]
+    solved_L2_im_k_star = solved[:, 1:N_star+1]
+    solved_L_im_k_star_up = solved[:, N_star+1:]
+
+    # the diagonals of $k_{**}$ and $\mathcal L^2_{\rm im} k_{**}$ only depend on $\Delta\xi = 0$
+    k_star_star = sigma_f**2
+    L2_im_k_star_star = matrix_L2_im_K(xi_star_vec[:1], xi_star_vec[:1], sigma_f, ell)[0, 0]
+
+    Z_im_vec_star = np.dot(solved_L2_im_k_star.T, solved_Z_exp)
+    Sigma_Z_im_vec_star = L2_im_k_star_star - np.sum(solved_L2_im_k_star**2, axis=0)
+    gamma_vec_star = np.dot(solved_L_im_k_star_up.T, solved_Z_exp)
+    Sigma_gamma_vec_star = k_star_star - np.sum(solved_L_im_k_star_up**2, axis=0)
+
+    return Z_im_vec_star, Sigma_Z_im_vec_star, gamma_vec_star, Sigma_gamma_vec_star
@@ -17,6 +17,7 @@ Contains:
 - SaveFileInbox: A combined label, entry and button for inputing a save file path (does not need to exist). 
 - FileInbox: A combined label, entry and button for inputing a file path (must exist).
 - PlotCanvas: A combined tkinter FigureCanvasTkAgg, NavigationToolbar2Tk and the figure and axis matplotlib objects
+- PlotScheduler: Collects plot updates and runs them at a fixed frame rate with tkinter after
 - function popupYesNo: Opens a window and asks a question, returns True if yes, False is no
 
 @author: Christoffer Askvik Faugstad (christoffer.askvik.faugstad@hotmail.com)
@@ -396,6 +397,10 @@ class PlotCanvas:
         self.canvas = FigureCanvasTkAgg(self.figure, master=window)
         self.toolbar = NavigationToolbar2Tk(self.canvas, window, pack_toolbar=False)
         self.twin_axis = None
+        # Artists that are drawn by blit and the background they are drawn on
+        self.animated_artists = []
+        self.background = None
+        self.canvas.mpl_connect("draw_event", self._on_draw)
         # Placing the widgets
         self.canvas.get_tk_widget().grid(row=row, column=column)
         self.toolbar.grid(row=row + 1, column=column)
@@ -492,6 +497,39 @@ class PlotCanvas:
         """Updates the axis(es)"""
         self.canvas.draw_idle()
 
+    def add_animated(self, artist):
+        """
+        Marks the artist as animated, meaning that it is not part of the stored
+        background and is only drawn by blit. Returns the artist.
+        """
+        artist.set_animated(True)
+        self.animated_artists.append(artist)
+        return artist
+
+    def _on_draw(self, event) -> None:
+        """Stores the background after a full draw and draws the animated artists on it"""
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        for artist in self.animated_artists:
+            self.figure.draw_artist(artist)
+
+    def redraw(self) -> None:
+        """Does a full draw of the figure, needed when the axis limits or labels change"""
+        self.canvas.draw()
+
+    def blit(self) -> None:
+        """
+        Draws only the animated artists on top of the stored background, which is
+        much faster than a full draw. If there is no background yet a full draw
+        is done instead.
+        """
+        if self.background is None:
+            self.redraw()
+            return
+        self.canvas.restore_region(self.background)
+        for artist in self.animated_artists:
+            self.figure.draw_artist(artist)
+        self.canvas.blit(self.figure.bbox)
+
     def remove(self) -> None:
         """Remove the canvas and its axsis"""
         self.axis.clear()
@@ -508,3 +546,51 @@ class PlotCanvas:
         self.axis = None
         self.figure = None
         self.canvas = None
+        self.animated_artists = []
+        self.background = None
+
+
+class PlotScheduler:
+    """
+    Coalesces plot updates so the figures are redrawn at most frame_rate times per
+    second, no matter how often new data arrives. Each update is given a key and
+    if several updates with the same key are requested before the next frame,
+    only the last one is run.
+    """
+
+    def __init__(self, window: tk.Tk, frame_rate: float = 10):
+        """
+        Parameters:
+        ----------
+        - window: The tkinter window whose after method is used for the scheduling
+        - frame_rate: The maximum number of redraws per second
+        """
+        self.window = window
+        self.interval = max(1, int(1000 / frame_rate))
+        self.pending = {}
+        self.after_id = None
+
+    def request(self, key, callback) -> None:
+        """
+        Parameters:
+        ----------
+        - key: Identifies the update, a later request with the same key replaces this one
+        - callback: Function without arguments doing the redraw
+        """
+        self.pending[key] = callback
+        if self.after_id is None:
+            self.after_id = self.window.after(self.interval, self.flush)
+
+    def flush(self) -> None:
+        """Runs all the pending updates now"""
+        self.after_id = None
+        pending, self.pending = self.pending, {}
+        for callback in pending.values():
+            callback()
+
+    def cancel(self) -> None:
+        """Drops all the pending updates"""
+        if self.after_id is not None:
+            self.window.after_cancel(self.after_id)
+            self.after_id = None
+        self.pending = {}
@@ -6,6 +6,7 @@ import pandas as pd
 from hyperopt import fmin, tpe, hp, Trials
 import warnings
 from scipy.integrate import IntegrationWarning
+from dependencies.profiling import timed
 
 
 """
@@ -31,6 +32,7 @@ class HypparError(Exception):
 
 
 
+@timed
 def find_hyperparameters(Z_exp, xi_vec, interface, plot_hyp_par_space=False):
     """
     Called by fit_DRT().
@@ -143,6 +145,7 @@ def find_hyperparameters(Z_exp, xi_vec, interface, plot_hyp_par_space=False):
 
 
 
+@timed
 def fit_DRT(Z_exp, freq_vec, data, interface, plotting = False):
     """
     This is where the linear regression in order to find the DRT happens.
@@ -179,7 +182,6 @@ def fit_DRT(Z_exp, freq_vec, data, interface, plotting = False):
     freq_vec = np.flip(freq_vec)
 
     # define the frequency range
-    N_freqs = len(freq_vec)     
     xi_vec = np.log(freq_vec)
 
     # define the frequency range used for prediction, we choose a wider range to better display the DRT
@@ -218,64 +220,10 @@ def fit_DRT(Z_exp, freq_vec, data, interface, plotting = False):
         log_file.write(f"{interface.current},{sigma_n},{sigma_f},{ell},{best_loss}\n")
         log_file.close()
 
-    # calculate the matrices shown in eq (18)
-    # K = GP_DRT.matrix_K(xi_vec, xi_vec, sigma_f, ell)
-    # L_im_K = GP_DRT.matrix_L_im_K(xi_vec, xi_vec, sigma_f, ell)
-    L2_im_K = dependencies.GP_DRT.matrix_L2_im_K(xi_vec, xi_vec, sigma_f, ell)
-    Sigma = (sigma_n**2)*np.eye(N_freqs)
-
-    # the matrix $\mathcal L^2_{\rm im} \mathbf K + \sigma_n^2 \mathbf I$ whose inverse is needed
-    K_im_full = L2_im_K + Sigma
-
-    # check if the K_im_full is positive definite, otherwise, a nearest one would replace the K_im_full
-    if not dependencies.GP_DRT.is_PD(K_im_full):
-        K_im_full = dependencies.GP_DRT.nearest_PD(K_im_full)
-
-    # Cholesky factorization, L is a lower-triangular matrix
-    L = np.linalg.cholesky(K_im_full)
-
-    # solve for alpha
-    alpha = np.linalg.solve(L, Z_exp.imag)
-    alpha = np.linalg.solve(L.T, alpha)
-
-    # estimate the gamma of eq (21a)
-    # gamma_fct_est = np.dot(L_im_K, alpha)
-
-    # covariance matrix
-    inv_L = np.linalg.inv(L)
-    inv_K_im_full = np.dot(inv_L.T, inv_L)
-
-    # estimate the sigma of gamma for eq (21b)
-    # cov_gamma_fct_est = K - np.dot(L_im_K, np.dot(inv_K_im_full, L_im_K.T))
-    # sigma_gamma_fct_est = np.sqrt(np.diag(cov_gamma_fct_est))
-
-
-    # initialize the imaginary part of impedance vector
-    Z_im_vec_star = np.empty_like(xi_vec_star)      #shape: (101,)
-    Sigma_Z_im_vec_star = np.empty_like(xi_vec_star)
-
-    gamma_vec_star = np.empty_like(xi_vec_star)
-    Sigma_gamma_vec_star = np.empty_like(xi_vec_star)
-
-    # calculate the imaginary part of impedance at each $\xi$ point for the plot
-    for index, val in enumerate(xi_vec_star):
-        xi_star = np.array([val])
-
-        # compute matrices shown in eq (18), xi_star corresponds to a new point
-        # k_star = GP_DRT.matrix_K(xi_vec, xi_star, sigma_f, ell)
-        L_im_k_star_up = dependencies.GP_DRT.matrix_L_im_K(xi_star, xi_vec, sigma_f, ell)
-        L2_im_k_star = dependencies.GP_DRT.matrix_L2_im_K(xi_vec, xi_star, sigma_f, ell)
-        k_star_star = dependencies.GP_DRT.matrix_K(xi_star, xi_star, sigma_f, ell)
-        # L_im_k_star_star = GP_DRT.matrix_L_im_K(xi_star, xi_star, sigma_f, ell)
-        L2_im_k_star_star = dependencies.GP_DRT.matrix_L2_im_K(xi_star, xi_star, sigma_f, ell)
-
-        # compute Z_im_star mean and standard deviation using eq (26)
-        Z_im_vec_star[index] = np.dot(L2_im_k_star.T, np.dot(inv_K_im_full, Z_exp.imag))[0]
-        Sigma_Z_im_vec_star[index] = L2_im_k_star_star[0,0] - np.dot(L2_im_k_star.T, np.dot(inv_K_im_full, L2_im_k_star))[0,0]
-        
-        # compute gamma_star mean and standard deviation using eq (29)
-        gamma_vec_star[index] = np.dot(L_im_k_star_up, np.dot(inv_K_im_full, Z_exp.imag))[0]
-        Sigma_gamma_vec_star[index] = k_star_star[0,0] - np.dot(L_im_k_star_up, np.dot(inv_K_im_full, L_im_k_star_up.T))[0,0]
+    # compute Z_im_star mean and standard deviation using eq (26), and gamma_star mean and standard deviation
+    # using eq (29), for all the points in xi_vec_star at once, see predict_star in GP_DRT.py
+    Z_im_vec_star, Sigma_Z_im_vec_star, gamma_vec_star, Sigma_gamma_vec_star = dependencies.GP_DRT.predict_star(
+        xi_vec, xi_vec_star, Z_exp, sigma_n, sigma_f, ell)
 
 
 
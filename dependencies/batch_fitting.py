@@ -0,0 +1,188 @@
+"""
+Batch fitting
+
+Short description:
+----------
+This is a helper file to the circuit handlers (circuit_handler.py). It fits many
+impedance spectra to the same circuit at the same time. Each spectrum is its own
+small least squares problem, and fitting them one after the other with curve_fit
+spends most of the time in Python for every iteration of every spectrum. Here the
+Levenberg-Marquardt steps of all the spectra are taken together: the model, the
+Jacobian and the normal equations of the whole batch are computed with one NumPy
+call each (see circuit_models.py), so the Python overhead is shared by the batch.
+
+Every spectrum has its own damping and its own convergence test, and the spectra
+that have converged are left out of the following iterations. The convergence is
+tested on the undamped Gauss-Newton step from the current parameters, not on the
+damped step that was taken: a spectrum has converged when that step would reduce
+the sum of squares relatively less than ftol, or change no parameter relatively
+more than xtol. After rejected steps the damping is high and the steps taken are
+tiny anywhere, so a test on them would stop far from the minimum. Parameters at a
+bound the gradient pushes against are left out of the test. The steps are
+projected on the bounds by going at most half the way to a bound, so the
+parameters stay strictly inside them (a capacitance of exactly zero has no
+impedance). The uncertainties are computed from the Jacobian at the solution the
+same way as curve_fit does, so they can be used as the conf_ of a CustomCircuit.
+
+The steps stay inside the bounds by halving, which is slow when the minimum is at
+a bound. Most spectra of the RC circuits converge, but fewer of the CPE and
+inductive circuits do, and those are fitted one at a time by the circuit handler,
+so batch fitting is only faster for circuits where most spectra converge.
+
+Contains:
+----------
+- BATCH_SIZE: The most spectra fitted in one batch
+- fit_batch: Fits a batch of spectra
+"""
+import numpy as np
+
+# The Jacobian of a batch takes batch size * frequencies * parameters complex numbers for every element of the circuit
+BATCH_SIZE = 256
+
+
+def _residuals_and_jacobian(model, frequencies, data, parameters):
+    """Returns the residuals with shape (B, 2N) and their Jacobian with shape (B, 2N, P), real parts followed by imaginary parts"""
+    Z, dZ = model.impedance_and_jacobian(frequencies, parameters)
+    residuals = np.concatenate([Z.real, Z.imag], axis=-1) - data
+    jacobian = np.concatenate([dZ.real, dZ.imag], axis=-2)
+    return residuals, jacobian
+
+
+def _gauss_newton_test(normal_matrix, gradient, scaling, x, cost, at_bound, ftol, xtol):
+    """
+    Returns True for the spectra where the undamped Gauss-Newton step, of the
+    parameters not at_bound, would reduce the cost relatively less than ftol or
+    change no parameter relatively more than xtol.
+    """
+    free = ~at_bound
+    # The parameters at a bound are held, their rows and columns only have the scaling on the diagonal
+    held_matrix = normal_matrix * (free[:, :, np.newaxis] & free[:, np.newaxis, :])
+    held_matrix += (1e-12 * free + at_bound)[:, :, np.newaxis] * (scaling[:, :, np.newaxis] * np.eye(x.shape[1]))
+    held_gradient = np.where(free, gradient, 0)
+    step = -np.linalg.solve(held_matrix, held_gradient[:, :, np.newaxis])[:, :, 0]
+    predicted_reduction = -np.sum(held_gradient * step, axis=1)
+    small_reduction = predicted_reduction <= ftol * cost
+    small_step = np.all(np.abs(step) <= xtol * (np.abs(x) + xtol), axis=1)
+    return small_reduction | small_step
+
+
+def _uncertainties(jacobian, cost, num_points):
+    """
+    Returns one standard deviation of the parameters in the same way as curve_fit,
+    from the pseudo inverse of J^T J scaled by the reduced chi square.
+    """
+    _, singular_values, vt = np.linalg.svd(jacobian, full_matrices=False)
+    threshold = np.finfo(float).eps * max(jacobian.shape[-2:]) * singular_values[:, :1]
+    inverse_squares = np.where(singular_values > threshold, 1 / np.maximum(singular_values, threshold) ** 2, 0)
+    covariance = np.einsum("bki,bk,bkj->bij", vt, inverse_squares, vt)
+    degrees_of_freedom = max(num_points - jacobian.shape[-1], 1)
+    variances = np.diagonal(covariance, axis1=1, axis2=2) * (cost / degrees_of_freedom)[:, np.newaxis]
+    return np.sqrt(variances)
+
+
+def fit_batch(
+    model,
+    frequencies,
+    impedances,
+    initial_guess,
+    bounds=None,
+    max_iterations=200,
+    ftol=1e-13,
+    xtol=1e-8,
+):
+    """
+    Parameters:
+    ----------
+    - model: CircuitModel
+        The circuit, see circuit_models.py
+    - frequencies: array like with shape (N,) or (B, N)
+        The frequencies of the spectra, the same for all or one row per spectrum
+    - impedances: array like with shape (B, N)
+        The complex impedance of the B spectra
+    - initial_guess: array like with shape (P,) or (B, P)
+        The parameters the fits start from, the same for all or one row per spectrum
+    - bounds: tuple of two array likes with shape (P,), default None
+        The lower and upper bounds of the parameters, (0, inf) if None
+    - max_iterations: int, default 200
+        The most steps taken for a spectrum before giving up on it
+    - ftol: float, default 1e-13
+        A spectrum has converged when the Gauss-Newton step would reduce its sum
+        of squares relatively less than this, the ftol of CompiledCircuit.fit
+    - xtol: float, default 1e-8
+        A spectrum has converged when the Gauss-Newton step would change no
+        parameter relatively more than this
+
+    Returns:
+    ----------
+    The fitted parameters and their standard deviations, both with shape (B, P),
+    and a boolean array with shape (B,) that is False for the spectra that did
+    not converge in max_iterations steps or could not be improved any further
+    before converging.
+    """
+    frequencies = np.asarray(frequencies, dtype=float)
+    impedances = np.asarray(impedances, dtype=complex)
+    num_spectra, num_frequencies = impedances.shape
+    num_parameters = model.num_parameters
+    if bounds is None:
+        lower, upper = np.zeros(num_parameters), np.full(num_parameters, np.inf)
+    else:
+        lower, upper = (np.asarray(bound, dtype=float) for bound in bounds)
+    data = np.concatenate([impedances.real, impedances.imag], axis=-1)
+    parameters = np.clip(np.array(np.broadcast_to(initial_guess, (num_spectra, num_parameters)), dtype=float), lower, upper)
+
+    def spectra(indices):
+        return frequencies if frequencies.ndim == 1 else frequencies[indices]
+
+    residuals, jacobian = _residuals_and_jacobian(model, frequencies, data, parameters)
+    cost = np.sum(residuals**2, axis=-1)
+    damping = np.full(num_spectra, 1e-3)
+    converged = np.zeros(num_spectra, dtype=bool)
+    active = np.arange(num_spectra)
+
+    for iteration in range(max_iterations + 1):
+        J, r, x = jacobian[active], residuals[active], parameters[active]
+        normal_matrix = np.einsum("bmi,bmj->bij", J, J)
+        gradient = np.einsum("bmi,bm->bi", J, r)
+        # Marquardt's scaling by the diagonal makes the steps independent of the units of the parameters
+        scaling = np.diagonal(normal_matrix, axis1=1, axis2=2)
+        scaling = np.maximum(scaling, 1e-15 * scaling.max(axis=1, keepdims=True) + np.finfo(float).tiny)
+
+        # A parameter is at a finite bound when it is within xtol of it and the gradient pushes it out
+        at_bound = (np.isfinite(lower) & (x - lower <= xtol * (np.abs(lower) + xtol)) & (gradient > 0)) | (
+            np.isfinite(upper) & (upper - x <= xtol * (np.abs(upper) + xtol)) & (gradient < 0)
+        )
+        done = _gauss_newton_test(normal_matrix, gradient, scaling, x, cost[active], at_bound, ftol, xtol)
+        converged[active[done]] = True
+        # The last round only tests the result of the last step
+        if np.all(done) or iteration == max_iterations:
+            break
+        active, J, r, x = active[~done], J[~done], r[~done], x[~done]
+        normal_matrix, gradient, scaling = normal_matrix[~done], gradient[~done], scaling[~done]
+
+        damped_matrix = normal_matrix + damping[active, np.newaxis, np.newaxis] * (
+            scaling[:, :, np.newaxis] * np.eye(num_parameters)
+        )
+        step = -np.linalg.solve(damped_matrix, gradient[:, :, np.newaxis])[:, :, 0]
+        trial = x + step
+        trial = np.where(trial < lower, (x + lower) / 2, trial)
+        trial = np.where(trial > upper, (x + upper) / 2, trial)
+
+        trial_residuals, trial_jacobian = _residuals_and_jacobian(model, spectra(active), data[active], trial)
+        trial_cost = np.sum(trial_residuals**2, axis=-1)
+        accepted = np.isfinite(trial_cost) & (trial_cost < cost[active])
+
+        if np.any(accepted):
+            indices = active[accepted]
+            parameters[indices] = trial[accepted]
+            residuals[indices] = trial_residuals[accepted]
+            jacobian[indices] = trial_jacobian[accepted]
+            cost[indices] = trial_cost[accepted]
+            damping[indices] = np.maximum(damping[indices] / 3, 1e-15)
+        damping[active[~accepted]] *= 10
+        # A spectrum no step can improve even with this damping is stuck
+        active = active[damping[active] <= 1e15]
+        if active.size == 0:
+            break
+
+    uncertainties = _uncertainties(jacobian, cost, 2 * num_frequencies)
+    return parameters, uncertainties, converged
@@ -23,11 +23,13 @@ Added functions that will calculate the impedance for the different circuits bas
 @co-author: Elling Svee (elling.svee@gmail.com)
 """
 import time
-from impedance.models.circuits.circuits import CustomCircuit
 import numpy as np
 import os
-import matplotlib.pyplot as plt
 import math 
+from dependencies.profiling import timed
+from dependencies.circuit_models import CompiledCircuit, get_model, make_circuit
+from dependencies.batch_fitting import BATCH_SIZE, fit_batch
+from dependencies.multistart import multistart_guess
 
 # Base class for all circuit handlers
 class BaseCircuitHandler:
@@ -54,6 +56,15 @@ class BaseCircuitHandler:
     plot :
         Plot the resulting output data from either process or load_exsisting
     """
+    # If the files are fitted all at once by do_batch_steps instead of one after the other by do_steps
+    batch_fit = False
+    # Parameters from an earlier fit the first fit starts from instead of get_initial_guess, see warm_start_store.py
+    warm_start = None
+    # If the first fit without a warm start starts from the best of many starts, see multistart.py
+    multistart = True
+    # Keyword arguments of the fit in do_initial_step besides the bounds
+    initial_fit_options = {}
+
     def __init__(
         self, file_dir, save_file_path, log, area_str='', area_size=-1
     ) -> None:
@@ -117,6 +128,8 @@ class BaseCircuitHandler:
         self.save_file_path = save_file_path
         self.log = log
         self.output_data = None
+        # The files that could not be loaded or fitted, to the exception, see fail_file
+        self.failed_files = {}
         self.area_str = area_str
         self.area_size = float(area_size)
         
@@ -182,6 +195,22 @@ class BaseCircuitHandler:
     def get_initial_guess(self):
         ...
 
+    def get_first_guess(self, f, Z):
+        """
+        Returns the parameters the first fit, of the spectrum f, Z, starts from:
+        warm_start if it is set and has the right length, else the best of the
+        multi-start search if multistart is set and the circuit can be compiled,
+        else get_initial_guess.
+        """
+        initial_guess = list(self.get_initial_guess())
+        lower, upper = self.get_bounds()
+        if self.warm_start is not None and len(self.warm_start) == len(initial_guess):
+            return list(np.clip(self.warm_start, lower, upper))
+        model = get_model(self.circuit_string)
+        if self.multistart and model is not None:
+            return list(multistart_guess(model, f, Z, initial_guess, (lower, upper)))
+        return initial_guess
+
     def get_new_indicies(self):
         ...
 
@@ -197,86 +226,177 @@ class BaseCircuitHandler:
             for variable, unit in zip(self.variables, self.units)
         )
 
+    @timed
     def do_initial_step(self):
         """
         The function that does the initial fitting of the parameters.
 
-        Note: Are redifine for some subclasses that need different
-        parameters for the fit call.
+        Note: Some subclasses need different parameters for the fit call,
+        see initial_fit_options. The first file that can be loaded and
+        fitted is used, the files before it are left out, see fail_file.
         """
-        # Create the CustomCircuit from impedance module
-        self.circuit = CustomCircuit(
-            self.circuit_string, initial_guess=self.get_initial_guess()
-        )
-        # Get the data to fit to
-        f, Z = BaseCircuitHandler.load_MMFILE(self.files_in_watch[0])
-
-
+        self.Z_fits = {}
+        self.fitted_parameters = {}
+        self.failed_files = {}
         # For timing the process
         start_time = time.time()
-        # Fitting data, global_opt=True, means that the basinhopping algorith of
-        # scipy is used, meaning that it searches for a golbal minimum.
-        self.circuit.fit(f, Z, bounds=self.get_bounds())  # ,global_opt=True)
+        for file_path in self.files_in_watch:
+            try:
+                # Get the data to fit to
+                f, Z = BaseCircuitHandler.load_MMFILE(file_path)
+                # Create the circuit, a compiled version of the CustomCircuit from impedance module, see circuit_models.py
+                self.circuit = make_circuit(
+                    self.circuit_string, initial_guess=self.get_first_guess(f, Z)
+                )
+                # Fitting data, from the best of the multi-start search instead of the
+                # much slower global_opt=True (basinhopping) option, see multistart.py
+                self.circuit.fit(f, Z, bounds=self.get_bounds(), **self.initial_fit_options)
+                break
+            except Exception as error:
+                self.failed_files[file_path] = error
+                self.log(f"Unable to fit {file_path}: {error}")
+        else:
+            # None of the files could be fitted
+            raise list(self.failed_files.values())[-1]
         # Log the time used
         # self.log(f"Time spent on first fit: {time.time()-start_time}")
         # Set the parameter values as the inital_guess for the next fitting
         initial_guess = list(self.circuit.parameters_)
         self.circuit.initial_guess = initial_guess
-        # Create the output_data array
-        self.output_data = np.zeros(
+        # Create the output_data array, the rows of the files that are not fitted stay NaN
+        self.output_data = np.full(
             (
                 len(self.files_in_watch),
                 2 * self.num_parameters
                 + self.num_taus
                 + self.num_tot
                 + 1,  # +1 from chi/n
-            )
+            ),
+            np.nan,
         )
         # Creates a new index list so that one can sort the values on some criteria
         self.new_indicies = self.get_new_indicies()
 
+    @timed
     def do_steps(self):
         """
         Loops through all the files in files_in_watch and fits the impedance data
-        to the circuit.
+        to the circuit. A file that can not be loaded or fitted is left out, see
+        fail_file, and the next file starts from the last fit that succeeded.
         """
         # Looping through files
-        self.Z_fits = {}
         for i, file_path in enumerate(self.files_in_watch):
+            if file_path in self.failed_files:
+                continue
+            try:
+                # Loading the data that should be fitted
+                f, Z = BaseCircuitHandler.load_MMFILE(file_path)
 
+                # Fitting data with bounds
+                self.circuit.fit(f, Z, bounds=self.get_bounds())
 
-            # Loading the data that should be fitted
+                # print( self.circuit.fit(f, Z, bounds=self.get_bounds())) # Testing
 
-            
-            f, Z = BaseCircuitHandler.load_MMFILE(file_path)
-
-
-            # Fitting data with bounds
-            self.circuit.fit(f, Z, bounds=self.get_bounds())
+                self.store_fit(i, file_path, f, Z)
+            except Exception as error:
+                self.fail_file(i, file_path, error)
+                continue
+            # Loging how far the process has come
+            # self.log(f"Done with {i+1} of {len(self.files_in_watch)}")
+            # Setting the previous parameters as the new initial_guess
+            self.circuit.initial_guess = list(self.circuit.parameters_)
 
-            # print( self.circuit.fit(f, Z, bounds=self.get_bounds())) # Testing
+    def fail_file(self, i, file_path, error):
+        """
+        Leaves out the file number i, that raised error when it was loaded or
+        fitted. Its row of output_data is NaN, it has no Z_fits or
+        fitted_parameters, and it is kept in failed_files.
+        """
+        self.failed_files[file_path] = error
+        self.Z_fits.pop(file_path, None)
+        self.fitted_parameters.pop(file_path, None)
+        self.output_data[i] = np.nan
+        self.log(f"Unable to fit {file_path}: {error}")
 
-            # Getting the predicted values to calculate the chi/N value for the fit
-            self.Z_fits[file_path] = self.circuit.predict(f)
-            chiN = (
-                np.sqrt(
-                    np.sum(
-                        (Z.real - self.Z_fits[file_path].real) * (Z.real - self.Z_fits[file_path].real)
-                        + (Z.imag - self.Z_fits[file_path].imag) * (Z.imag - self.Z_fits[file_path].imag)
-                    )
-                    / Z.size
+    def store_fit(self, i, file_path, f, Z):
+        """
+        Stores the fit in self.circuit of the file number i in fitted_parameters,
+        Z_fits and output_data, together with its chi/N value.
+        """
+        self.fitted_parameters[file_path] = list(self.circuit.parameters_)
+        # Getting the predicted values to calculate the chi/N value for the fit
+        self.Z_fits[file_path] = self.circuit.predict(f)
+        chiN = (
+            np.sqrt(
+                np.sum(
+                    (Z.real - self.Z_fits[file_path].real) * (Z.real - self.Z_fits[file_path].real)
+                    + (Z.imag - self.Z_fits[file_path].imag) * (Z.imag - self.Z_fits[file_path].imag)
                 )
-                / f.size
+                / Z.size
             )
+            / f.size
+        )
+        # Storing the data in output_data
+        self.update_output_data(
+            i, self.circuit.parameters_, self.circuit.conf_, chiN
+        )
 
+    @timed
+    def do_batch_steps(self):
+        """
+        Fits all the files in files_in_watch at the same time with fit_batch
+        (batch_fitting.py), all starting from the parameters of the initial step,
+        instead of one after the other as do_steps. The files the batch fit does
+        not converge for are fitted one at the time as in do_steps, starting from
+        the parameters of the file before. Does the same as do_steps if the circuit
+        is not compiled. Files that can not be loaded or fitted are left out, as
+        in do_steps, and a batch that raises is fitted one file at the time.
+        """
+        if not isinstance(self.circuit, CompiledCircuit):
+            self.do_steps()
+            return
+        spectra = {}
+        for i, file_path in enumerate(self.files_in_watch):
+            if file_path in self.failed_files:
+                continue
+            try:
+                spectra[i] = BaseCircuitHandler.load_MMFILE(file_path)
+            except Exception as error:
+                self.fail_file(i, file_path, error)
+        initial_guess = list(self.circuit.initial_guess)
+        batch_fits = {}
+        # Spectra with the same number of frequencies are stacked and fitted together
+        for length in sorted({len(f) for f, _ in spectra.values()}):
+            indices = [i for i, (f, _) in spectra.items() if len(f) == length]
+            for start in range(0, len(indices), BATCH_SIZE):
+                batch = indices[start : start + BATCH_SIZE]
+                try:
+                    parameters, deviations, converged = fit_batch(
+                        self.circuit.model,
+                        np.array([spectra[i][0] for i in batch]),
+                        np.array([spectra[i][1] for i in batch]),
+                        initial_guess,
+                        self.get_bounds(),
+                    )
+                except Exception:
+                    continue
+                for k, i in enumerate(batch):
+                    batch_fits[i] = (parameters[k], deviations[k], converged[k])
 
-            # Storing the data in output_data
-            self.update_output_data(
-                i, self.circuit.parameters_, self.circuit.conf_, chiN
-            )
-            # Loging how far the process has come
-            # self.log(f"Done with {i+1} of {len(self.files_in_watch)}")
-            # Setting the previous parameters as the new initial_guess
+        for i, file_path in enumerate(self.files_in_watch):
+            if i not in spectra:
+                continue
+            f, Z = spectra[i]
+            try:
+                if i in batch_fits and batch_fits[i][2]:
+                    self.circuit.parameters_ = batch_fits[i][0]
+                    self.circuit.conf_ = batch_fits[i][1]
+                else:
+                    self.circuit.fit(f, Z, bounds=self.get_bounds())
+                self.store_fit(i, file_path, f, Z)
+            except Exception as error:
+                self.fail_file(i, file_path, error)
+                continue
             self.circuit.initial_guess = list(self.circuit.parameters_)
 
     def normalize(self):
@@ -304,6 +424,7 @@ class BaseCircuitHandler:
         else:
             pass
 
+    @timed
     def process(self):
         """
         Does the hole process of fitting a folder of files to the circuit
@@ -312,7 +433,10 @@ class BaseCircuitHandler:
         """
         total_start_time = time.time()
         self.do_initial_step()
-        self.do_steps()
+        if self.batch_fit:
+            self.do_batch_steps()
+        else:
+            self.do_steps()
 
         return self.output_data, self.variables, self.files_in_watch, self.Z_fits
 
@@ -344,6 +468,8 @@ class BaseCircuitHandler:
 
     def plot(self,save=False):
         """Creates a matplotlib figure and plots the output_data to this."""
+        import matplotlib.pyplot as plt
+
         # Create figure and axis
         self.figure, self.axis = plt.subplots()
         # Seting the tilte to be the name of the save_file_path filename
@@ -1179,6 +1305,7 @@ class Circuit_pR1C1(BaseCircuitHandler):
 #### "R0-p(R1,CPE1)-p(R2,CPE2)-p(R3,CPE3)" ####
 class Circuit_R0pR1CPE1pR2CPE2pR3CPE3(BaseCircuitHandler):
     circuit_string = "R0-p(R1,CPE1)-p(R2,CPE2)-p(R3,CPE3)"
+    initial_fit_options = {"method": "trf"}
     num_parameters = 10
     num_taus = 0
     num_tot = 1
@@ -1267,27 +1394,6 @@ class Circuit_R0pR1CPE1pR2CPE2pR3CPE3(BaseCircuitHandler):
         ]
         return [index for _, index in sorted(zip(resistances, indicies))]
 
-    def do_initial_step(self):
-        self.circuit = CustomCircuit(
-            self.circuit_string, initial_guess=self.get_initial_guess()
-        )
-        f, Z = BaseCircuitHandler.load_MMFILE(self.files_in_watch[0])
-        start_time = time.time()
-        self.circuit.fit(f, Z, bounds=self.get_bounds(), method="trf")
-        # self.log(
-        #     # f"Time spent on first fit, with global optinon true: {time.time()-start_time}"
-        # )
-        initial_guess = list(self.circuit.parameters_)
-        self.circuit.initial_guess = initial_guess
-        self.output_data = np.zeros(
-            (
-                len(self.files_in_watch),
-                2 * self.num_parameters + self.num_taus + self.num_tot + 1,
-            )
-        )  # +1 from chi/n
-
-        self.new_indicies = self.get_new_indicies()
-
     def update_output_data(self, i, parameters, deviations, chiN):
         self.output_data[i, 0] = parameters[0]  # Re
         self.output_data[i, 1] = parameters[self.new_indicies[0]]  # R1
@@ -1457,6 +1563,7 @@ class Circuit_R0pR1CPE1pR2CPE2pR3CPE3(BaseCircuitHandler):
 #### "R0-p(R1,CPE1)-p(R2,CPE2)" ####
 class Circuit_R0pR1CPE1pR2CPE2(BaseCircuitHandler):
     circuit_string = "R0-p(R1,CPE1)-p(R2,CPE2)"
+    initial_fit_options = {"method": "trf"}
     num_parameters = 7
     num_taus = 0
     num_tot = 1
@@ -1529,26 +1636,6 @@ class Circuit_R0pR1CPE1pR2CPE2(BaseCircuitHandler):
         ]
         return [index for _, index in sorted(zip(resistances, indicies))]
 
-    def do_initial_step(self):
-        self.circuit = CustomCircuit(
-            self.circuit_string, initial_guess=self.get_initial_guess()
-        )
-        f, Z = BaseCircuitHandler.load_MMFILE(self.files_in_watch[0])
-        start_time = time.time()
-        self.circuit.fit(f, Z, bounds=self.get_bounds(), method="trf")
-        # self.log(
-        #     # f"Time spent on first fit, with global optinon true: {time.time()-start_time}"
-        # )
-        initial_guess = list(self.circuit.parameters_)
-        self.circuit.initial_guess = initial_guess
-        self.output_data = np.zeros(
-            (
-                len(self.files_in_watch),
-                2 * self.num_parameters + self.num_taus + self.num_tot + 1,
-            )
-        )  # +1 from chi/n
-        self.new_indicies = self.get_new_indicies()
-
     def update_output_data(self, i, parameters, deviations, chiN):
         self.output_data[i, 0] = parameters[0]  # Re
         self.output_data[i, 1] = parameters[self.new_indicies[0]]  # R1
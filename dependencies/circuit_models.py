@@ -0,0 +1,327 @@
+"""
+Circuit models
+
+Short description:
+----------
+This is a helper file to the circuit handlers (circuit_handler.py). It computes the
+impedance of an equivalent circuit together with its derivatives with respect to
+the parameters in closed form, so the fit does not have to estimate them with
+finite differences. scipy's curve_fit otherwise evaluates the circuit once more for
+every parameter in each iteration, which is most of the time for the CPE circuits.
+
+The circuit strings are written the same way as for the impedance module, with the
+elements R, C, L and CPE, "-" for elements in series and p(...,...) for elements in
+parallel, e.g. "R0-p(R1,CPE1)-p(R2,C2,R3-L1)". The parameters are in the order the
+elements appear, with two for a CPE (Q and alpha), the same as in CustomCircuit.
+
+The derivatives follow from the elements and the chain rule:
+    R:   Z = R                      dZ/dR = 1
+    C:   Z = 1 / (jwC)              dZ/dC = -Z / C
+    L:   Z = jwL                    dZ/dL = jw
+    CPE: Z = 1 / (Q (jw)^alpha)     dZ/dQ = -Z / Q,  dZ/dalpha = -Z ln(jw)
+    series:   Z = sum Zi            dZ = sum dZi
+    parallel: 1/Z = sum 1/Zi        dZ = Z^2 sum dZi / Zi^2
+
+The impedance itself is compiled: the circuit is written out once as a single
+NumPy expression, e.g. "R0-p(R1,C1)" becomes R0 + 1 / (1 / R1 + jw C1), which is
+evaluated for all the frequencies, and for a whole batch of parameter sets at the
+time, without going through the circuit string as the impedance module does.
+
+Contains:
+----------
+- ELEMENT_PARAMETERS: The number of parameters of each element
+- CircuitModel: The impedance and Jacobian of a circuit string
+- CompiledCircuit: Fits a circuit the same way as CustomCircuit of the impedance module
+- get_model: The cached CircuitModel of a circuit string
+- get_jacobian: The Jacobian function passed to CustomCircuit.fit for a circuit string
+- make_circuit: A CompiledCircuit, or a CustomCircuit if the circuit is not supported
+"""
+import re
+import functools
+import numpy as np
+
+ELEMENT_PARAMETERS = {"R": 1, "C": 1, "L": 1, "CPE": 2}
+
+
+class CircuitModel:
+    """
+    Short description:
+    ----------
+    An equivalent circuit parsed from a circuit string.
+
+    Main methods:
+    ----------
+    - impedance :
+        The impedance at the frequencies, for one or a batch of parameter sets.
+    - stacked :
+        The real and imaginary parts of the impedance in the form curve_fit fits.
+    - impedance_and_jacobian :
+        The impedance and its derivatives with respect to the parameters.
+    - jacobian :
+        The derivatives in the form scipy's curve_fit takes as jac.
+    """
+
+    def __init__(self, circuit_string):
+        """
+        Parameters:
+        ----------
+        - circuit_string: str
+            The circuit, e.g. "R0-p(R1,C1)"
+
+        Note:
+        ----------
+        Raises ValueError if the string can not be parsed or has elements
+        other than those in ELEMENT_PARAMETERS.
+        """
+        self.circuit_string = circuit_string
+        self.tokens = re.findall(r"p\(|[A-Za-z]+\d*|[-,)]", circuit_string.replace(" ", ""))
+        if "".join(self.tokens) != circuit_string.replace(" ", ""):
+            raise ValueError(f"Can not parse the circuit {circuit_string}")
+        self.position = 0
+        self.num_parameters = 0
+        self.alpha_indices = []
+        # What each parameter is, "R", "C", "L", or "Q" and "alpha" for a CPE
+        self.parameter_kinds = []
+        self.tree = self._parse_series()
+        if self.position != len(self.tokens):
+            raise ValueError(f"Can not parse the circuit {circuit_string}")
+        self.expression = self._impedance_expression(self.tree)
+        source = f"def impedance(jw, p):\n    return {self.expression}\n"
+        namespace = {}
+        exec(compile(source, f"<circuit {circuit_string}>", "exec"), namespace)
+        self._compiled = namespace["impedance"]
+
+    def _next(self):
+        token = self.tokens[self.position] if self.position < len(self.tokens) else ""
+        self.position += 1
+        return token
+
+    def _parse_series(self):
+        elements = [self._parse_term()]
+        while self.position < len(self.tokens) and self.tokens[self.position] == "-":
+            self.position += 1
+            elements.append(self._parse_term())
+        return elements[0] if len(elements) == 1 else ("series", elements)
+
+    def _parse_term(self):
+        token = self._next()
+        if token == "p(":
+            branches = [self._parse_series()]
+            while True:
+                token = self._next()
+                if token == ")":
+                    return ("parallel", branches)
+                if token != ",":
+                    raise ValueError(f"Can not parse the circuit {self.circuit_string}")
+                branches.append(self._parse_series())
+        kind = re.match(r"[A-Za-z]*", token).group()
+        if kind not in ELEMENT_PARAMETERS:
+            raise ValueError(f"The element {token} in {self.circuit_string} is not supported")
+        index = self.num_parameters
+        self.num_parameters += ELEMENT_PARAMETERS[kind]
+        if kind == "CPE":
+            self.alpha_indices.append(index + 1)
+            self.parameter_kinds += ["Q", "alpha"]
+        else:
+            self.parameter_kinds.append(kind)
+        return ("element", kind, index)
+
+    def _impedance_expression(self, node):
+        """Returns the source of the impedance of the node, with the parameters p[..., i, None] and jw broadcast against each other"""
+        if node[0] == "element":
+            _, kind, index = node
+            parameter = f"p[..., {index}, None]"
+            if kind == "R":
+                return parameter
+            if kind == "L":
+                return f"(jw * {parameter})"
+            return f"(1 / {self._admittance_expression(node)})"
+        if node[0] == "series":
+            return "(" + " + ".join(self._impedance_expression(child) for child in node[1]) + ")"
+        return "(1 / (" + " + ".join(self._admittance_expression(child) for child in node[1]) + "))"
+
+    def _admittance_expression(self, node):
+        """Returns the source of the admittance of the node, which saves a division for the C and CPE elements in parallel"""
+        if node[0] != "element":
+            return f"(1 / {self._impedance_expression(node)})"
+        _, kind, index = node
+        if kind == "C":
+            return f"(jw * p[..., {index}, None])"
+        if kind == "CPE":
+            return f"(p[..., {index}, None] * jw ** p[..., {index + 1}, None])"
+        return f"(1 / {self._impedance_expression(node)})"
+
+    def _evaluate(self, node, jw, parameters):
+        """
+        Returns the impedance of the node with shape (..., N) and its derivatives
+        with shape (..., N, num_parameters), for jw with shape (N,) or (..., N)
+        and parameters with shape (..., num_parameters).
+        """
+        if node[0] == "element":
+            _, kind, index = node
+            shape = np.broadcast_shapes(parameters.shape[:-1] + (1,), jw.shape)
+            dZ = np.zeros(shape + (self.num_parameters,), dtype=complex)
+            value = parameters[..., index, None]
+            if kind == "R":
+                Z = np.broadcast_to(value, shape).astype(complex)
+                dZ[..., index] = 1
+            elif kind == "C":
+                Z = 1 / (jw * value)
+                dZ[..., index] = -Z / value
+            elif kind == "L":
+                Z = jw * value
+                dZ[..., index] = jw
+            else:
+                Q, alpha = value, parameters[..., index + 1, None]
+                Z = 1 / (Q * jw**alpha)
+                dZ[..., index] = -Z / Q
+                dZ[..., index + 1] = -Z * np.log(jw)
+            return Z, dZ
+
+        children = [self._evaluate(child, jw, parameters) for child in node[1]]
+        if node[0] == "series":
+            return sum(child_Z for child_Z, _ in children), sum(child_dZ for _, child_dZ in children)
+        Z = 1 / sum(1 / child_Z for child_Z, _ in children)
+        dZ = Z[..., np.newaxis] ** 2 * sum(child_dZ / child_Z[..., np.newaxis] ** 2 for child_Z, child_dZ in children)
+        return Z, dZ
+
+    def impedance(self, frequencies, parameters):
+        """
+        Parameters:
+        ----------
+        - frequencies: array like with shape (N,), or (..., N) for a batch of spectra
+            The frequencies in Hz
+        - parameters: array like with shape (num_parameters,) or (..., num_parameters)
+            One parameter set, or a batch of them along the first axes
+
+        Returns:
+        ----------
+        The complex impedance with shape (N,), or (..., N) for a batch.
+        """
+        jw = 2j * np.pi * np.asarray(frequencies, dtype=float)
+        parameters = np.asarray(parameters, dtype=float)
+        Z = self._compiled(jw, parameters)
+        shape = np.broadcast_shapes(parameters.shape[:-1] + (1,), jw.shape)
+        if Z.shape != shape or Z.dtype != complex:
+            # Circuits of only resistors do not depend on the frequency
+            Z = np.broadcast_to(Z, shape).astype(complex)
+        return Z
+
+    def stacked(self, frequencies, *parameters):
+        """The model curve_fit fits for the impedance module, the real parts followed by the imaginary parts"""
+        Z = self.impedance(frequencies, parameters)
+        return np.hstack([Z.real, Z.imag])
+
+    def impedance_and_jacobian(self, frequencies, parameters):
+        """
+        Parameters:
+        ----------
+        - frequencies: array like with shape (N,), or (..., N) for a batch of spectra
+            The frequencies in Hz
+        - parameters: array like with shape (num_parameters,) or (..., num_parameters)
+            One parameter set, or a batch of them along the first axes
+
+        Returns:
+        ----------
+        The complex impedance with shape (..., N) and its derivatives with respect
+        to the parameters with shape (..., N, num_parameters).
+        """
+        jw = 2j * np.pi * np.asarray(frequencies, dtype=float)
+        return self._evaluate(self.tree, jw, np.asarray(parameters, dtype=float))
+
+    def jacobian(self, frequencies, *parameters):
+        """
+        The Jacobian in the form curve_fit takes as jac, for the model used by
+        the impedance module, where the real and imaginary parts are stacked.
+        Returns an array with shape (2 * len(frequencies), num_parameters).
+        """
+        _, dZ = self.impedance_and_jacobian(frequencies, parameters)
+        return np.vstack([dZ.real, dZ.imag])
+
+
+class CompiledCircuit:
+    """
+    Short description:
+    ----------
+    A replacement for CustomCircuit of the impedance module in the circuit handlers,
+    with the same attributes (initial_guess, parameters_ and conf_) and the same fit
+    and predict, that uses the compiled model and its Jacobian. It does not import
+    the impedance module, which imports matplotlib and takes longer than fitting a
+    whole folder.
+    """
+
+    def __init__(self, circuit_string, initial_guess):
+        self.circuit = circuit_string
+        self.model = get_model(circuit_string)
+        if self.model is None:
+            raise ValueError(f"The circuit {circuit_string} can not be compiled")
+        self.initial_guess = list(initial_guess)
+        self.parameters_ = None
+        self.conf_ = None
+
+    def get_default_bounds(self):
+        """Returns the bounds the impedance module uses, all parameters positive and the CPE alphas at most 1"""
+        upper = np.full(self.model.num_parameters, np.inf)
+        upper[self.model.alpha_indices] = 1
+        return np.zeros(self.model.num_parameters), upper
+
+    def fit(self, frequencies, impedance, bounds=None, weight_by_modulus=False, **kwargs):
+        """
+        Fits the circuit to the impedance from initial_guess, with the same least
+        squares problem and tolerances as CustomCircuit.fit. The kwargs are passed
+        on to scipy's curve_fit, e.g. method="trf". Returns itself.
+        """
+        from scipy.optimize import curve_fit
+
+        frequencies = np.asarray(frequencies, dtype=float)
+        impedance = np.asarray(impedance, dtype=complex)
+        if len(frequencies) != len(impedance):
+            raise TypeError("length of frequencies and impedance do not match")
+        kwargs.setdefault("maxfev", 1e5)
+        kwargs.setdefault("ftol", 1e-13)
+        if weight_by_modulus:
+            kwargs["sigma"] = np.hstack([np.abs(impedance), np.abs(impedance)])
+        self.parameters_, covariance = curve_fit(
+            self.model.stacked,
+            frequencies,
+            np.hstack([impedance.real, impedance.imag]),
+            p0=self.initial_guess,
+            bounds=self.get_default_bounds() if bounds is None else bounds,
+            jac=self.model.jacobian,
+            **kwargs,
+        )
+        self.conf_ = np.sqrt(np.diag(covariance))
+        return self
+
+    def predict(self, frequencies, use_initial=False):
+        """Returns the impedance at the frequencies with the fitted parameters, or the initial guess if not fitted or use_initial"""
+        if self.parameters_ is None or use_initial:
+            return self.model.impedance(frequencies, self.initial_guess)
+        return self.model.impedance(frequencies, self.parameters_)
+
+
+@functools.lru_cache(maxsize=None)
+def get_model(circuit_string):
+    """Returns the CircuitModel of the circuit, made once per process, or None if it has elements that are not supported"""
+    try:
+        return CircuitModel(circuit_string)
+    except ValueError:
+        return None
+
+
+def get_jacobian(circuit_string):
+    """Returns the jac function for CustomCircuit.fit of the circuit, or None if it has elements without a Jacobian"""
+    model = get_model(circuit_string)
+    return None if model is None else model.jacobian
+
+
+def make_circuit(circuit_string, initial_guess):
+    """
+    Returns a CompiledCircuit of the circuit, or a CustomCircuit of the impedance
+    module if the circuit has elements the compiled model does not support.
+    """
+    if get_model(circuit_string) is not None:
+        return CompiledCircuit(circuit_string, initial_guess)
+    from impedance.models.circuits.circuits import CustomCircuit
+
+    return CustomCircuit(circuit_string, initial_guess=initial_guess)
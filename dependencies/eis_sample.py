@@ -12,13 +12,22 @@ the results. For further specification see the class description.
 
 @author: Christoffer Askvik Faugstad (christoffer.askvik.faugstad@hotmail.com)
 """
-from dependencies.GUI_helper import PlotCanvas
 import numpy as np
-from matplotlib.colors import LogNorm
+from typing import TYPE_CHECKING
 from scipy.fft import rfft, rfftfreq, next_fast_len
-from scipy.signal import find_peaks
+from dependencies.segmented_estimator import SegmentedEstimator, read_chunks
+from dependencies.raw_data import RawCapture
+from dependencies.profiling import timed
 import os
 
+# matplotlib and scipy.signal are imported where they are used, as importing them
+# takes longer than the rest of the processing worker processes start with
+if TYPE_CHECKING:
+    from dependencies.GUI_helper import PlotCanvas
+
+# The ways the impedance can be estimated from the time signals, see EIS_Sample.fft
+ESTIMATORS = ["FFT", "Sine fit", "Segmented"]
+
 class EIS_Sample:
     """
     Short description:
@@ -60,6 +69,7 @@ class EIS_Sample:
         filter_type="Hann",       
         beta_factor=4.2,
         frequency_now = 1,
+        estimator="FFT",
 
     ):
         """
@@ -77,6 +87,12 @@ class EIS_Sample:
         - current_proportion : float, default 0.1
             The proportion of the maximum height a peak have to have to be
             counted as a valid peak, in the current fft
+        - estimator : str, default "FFT"
+            How the impedance is found, one of ESTIMATORS. "FFT" takes the bin of
+            the fft closest to frequency_now, "Sine fit" fits a sine to the signals,
+            which is accurate with only a few tens of periods, see sine_fit.
+            "Segmented" averages overlapping segments and also gives the standard
+            deviation of the impedance, see segmented_fft.
 
         Does:
         ----------
@@ -109,8 +125,12 @@ class EIS_Sample:
         self.filter_type = filter_type
         self.beta_factor = beta_factor
         self.frequency_now = frequency_now
+        if estimator not in ESTIMATORS:
+            raise ValueError(f"Unknown estimator {estimator}. \n Must be one of {ESTIMATORS}.")
+        self.estimator = estimator
 
     @classmethod
+    @timed
     def from_file(
         cls,
         file_path,
@@ -124,6 +144,8 @@ class EIS_Sample:
         filter_type="Hann",
         beta_factor=4.2,
         frequency_now = 1,
+        estimator="FFT",
+        memory_map=False,
     ):
         """
         Parameters:
@@ -145,6 +167,11 @@ class EIS_Sample:
         - current_factor : float, default 0.01
             A factor to multiply the current data with. Relevant if a quasi
             measurment is done or some loging error is done.
+        - memory_map : bool, default False
+            If True the columns are taken from the memory mapped index of the
+            file (see raw_data.py), made the first time, instead of parsing all
+            of the text. Faster when the file is read more than once, as for
+            every channel pair, and only the used columns are loaded.
 
         Does:
         ----------
@@ -162,12 +189,28 @@ class EIS_Sample:
         A instance of the class with the parameters that are found in the file
         together with the ones passed in to this function.
         """
+        if memory_map:
+            capture = RawCapture(file_path, time_loc=time_loc)
+            return cls(
+                np.array(capture.column(voltage_loc)),
+                capture.column(current_loc) / correction_factor_current,
+                capture.sample_frequency,
+                voltage_proportion=voltage_proportion,
+                current_proportion=current_proportion,
+                filter_apply=filter_apply,
+                filter_type=filter_type,
+                beta_factor=beta_factor, 
+                frequency_now = frequency_now,
+                estimator=estimator,
+            )
         # Getting the header unit names
         header = np.loadtxt(file_path, skiprows=21, max_rows=1, dtype=str)
         # Making a bool array with True if the unit is in milli-
         is_in_m = ["m" in name for name in header]
         # Loading the data after skipping 23 rows
-        data = np.loadtxt(file_path, skiprows=23)
+        data = np.loadtxt(file_path, skiprows=23, ndmin=2)
+        if len(data) < 2:
+            raise ValueError(f"The file {file_path} has {len(data)} samples, at least two are needed")
         # Getting the different parts as seperate arrays and converting is in milli-
         time_data = data[:, time_loc]
         if is_in_m[time_loc]:
@@ -193,8 +236,118 @@ class EIS_Sample:
             filter_type=filter_type,
             beta_factor=beta_factor, 
             frequency_now = frequency_now,
+            estimator=estimator,
+        )
+
+    @classmethod
+    @timed
+    def from_file_segmented(
+        cls,
+        file_path,
+        time_loc=0,
+        voltage_loc=1,
+        current_loc=2,
+        correction_factor_current=1,
+        frequency_now=1,
+        chunk_rows=200000,
+        memory_map=False,
+    ):
+        """
+        Parameters:
+        ----------
+        The same as from_file, and
+        - chunk_rows : int, default 200000
+            The number of rows of the file in memory at the time
+
+        Does:
+        ----------
+        Reads the file a chunk at the time and feeds it to a SegmentedEstimator,
+        so very long captures can be processed without loading them. The time
+        signals are not kept.
+
+        Returns:
+        ----------
+        A instance of the class with the "Segmented" estimator, where the results
+        of the fft are already set, so fft should not be called.
+        """
+        columns = [time_loc, voltage_loc, current_loc]
+        if memory_map:
+            chunks = RawCapture(file_path, chunk_rows=chunk_rows).chunks(columns)
+        else:
+            chunks = read_chunks(file_path, columns, chunk_rows)
+        estimator = None
+        # The first rows are kept until there are two, for the sample frequency
+        first_rows = np.empty((0, len(columns)))
+        for chunk in chunks:
+            if estimator is None:
+                first_rows = np.concatenate([first_rows, chunk])
+                if len(first_rows) < 2:
+                    continue
+                sample_frequency = int(np.round(1 / (first_rows[1, 0] - first_rows[0, 0])))
+                estimator = SegmentedEstimator(sample_frequency, frequency_now)
+                chunk = first_rows
+            estimator.add(chunk[:, 1], chunk[:, 2] / correction_factor_current)
+        if estimator is None:
+            raise ValueError(f"The file {file_path} has {len(first_rows)} samples, at least two are needed")
+        sample = cls(
+            np.empty(0),
+            np.empty(0),
+            sample_frequency,
+            frequency_now=frequency_now,
+            estimator="Segmented",
         )
+        sample.set_segmented_result(estimator.result())
+        return sample
+
+    @staticmethod
+    def read_header(file_path):
+        """
+        Parameters:
+        ----------
+        - file_path : str
+            The relative/absolute filepath to pico text file
+
+        Does:
+        ----------
+        Reads the metadata written in the first 19 rows of the files made by
+        EIS_experiment.saveData. The picoscope code is a string of 0 and 1, four
+        for each picoscope, telling which channels that were active.
 
+        Returns:
+        ----------
+        A dict with the keys date, time, channels (bool array with shape
+        (num_picoscopes, 4)) and the keys used in the save_metadata dict of the
+        experiment: max_potential_channel, max_potential_stack, max_potential_cell,
+        cell_numbers, area, temperature, pressure, DC_current, AC_current, shunt
+        and selected_frequencies.
+        """
+        with open(file_path, "r") as f:
+            lines = [f.readline() for _ in range(19)]
+        values = [line.split("\t", 1)[-1].strip() if "\t" in line else "" for line in lines]
+
+        picoscope_code = values[3]
+        channels = np.array([int(digit) for digit in picoscope_code], dtype=bool).reshape(-1, 4)
+        # The code is padded with zeros, the current channel is always active on a used picoscope
+        channels = channels[: int(np.max(np.nonzero(channels[:, 0])[0], initial=-1)) + 1]
+
+        return {
+            "date": values[0],
+            "time": values[1],
+            "channels": channels,
+            "max_potential_channel": values[5],
+            "max_potential_stack": values[6],
+            "max_potential_cell": values[7],
+            "cell_numbers": values[9],
+            "area": values[10],
+            "temperature": values[11],
+            "pressure": values[12],
+            "DC_current": values[13],
+            "AC_current": values[14],
+            "shunt": values[15],
+            "selected_frequencies": values[18],
+        }
+
+    @timed
     def save_to_MMFILE(self, full_save_path):
         """
         Paramaters:
@@ -216,6 +369,7 @@ class EIS_Sample:
             for imp, freq in zip(self.impedance, self.fft_frequencies):
                 f.write(f"\n{freq}\t{imp.real}\t{imp.imag}")
 
+    @timed
     def fft(self):
         """
         Does:
@@ -234,6 +388,9 @@ class EIS_Sample:
         If a window function is applied to filter, this will apply this prior to the fft 
         and a normalization is applied according to the window function to the fft processed data.
 
+        If the estimator is "Sine fit" the spectrum is still computed for the plots,
+        but the frequency, impedance and amplitudes are replaced by those of sine_fit.
+
         Stored values:
         ----------
         - all_fft_frequencies : All the frequencies that are calculated
@@ -244,7 +401,14 @@ class EIS_Sample:
         - indicies : The intersection of the voltage and current_indicies
         - fft_frequencies : The frequency of the found peaks
         - impedance : The impedance calculated at the peaks
+        - voltage_amplitude : The amplitude of the voltage at the peaks
+        - current_amplitude : The amplitude of the current at the peaks
+        - z_std : The standard deviation of the impedance, nan if not known
         """
+        if self.estimator == "Segmented":
+            self.segmented_fft()
+            return
+
         # Sample size
         N = self.voltage.size
         self.beta_factor = float(self.beta_factor)
@@ -365,6 +529,8 @@ class EIS_Sample:
             """
             Finds the local maximum closest to the desired point.
             """
+            from scipy.signal import find_peaks
+
             # Get the local maxima
             maxima = find_peaks(np.abs(fft_current))
             #print(f"This is the maximas: {maxima[0]}")
@@ -402,6 +568,13 @@ class EIS_Sample:
         self.indicies = indicies
         self.fft_frequencies = fft_frequencies[indicies]
         self.impedance = fft_voltage[indicies] / fft_current[indicies]  # Corrected by THolm  
+        # Single sided amplitudes
+        self.voltage_amplitude = 2 * np.abs(fft_voltage[indicies])
+        self.current_amplitude = 2 * np.abs(fft_current[indicies])
+        self.z_std = np.full(len(self.fft_frequencies), np.nan)
+
+        if self.estimator == "Sine fit":
+            self.sine_fit()
        
 
         # We now make an additional sequence to try to correct the phase angle values for the plot
@@ -427,6 +600,98 @@ class EIS_Sample:
         ##Old_magnitude = np.abs(self.impedance[0])
         ##Old_phase_angle = 1
         
+    def sine_fit(self):
+        """
+        Does:
+        ----------
+        Estimates the impedance at frequency_now by fitting a sine to the voltage
+        and the current, instead of reading the fft bin. The bins are spaced by
+        sample_frequency / N, so the fft needs many periods to have a bin close
+        to the frequency, while the fit only needs a few tens of periods.
+
+        First the frequency is refined with an interpolated DFT: the current is
+        Hann windowed and the position of the peak between the largest bin k and
+        its largest neighbour is found from the ratio of their magnitudes, which
+        for the Hann window gives the offset (2 * ratio - 1) / (ratio + 1) bins.
+        Then a cosine, a sine, an offset and a linear drift at this frequency are
+        fitted to both signals by least squares. The window function settings are
+        not used, as the fit has no leakage to correct for.
+
+        Stored values:
+        ----------
+        - fft_frequencies : The fitted frequency, as an array of length one
+        - impedance : The impedance at the fitted frequency
+        - voltage_amplitude : The amplitude of the fitted voltage sine
+        - current_amplitude : The amplitude of the fitted current sine
+        """
+        N = self.current.size
+        resolution = self.sample_frequency / N
+        spectrum = np.abs(rfft(self.current * np.hanning(N)))
+
+        # The largest bin within 2 % or a few bins of the expected frequency
+        expected = int(np.clip(np.round(self.frequency_now / resolution), 1, spectrum.size - 2))
+        search = 3 + int(0.02 * expected)
+        low = max(expected - search, 1)
+        k = low + int(np.argmax(spectrum[low : min(expected + search + 1, spectrum.size - 1)]))
+        if spectrum[k + 1] > spectrum[k - 1]:
+            ratio = spectrum[k + 1] / spectrum[k]
+            offset = (2 * ratio - 1) / (ratio + 1)
+        else:
+            ratio = spectrum[k - 1] / spectrum[k]
+            offset = -(2 * ratio - 1) / (ratio + 1)
+        frequency = (k + offset) * resolution
+
+        # Least squares fit of a * cos + b * sin + offset + drift, the phasor is a - jb
+        time_data = np.arange(N) / self.sample_frequency
+        phase = 2 * np.pi * frequency * time_data
+        basis = np.column_stack(
+            [np.cos(phase), np.sin(phase), np.ones(N), time_data - time_data.mean()]
+        )
+        coefficients = np.linalg.lstsq(
+            basis, np.column_stack([self.voltage, self.current]), rcond=None
+        )[0]
+        voltage_phasor, current_phasor = coefficients[0] - 1j * coefficients[1]
+
+        self.fft_frequencies = np.array([frequency])
+        self.impedance = np.array([voltage_phasor / current_phasor])
+        self.voltage_amplitude = np.array([np.abs(voltage_phasor)])
+        self.current_amplitude = np.array([np.abs(current_phasor)])
+        self.z_std = np.array([np.nan])
+
+    def segmented_fft(self):
+        """
+        Does:
+        ----------
+        Estimates the impedance at frequency_now from overlapping Hann windowed
+        segments of the voltage and current, see SegmentedEstimator. Used by fft
+        for the "Segmented" estimator when the signals are in memory, the same
+        result is found from the file with from_file_segmented.
+        """
+        if len(self.voltage) < 2:
+            raise ValueError(f"The sample has {len(self.voltage)} samples, at least two are needed")
+        estimator = SegmentedEstimator(self.sample_frequency, self.frequency_now)
+        estimator.add(self.voltage, self.current)
+        self.set_segmented_result(estimator.result())
+
+    def set_segmented_result(self, result):
+        """
+        Stores the result of a SegmentedEstimator in the same values as fft. The
+        spectrum is the average of the segments, so its resolution is that of
+        one segment.
+        """
+        index = np.array([result["index"]])
+        self.all_fft_frequencies = result["all_fft_frequencies"]
+        self.all_fft_voltage = result["all_fft_voltage"]
+        self.all_fft_current = result["all_fft_current"]
+        self.voltage_indicies = index
+        self.current_indicies = index
+        self.indicies = index
+        self.fft_frequencies = np.array([result["frequency"]])
+        self.impedance = np.array([result["impedance"]])
+        self.voltage_amplitude = np.array([result["voltage_amplitude"]])
+        self.current_amplitude = np.array([result["current_amplitude"]])
+        self.z_std = np.array([result["z_std"]])
+
     @staticmethod
     def get_full_save_path(save_path, file_path, voltage_loc, add_loc_save):
         """
@@ -565,6 +830,8 @@ class EIS_Sample:
         frequency, where yellow corresponds to high frequency and
         blue to low.
         """
+        from matplotlib.colors import LogNorm
+
         axis.set_xlabel(r"Re$Z$  [$\Omega$]")
         axis.set_ylabel(r"-Im$Z$ [$\Omega$]")
         axis.grid()
@@ -579,7 +846,7 @@ class EIS_Sample:
         figure.tight_layout()
         axis.axis("equal")
 
-    def plot_nyquist_canvas(self, canvas: PlotCanvas):
+    def plot_nyquist_canvas(self, canvas: "PlotCanvas"):
         """
         Parameters:
         ----------
@@ -608,6 +875,8 @@ class EIS_Sample:
         also the dots are colerd based on the loagarith of there
         frequency.
         """
+        from matplotlib.colors import LogNorm
+
         axises[0].scatter(
             self.fft_frequencies,
             np.abs(self.impedance),
@@ -631,7 +900,7 @@ class EIS_Sample:
 
         figure.tight_layout()
 
-    def plot_bode_canvas(self, canvas: PlotCanvas):
+    def plot_bode_canvas(self, canvas: "PlotCanvas"):
         """
         Parameters:
         ----------
@@ -663,6 +932,8 @@ class EIS_Sample:
         The color of the dots are given by the logarithm of
         there frequency.
         """
+        from matplotlib.colors import LogNorm
+
         axises[0].scatter(
             self.all_fft_frequencies[self.voltage_indicies],
             np.abs(self.all_fft_voltage[self.voltage_indicies]),
@@ -702,7 +973,7 @@ class EIS_Sample:
 
         figure.tight_layout()
 
-    def plot_fft_spectrum_canvas(self, canvas: PlotCanvas):
+    def plot_fft_spectrum_canvas(self, canvas: "PlotCanvas"):
         """
         Parameters:
         ----------
@@ -16,16 +16,18 @@ import pandas as pd         # For sorting file structure
 import time
 import numpy as np
 from datetime import datetime # For sorting dates
-from dependencies.RR_GP_DRT import fit_DRT
-import dependencies.DRT_fitting
 import tkinter as tk
-from tkinter import ttk
-from tkinter import filedialog
-from dependencies.tkinter_window import tkinter_class
+from dependencies.impedance_store import ImpedanceStore
+from dependencies.circuit_handler import IMPLEMENTED_CIRCUITS
+from dependencies.parallel_fitting import cell_chains, fit_chains, fit_models
+from dependencies.model_selection import CRITERIA, information_criteria, rank_models
+from dependencies.warm_start_store import CONDITION_KEYS, WarmStartStore
+from dependencies.profiling import timed
 
 
 
 
+@timed
 def retrieve_data(interface):
     """
     When
@@ -45,14 +47,19 @@ def retrieve_data(interface):
     interface.tw.log(f"Started retrieving data.")
     start_time = time.time()
 
-    checkbool = False
-
     df = pd.DataFrame(data={})
     # Iterating through the directory
     for root, dirs, files in os.walk(interface.default_path, topdown=True):  
         for dir_name in dirs:
             path_to_params = os.path.join(interface.default_path, dir_name, 'Parameters.txt')
 
+            # Runs with an impedance store are read from it with one read
+            store = ImpedanceStore(os.path.join(interface.default_path, dir_name))
+            if store.exists():
+                interface.tw.log(f"Found impedance store in {dir_name}")
+                dfs.extend(retrieve_store(interface, store, dir_name))
+                continue
+
             # Only running the following code if the Parameters.txt file exists
             if os.path.exists(path_to_params):
                 interface.tw.log(f"Found parameters.txt in {dir_name}")
@@ -69,7 +76,6 @@ def retrieve_data(interface):
                 dccurrent_text      = lines[7].strip('\n').strip().split("\t").pop(1)
                 accurrent_text      = lines[8].strip('\n').strip().split("\t").pop(1)
 
-                params_string       = date_text + "_" + time_text + "_" + area_text + "_" + temperature_text + "_" + pressure_text + "_" + dccurrent_text + "_" + accurrent_text # F.ex 2023-05-28-_1401-38_86_50_1_3.4_40
                 cell_name_array     = lines[3].strip('\n').strip().split("\t").pop(1).split(',') # F.ex ['2', '3', '4', '5', '6', '7']
 
                 # Iterate throught the files within the folder, which wave been stored in the temp_files_in_watch-folder
@@ -98,67 +104,15 @@ def retrieve_data(interface):
                         path_to_file = os.path.join(root,filename_here)
                         f = open(path_to_file,'r')
                         lines = f.readlines()
-                        # Arrays that will be filled with values 
-                        frequencies = []
-                        realvalues = []
-                        imaginaryvalues = []                        
-                        magnitude = []
-                        phase_angle = []
-
-
-                        for i in range(1,len(lines)):
-                            # Check if line has values (ie. not the uppermost line). Does probably not need the if-statement since all files are on the same format
-                            if any(chr.isdigit() for chr in lines[i]):
-                                # Retrieving the data from the files, and some basic calculations to get the magnitue and phase angle 
-                                frequencies.append(lines[i].strip('\n').strip().split("\t")[0])
-                                # print(f"area_text = {area_text}")
-
-                                real_norm = float(lines[i].strip('\n').strip().split("\t")[1])
-                                imag_norm = -float(lines[i].strip('\n').strip().split("\t")[2])
-                                phase_angle_value = np.arctan2(imag_norm,real_norm)*180/math.pi
-                                phase_angle.append(phase_angle_value)
-                                if interface.tw.normalize_checkbox_var.get() == 1: # Normalizing
-                                    real_norm *= float(area_text)
-                                    imag_norm *= float(area_text)
-                                realvalues.append(real_norm)
-                                imaginaryvalues.append(imag_norm)
-                                magnitude_norm = np.sqrt(real_norm**2 + imag_norm**2)
-                                magnitude.append(magnitude_norm)
-
-                        if checkbool == True: # To be deleted
-                            print(f"frequencies = {frequencies}")
-                            print(f"realvalues = {realvalues}")
-                            print(f"imaginaryvalues = {imaginaryvalues}")
-                            checkbool = False
-
-                        params_string_individual_cell = "data_" + params_string + "_" + cell_name_array[num]
-
-                        # Creating a dataframe that includes all the individual values retrieved from the files in the subdirectory
-                        temp_df = pd.DataFrame({'frequencies': frequencies, 'realvalues': realvalues, 'imaginaryvalues': imaginaryvalues, 'magnitude': magnitude, 'phase_angle': phase_angle})
-                        temp_df = temp_df.astype(float)
-
-                        split_string = params_string_individual_cell.split('_')
-                        temp_df['cell_name'] = 'Cell '+ str(split_string[8])
-                        temp_df['date'] = str(datetime.strptime(params_string_individual_cell.split('_')[1][:], '%Y-%m-%d').date())
-                        temp_df['time'] = str(datetime.strptime(params_string_individual_cell.split('_')[2][:], '%H%M-%S').time())
-                        temp_df['temp'] = str(split_string[4])+"\u00b0C"
-                        temp_df['pressure'] = str(split_string[5]+" bar")
-                        temp_df['dc'] = str(split_string[6]+" A")
-                        temp_df['ac'] = str(split_string[7]+" %")
-                        temp_df['area'] = str(split_string[3]+" cm^2")
-                        temp_df['dir_name'] = dir_name
-                        temp_df['path_to_file'] = path_to_file
-
-                        # Normalizing, if checkbox is checked
-                        if interface.tw.normalize_checkbox_var.get() == 1:
-                            # temp_df['realvalues'] *= float(split_string[3])
-                            # temp_df['imaginaryvalues'] *= float(split_string[3])
-                            # temp_df['magnitude'] *= float(split_string[3])
-                            temp_df['normalized'] = 'True'
-                        else:
-                            temp_df['normalized'] = 'False'
-
-                        dfs.append(temp_df.copy())
+                        f.close()
+                        # Check if line has values (ie. not the uppermost line)
+                        values = [line.strip('\n').strip().split("\t") for line in lines[1:] if any(chr.isdigit() for chr in line)]
+                        values = np.array(values, dtype=float).reshape(-1, 3)
+
+                        run_parameters = {'date': date_text, 'time': time_text, 'area': area_text, 'temperature': temperature_text,
+                                          'pressure': pressure_text, 'dc': dccurrent_text, 'ac': accurrent_text}
+                        dfs.append(cell_dataframe(interface, values[:, 0], values[:, 1], values[:, 2], cell_name_array[num],
+                                                  run_parameters, dir_name, path_to_file))
 
 
     if dfs == []: # In case no dataframes has been created
@@ -167,40 +121,157 @@ def retrieve_data(interface):
         df = pd.concat(dfs, ignore_index=True) # Combining all smaller dataframe to one big one
     interface.tw.log(f"Finished retrieving. Total time: {round(time.time()-start_time, 2)} sec.")
     return df.drop_duplicates().copy() 
-    
 
-def retrieve_process(interface, df, dir_name):
+
+def cell_dataframe(interface, frequencies, z_real, z_imag, cell_name, run_parameters, dir_name, path_to_file):
     """
-    Does
+    Parameters
     ----------
-    Logs that it has started to process. Then it initiates a inherited class of the
-    BaseCircuitHandles from the circuit_process_and_plot.py. Then the
-    BaseCircuitHandler methods process and plot are called.
-    Note
+    - frequencies, z_real, z_imag: The measured impedance of the cell, as in the .mmfiles
+    - cell_name: The number of the cell
+    - run_parameters: dict with date, time, area, temperature, pressure, dc and ac of the run, as in Parameters.txt
+    - dir_name: The name of the run folder in Total_mm
+    - path_to_file: The total_mmfile of the cell, used to match the data with the circuit fits
+
+    Returns
     ----------
-    If an error occur or input is invalid, this will be logged to the message board
-    and the function will terminate.
+    The dataframe of one cell in one run, with the columns used by the Bokeh-plots.
+    The phase angle is found before normalizing, and if the normalize checkbox is
+    checked the impedance is multiplied with the area.
     """
+    real_norm = np.asarray(z_real, dtype=float)
+    imag_norm = -np.asarray(z_imag, dtype=float)
+    phase_angle = np.arctan2(imag_norm, real_norm)*180/math.pi
+    if interface.tw.normalize_checkbox_var.get() == 1: # Normalizing
+        real_norm = real_norm * float(run_parameters['area'])
+        imag_norm = imag_norm * float(run_parameters['area'])
+    magnitude = np.sqrt(real_norm**2 + imag_norm**2)
+
+    # Creating a dataframe that includes all the individual values retrieved from the files in the subdirectory
+    temp_df = pd.DataFrame({'frequencies': frequencies, 'realvalues': real_norm, 'imaginaryvalues': imag_norm, 'magnitude': magnitude, 'phase_angle': phase_angle})
+    temp_df = temp_df.astype(float)
+
+    temp_df['cell_name'] = 'Cell '+ str(cell_name)
+    temp_df['date'] = str(datetime.strptime(run_parameters['date'], '%Y-%m-%d').date())
+    temp_df['time'] = str(datetime.strptime(run_parameters['time'], '%H%M-%S').time())
+    temp_df['temp'] = str(run_parameters['temperature'])+"\u00b0C"
+    temp_df['pressure'] = str(run_parameters['pressure']+" bar")
+    temp_df['dc'] = str(run_parameters['dc']+" A")
+    temp_df['ac'] = str(run_parameters['ac']+" %")
+    temp_df['area'] = str(run_parameters['area']+" cm^2")
+    temp_df['dir_name'] = dir_name
+    temp_df['path_to_file'] = path_to_file
+
+    # Normalizing, if checkbox is checked
+    if interface.tw.normalize_checkbox_var.get() == 1:
+        temp_df['normalized'] = 'True'
+    else:
+        temp_df['normalized'] = 'False'
+    return temp_df
 
-    dir_path = os.path.join(interface.default_path,dir_name)
-    # circuit_handler = interface.find_circuit_type(
-    #     dir_name, ''
-    # )
 
-    circuit_handler = interface.find_circuit_type(
-        dir_path, ''
-    )
-    temp_output_data, temp_variables, temp_files_in_watch, temp_Z_fits = circuit_handler.process()
+def retrieve_store(interface, store, dir_name):
+    """
+    Does
+    ----------
+    Reads the impedance store of a run and returns one dataframe per cell, the same
+    as retrieve_data makes from the total_mmfiles and Parameters.txt. The data is
+    filtered on the selected frequencies in the same way as when the total_mmfiles
+    are made, and path_to_file is set to the total_mmfile the store is exported to.
+    """
+    merger = store.merger(log=interface.tw.log)
+    metadata = store.metadata
+    run_parameters = {'date': metadata['run'][:10], 'time': metadata['run'][11:], 'area': metadata['area'],
+                      'temperature': metadata['temperature'], 'pressure': metadata['pressure'],
+                      'dc': metadata['DC_current'], 'ac': metadata['AC_current']}
+    dfs = []
+    for channel in store.channel_numbers():
+        if channel not in merger.records:
+            continue
+        frequencies, impedance = merger.channel_data(channel)
+        path_to_file = os.path.join(interface.default_path, dir_name, f"total_mmfile_{channel}.mmfile")
+        dfs.append(cell_dataframe(interface, frequencies, impedance.real, impedance.imag, store.cell_of_channel(channel),
+                                  run_parameters, dir_name, path_to_file))
+    return dfs
+    
 
-    # Adding the predicted impedances to a df
-    temp_impedance_df = df.loc[(df['dir_name'] == dir_name), ['frequencies', 'cell_name', 'date', 'path_to_file', 'temp', 'dc', 'ac', 'pressure']]
-    for i, file_path in enumerate(circuit_handler.files_in_watch):
-        temp_impedance_df.loc[temp_impedance_df['path_to_file'] == file_path, 'impedance'] = temp_Z_fits[file_path]
-    temp_impedance_df['dir_name'] = dir_name
+def written_spectra(interface, df, log_prefix):
+    """
+    Returns df without the spectra whose total_mmfile is not written yet. A run is read
+    from its impedance store while it is measured, see retrieve_store, but its
+    total_mmfiles are only written by save_total_mm when the run ends, and the circuit
+    handlers read the files. The skipped spectra are fitted when their files exist.
+    """
+    file_paths = df['path_to_file'].unique()
+    missing = [file_path for file_path in file_paths if not os.path.exists(file_path)]
+    if len(missing) == 0:
+        return df
+    interface.tw.log(f"{log_prefix}: Skipping {len(missing)} spectra of runs in progress until their total_mmfiles are written.")
+    return df.loc[~df['path_to_file'].isin(missing)]
 
-    return temp_output_data, temp_variables, temp_files_in_watch, temp_impedance_df
-    
 
+def output_frame(files, output_data, variables):
+    """
+    Returns the output data of a circuit handler as a dataframe with one row per
+    file, the column path_to_file and one column for each of the variables, to be
+    merged with the files of the df made by retrieve_data.
+    """
+    output_df = pd.DataFrame(np.asarray(output_data, dtype=float), columns=list(variables))
+    output_df.insert(0, 'path_to_file', list(files))
+    return output_df
+
+
+def merge_impedances(impedance_df, Z_fits):
+    """
+    Parameters:
+    ----------
+    - impedance_df: pandas DataFrame
+        Rows of the df made by retrieve_data, one per frequency of each file, in the order of the frequencies
+    - Z_fits: dict
+        From the path_to_file of a file to the fitted impedance at its frequencies
+
+    Returns:
+    ----------
+    impedance_df with the fitted impedance of each row in the column impedance,
+    joined on the file and the position of the row within the file.
+    """
+    impedance_df = impedance_df.assign(position=impedance_df.groupby('path_to_file').cumcount())
+    file_paths = list(Z_fits.keys())
+    Z_values = [np.asarray(Z_fits[file_path], dtype=complex).ravel() for file_path in file_paths]
+    lengths = [len(Z) for Z in Z_values]
+    fits_df = pd.DataFrame({
+        'path_to_file': np.repeat(np.array(file_paths, dtype=object), lengths),
+        'position': np.concatenate([np.arange(length) for length in lengths]) if lengths else np.array([], dtype=int),
+        'impedance': np.concatenate(Z_values) if Z_values else np.array([], dtype=complex),
+    })
+    return impedance_df.merge(fits_df, on=['path_to_file', 'position'], how='left').drop(columns='position')
+
+
+def get_file_runs(df):
+    """Returns a dataframe indexed by path_to_file with the cell, run, conditions and run_time of each file, for the warm start store"""
+    file_runs = df.drop_duplicates('path_to_file').set_index('path_to_file')
+    return file_runs[['cell_name', 'dir_name'] + CONDITION_KEYS].assign(run_time=file_runs['date'] + ' ' + file_runs['time'])
+
+
+def lookup_warm_starts(warm_start_store, circuit_string, chains, file_runs):
+    """Returns a dict from the first file of each chain to the parameters of the closest earlier fit of its cell, for the chains that have one"""
+    warm_starts = {}
+    for file_paths in chains.values():
+        run = file_runs.loc[file_paths[0]]
+        warm_start = warm_start_store.lookup(circuit_string, run['cell_name'], run['run_time'], run[CONDITION_KEYS].to_dict())
+        if warm_start is not None:
+            warm_starts[file_paths[0]] = warm_start
+    return warm_starts
+
+
+def update_warm_starts(warm_start_store, circuit_string, fitted_parameters, file_runs):
+    """Adds the fitted parameters of each file, a dict from path_to_file to parameters, to the warm start store"""
+    for file_path, parameters in fitted_parameters.items():
+        run = file_runs.loc[file_path]
+        warm_start_store.update(circuit_string, run['cell_name'], run['dir_name'], run['run_time'], run[CONDITION_KEYS].to_dict(), parameters)
+
+
+@timed
 def fit_with_circuit(interface, df):
     """
     When
@@ -210,6 +281,11 @@ def fit_with_circuit(interface, df):
     Does
     ----------
     Fits the data using the selected circuit, and also formats this in such a way that it can be plotted. 
+    The spectra of each cell are fitted in time order with a warm start, and the cells are fitted in
+    parallel by interface.circuit_fit_workers processes, see parallel_fitting.py. If batch fitting is
+    checked the spectra are instead fitted many at the time, see do_batch_steps in circuit_handler.py.
+    The first fit of each cell starts from the parameters of the closest earlier fit of the cell in the
+    warm start store of the Total_mm folder, and the new fits are added to it, see warm_start_store.py.
     
     Note
     ----------
@@ -218,6 +294,7 @@ def fit_with_circuit(interface, df):
     interface.tw.log('Started circuit-fitting:')
     start_time = time.time()
     current_time = start_time
+    df = written_spectra(interface, df, "- Circuit-fitting")
 
     # print(df)
     # circuit_df = df[['cell_name', 'date', 'dir_name', 'path_to_file', 'area', 'frequencies']]
@@ -226,13 +303,34 @@ def fit_with_circuit(interface, df):
     # impedance_df = df[['path_to_file',  'frequencies', 'cell_name', 'date', 'dir_name']]
     # impedance_df = impedance_df.drop_duplicates()
     base_variables = []
-
-
-    impedance_dfs=[]
-    dir_names = circuit_df['dir_name'].unique()
-    for i in range(len(dir_names)):
-        temp_output_data, temp_base_variables, temp_files_in_watch, temp_impedance_df = retrieve_process(interface, df, dir_names[i])
-        impedance_dfs.append(temp_impedance_df)
+    output_dfs = []
+
+
+    Z_fits = {}
+    chains = cell_chains(circuit_df)
+    num_files = sum(len(file_paths) for file_paths in chains.values())
+    num_fitted = 0
+    batch_fit = interface.tw.batch_fit_checkbox_var.get() == 1
+    circuit_string = interface.tw.circuit_string.get()
+
+    # The run and conditions of each file, for the warm start store
+    file_runs = get_file_runs(df)
+    warm_start_store = WarmStartStore(interface.default_path)
+    warm_starts = lookup_warm_starts(warm_start_store, circuit_string, chains, file_runs)
+    interface.tw.log(f"- Circuit-fitting: Starting {len(warm_starts)} out of {len(chains)} cells from earlier fits.")
+
+    fitted_chains = fit_chains(circuit_string, chains, interface.circuit_fit_workers, batch_fit, warm_starts)
+    for cell_name, result, error in fitted_chains:
+        if error is not None:
+            interface.tw.log(f"- Circuit-fitting: Unable to fit {cell_name}: {error}")
+            continue
+        for file_path, message in result["failed"].items():
+            interface.tw.log(f"- Circuit-fitting: Unable to fit {file_path}: {message}")
+        update_warm_starts(warm_start_store, circuit_string, result["parameters"], file_runs)
+        temp_output_data = result["output_data"]
+        temp_base_variables = result["variables"]
+        temp_files_in_watch = result["files"]
+        Z_fits.update(result["Z_fits"])
 
         # Normalizing the fitted variables
         if interface.tw.normalize_checkbox_var.get() == 1:
@@ -247,17 +345,23 @@ def fit_with_circuit(interface, df):
                     # self.units[i] += f"{self.area_str}"
                     temp_output_data[:, j] *= float(interface.area_size)
         
-        if i == 0:
-            for base_variable in temp_base_variables:
-                base_variables.append(base_variable)
-                circuit_df[base_variable] = None
-        for j, filepath in enumerate(temp_files_in_watch):
-            for k, base_variable in enumerate(temp_base_variables):
-                circuit_df.loc[circuit_df['path_to_file'] == filepath, base_variable] = temp_output_data[j][k]
-
-        interface.tw.log(f"- Circuit-fitting: Done with {i+1} out of {len(dir_names)} folders. Time: {round(time.time()-current_time,2)} sec.")
+        if len(base_variables) == 0:
+            base_variables.extend(temp_base_variables)
+        output_dfs.append(output_frame(temp_files_in_watch, temp_output_data, temp_base_variables))
+
+        num_fitted += len(temp_files_in_watch)
+        interface.tw.log(f"- Circuit-fitting: Done with {num_fitted} out of {num_files} spectra. Time: {round(time.time()-current_time,2)} sec.")
         current_time = time.time()
 
+    try:
+        warm_start_store.save()
+    except OSError as e:
+        interface.tw.log(f"- Circuit-fitting: Unable to save the warm start store: {e}")
+
+    # Joining the fitted variables of all the files to the files in one merge, the files that were not fitted get NaN
+    if len(output_dfs) > 0:
+        circuit_df = circuit_df.merge(pd.concat(output_dfs, ignore_index=True), on='path_to_file', how='left')
+
     # Add column with the earliest date
     earliest_date = pd.to_datetime(circuit_df['date']).min()
     circuit_df['hours_since_first_date'] = (pd.to_datetime(circuit_df['date']) - earliest_date).dt.total_seconds() / 3600
@@ -300,10 +404,14 @@ def fit_with_circuit(interface, df):
             circuit_df['char_freq' + time_val[-1]] = 1 / circuit_df[time_val]
 
 
-    impedance_df = pd.concat(impedance_dfs, ignore_index=True).drop_duplicates().copy()
+    # Adding the predicted impedances to a df
+    impedance_df = df.loc[df['path_to_file'].isin(Z_fits.keys()), ['frequencies', 'cell_name', 'date', 'path_to_file', 'temp', 'dc', 'ac', 'pressure', 'dir_name']]
+    impedance_df = merge_impedances(impedance_df, Z_fits)
+    impedance_df = impedance_df.drop_duplicates().copy()
     # Create new columns only including the real- and imag-parts of the impedance in the impedance_df
-    impedance_df['impedance_real'] = impedance_df['impedance'].apply(lambda x: x.real)
-    impedance_df['impedance_imag'] = impedance_df['impedance'].apply(lambda x: x.imag)
+    Z_values = impedance_df['impedance'].to_numpy(dtype=complex)
+    impedance_df['impedance_real'] = Z_values.real
+    impedance_df['impedance_imag'] = Z_values.imag
     # Inverting the imaginary part
     impedance_df['impedance_imag'] *= -1 
     # Removing the 'impedance'-column from the dataframe
@@ -330,7 +438,83 @@ def fit_with_circuit(interface, df):
     return circuit_df.drop_duplicates().copy(), impedance_df.drop_duplicates().copy(), base_variables
 
 
+@timed
+def compare_circuits(interface, df):
+    """
+    When
+    ----------
+    Called from the process-function, if comparing the circuits is checked
+
+    Does
+    ----------
+    Fits every circuit in IMPLEMENTED_CIRCUITS to every spectrum, with the chains of all the circuits
+    in the same pool of interface.circuit_fit_workers processes, see fit_models in parallel_fitting.py,
+    and ranks the circuits of each spectrum by the criterion chosen in the window, see model_selection.py.
+    The fits start from and are added to the warm start store in the same way as in fit_with_circuit.
 
+    Returns
+    ----------
+    A dataframe with one row per spectrum and circuit, with the cell, run and date, the circuit, its
+    number of parameters, the fitted parameters (not normalized), the values of the CRITERIA, the rank
+    of the circuit for the spectrum and if it is the best.
+    """
+    interface.tw.log('Started comparing the circuits:')
+    start_time = time.time()
+    df = written_spectra(interface, df, "- Comparing circuits")
+
+    files_df = df[['cell_name', 'date', 'dir_name', 'path_to_file']].drop_duplicates()
+    chains = cell_chains(files_df)
+    circuit_strings = list(IMPLEMENTED_CIRCUITS.keys())
+    batch_fit = interface.tw.batch_fit_checkbox_var.get() == 1
+
+    file_runs = get_file_runs(df)
+    warm_start_store = WarmStartStore(interface.default_path)
+    warm_starts = {
+        circuit_string: lookup_warm_starts(warm_start_store, circuit_string, chains, file_runs)
+        for circuit_string in circuit_strings
+    }
+
+    rows = []
+    fitted_chains = fit_models(circuit_strings, chains, interface.circuit_fit_workers, batch_fit, warm_starts)
+    for circuit_string, cell_name, result, error in fitted_chains:
+        if error is not None:
+            interface.tw.log(f"- Comparing circuits: Unable to fit {cell_name} to {circuit_string}: {error}")
+            continue
+        for file_path, message in result["failed"].items():
+            interface.tw.log(f"- Comparing circuits: Unable to fit {file_path} to {circuit_string}: {message}")
+        update_warm_starts(warm_start_store, circuit_string, result["parameters"], file_runs)
+        chiN = result["output_data"][:, result["variables"].index("Chivalue")]
+        for file_path, file_chiN in zip(result["files"], chiN):
+            if file_path in result["failed"]:
+                continue
+            parameters = result["parameters"][file_path]
+            rows.append({
+                'path_to_file': file_path,
+                'circuit': circuit_string,
+                'num_parameters': len(parameters),
+                'num_frequencies': len(result["Z_fits"][file_path]),
+                'chiN': file_chiN,
+                'parameters': list(parameters),
+            })
+
+    try:
+        warm_start_store.save()
+    except OSError as e:
+        interface.tw.log(f"- Comparing circuits: Unable to save the warm start store: {e}")
+
+    model_df = pd.DataFrame(rows, columns=['path_to_file', 'circuit', 'num_parameters', 'num_frequencies', 'chiN', 'parameters'])
+    criteria = information_criteria(model_df['chiN'], model_df['num_frequencies'], model_df['num_parameters'])
+    for criterion in CRITERIA:
+        model_df[criterion] = criteria[criterion]
+    model_df = files_df.merge(model_df, on='path_to_file', how='inner')
+    model_df = rank_models(model_df, interface.tw.model_criterion.get())
+
+    interface.tw.log(f"Finished comparing {len(circuit_strings)} circuits. Total time: {round(time.time()-start_time,2)} sec.")
+    return model_df
+
+
+
+@timed
 def fit_with_DRT(interface, df):
     """
     This function is called from dashboard_for_plotting_and_fitting by the process method.
@@ -352,29 +536,34 @@ def fit_with_DRT(interface, df):
     DRT_df : pandas DataFrame
         DataFrame containing data produced by DRT fitting.
     """
+    # The DRT fitting is imported here, as hyperopt and impedance take long to import
+    from dependencies.RR_GP_DRT import fit_DRT
+    from dependencies import kernel_tables
+
     interface.tw.log('Started DRT-fitting:')
     start_time   = time.time()
+    kernel_tables.prepare(lambda message: interface.tw.log(f"- DRT-fitting: {message}"))
 
 
     dfs = []
-    # Iterate through dits
-    dir_names           = df['dir_name'].unique()
-    cell_names          = df['cell_name'].unique()
+    # Iterate through dits. Only the cells a run has are fitted, an incremental process
+    # passes a few spectra of some runs
+    dir_groups          = df.groupby('dir_name', sort=False)
     
     if interface.log_hyperparameters:
         log_file = open("hyppar_log.csv", "w")
         log_file.write(f"dataset,sigma_n,sigma_f,ell,loss\n")
         log_file.close()
 
-    for i, dir_name in enumerate(dir_names):
-        for cell_name in cell_names:
+    for i, (dir_name, dir_df) in enumerate(dir_groups):
+        for cell_name, cell_df in dir_df.groupby('cell_name', sort=False):
             interface.current = f"{cell_name} in {dir_name}"
 
-            real_vals = np.array(df.loc[(df["dir_name"] == dir_name) & (df["cell_name"] == cell_name), 'realvalues'].tolist())
-            imag_vals = np.array(df.loc[(df["dir_name"] == dir_name) & (df["cell_name"] == cell_name), 'imaginaryvalues'].tolist())
+            real_vals = np.array(cell_df['realvalues'].tolist())
+            imag_vals = np.array(cell_df['imaginaryvalues'].tolist())
             Z_exp = real_vals - 1j*imag_vals #Imagenary numbers must be inverted
 
-            freq_vec = np.array(df.loc[(df["dir_name"] == dir_name) & (df['cell_name'] == cell_name), 'frequencies'].tolist())
+            freq_vec = np.array(cell_df['frequencies'].tolist())
             #dict with result data to be passed and filled
             data = {
                     'freq_vec_star'         :np.zeros(interface.DRT_range_pred), 
@@ -388,7 +577,7 @@ def fit_with_DRT(interface, df):
                 fit_DRT(Z_exp, freq_vec, data, interface)
                 # Insert collected data into dataframe
                 temp_df = pd.DataFrame.from_dict(data)
-                temp_date = df.loc[df['dir_name'] == dir_name]['date'].values[0]
+                temp_date = dir_df['date'].values[0]
 
                 temp_df['cell_name']    = cell_name
                 temp_df['dir_name']     = dir_name
@@ -402,12 +591,13 @@ def fit_with_DRT(interface, df):
         interface.tw.log(f"{dir_name} folder done")
             
 
-    interface.tw.log(f"- DRT-fitting: Done with {i+1} out of {len(dir_names)} folders. Time: {round(time.time()-start_time,2)} sec.")
+    interface.tw.log(f"- DRT-fitting: Done with {i+1} out of {dir_groups.ngroups} folders. Time: {round(time.time()-start_time,2)} sec.")
 
     DRT_df = pd.concat(dfs, ignore_index=True).drop_duplicates()
 
     return DRT_df
     
+@timed
 def predict_impedances(interface, df):
     """
     When
@@ -422,29 +612,30 @@ def predict_impedances(interface, df):
     The data is stored in a Pandas Dataframe, and this df will be used at the source for the Bokeh-plot.
     The interpolation of the data can be improved, since the DRT-method only fits the imaginary part of the experimental impedances.
     """
+    import dependencies.DRT_fitting
+    from dependencies import kernel_tables
+
     interface.tw.log('Started predicting impedances:')
     start_time   = time.time()
+    kernel_tables.prepare(lambda message: interface.tw.log(f"- Predicting impedances: {message}"))
     current_time = start_time
 
     dfs = []
-    # Iterate through dits
-    dir_names           = df['dir_name'].unique()
-    cell_names          = df['cell_name'].unique()
-
-    # print(f"dir_names = {dir_names}")
-    for i, dir_name in enumerate(dir_names):
+    # Iterate through dits. Only the cells a run has are predicted, an incremental process
+    # passes a few spectra of some runs
+    for i, (dir_name, dir_df) in enumerate(df.groupby('dir_name', sort=False)):
         # Iterate_through cells
-        temp_date = df.loc[df['dir_name'] == dir_name]['date'].values[0]
-        for cell_name in cell_names:
+        temp_date = dir_df['date'].values[0]
+        for cell_name, cell_df in dir_df.groupby('cell_name', sort=False):
 
-            real_vals = np.array(df.loc[(df["dir_name"] == dir_name) & (df['cell_name'] == cell_name), 'realvalues'].tolist())
-            imag_vals = np.array(df.loc[(df["dir_name"] == dir_name) & (df['cell_name'] == cell_name), 'imaginaryvalues'].tolist())
+            real_vals = np.array(cell_df['realvalues'].tolist())
+            imag_vals = np.array(cell_df['imaginaryvalues'].tolist())
 
             try:
                 # Perform DRT
                 freq_vec_star, Z_re_vec_star, Z_im_vec_star, error_lower, error_upper = dependencies.DRT_fitting.predict_impedance(
                     interface, 
-                    df.loc[(df["dir_name"] == dir_name) & (df['cell_name'] == cell_name), 'frequencies'].tolist(),
+                    cell_df['frequencies'].tolist(),
                     real_vals,
                     imag_vals
                 ) 
@@ -465,10 +656,10 @@ def predict_impedances(interface, df):
             temp_df['dir_name']     = dir_name
             temp_df['date']         = temp_date
 
-            temp_df['temp']         = df.loc[(df["dir_name"] == dir_name) & (df['cell_name'] == cell_name), 'temp'].unique()[0]
-            temp_df['pressure']         = df.loc[(df["dir_name"] == dir_name) & (df['cell_name'] == cell_name), 'pressure'].unique()[0]
-            temp_df['dc']         = df.loc[(df["dir_name"] == dir_name) & (df['cell_name'] == cell_name), 'dc'].unique()[0]
-            temp_df['ac']         = df.loc[(df["dir_name"] == dir_name) & (df['cell_name'] == cell_name), 'ac'].unique()[0]
+            temp_df['temp']         = cell_df['temp'].unique()[0]
+            temp_df['pressure']         = cell_df['pressure'].unique()[0]
+            temp_df['dc']         = cell_df['dc'].unique()[0]
+            temp_df['ac']         = cell_df['ac'].unique()[0]
 
 
             dfs.append(temp_df)
@@ -0,0 +1,226 @@
+"""
+Impedance merge
+
+Short description:
+----------
+This is a helper file to the data processor (data_processor.py) and the batch
+processor (batch_processor.py). It merges the per frequency impedance files of
+a run, saved as freq<frequency>Hzv_<voltage index>.mmfile in the save folder,
+into one total_mmfile_<channel>.mmfile for each voltage channel and writes the
+Parameters.txt file used by the fitting dashboard.
+
+Instead of scanning the save folder once per channel, the impedances are kept
+in memory by an ImpedanceMerger as they are processed. Files that were processed
+earlier, and thus are only on disk, are read with one listing of the save folder.
+All the total_mmfiles are then written in one pass.
+
+Contains:
+----------
+- active_channel_numbers: The channel numbers of the active voltage channels
+- ImpedanceMerger: Collects the impedances of a run and writes the merged files
+- merge_run: Makes the Total_mm folder of a run from the save folder
+- write_parameters: Writes the Parameters.txt file of a run
+"""
+import os
+import re
+import numpy as np
+
+# How much a frequency can miss a selected frequency by and still be merged
+FREQUENCY_TOLERANCE = 0.1
+
+
+def active_channel_numbers(num_picoscopes, channels):
+    """Returns the channel numbers, 4*picoscope + channel + 1, of the active voltage channels"""
+    return [
+        4 * picoscope_index + channel_index + 1
+        for picoscope_index in range(num_picoscopes)
+        for channel_index in range(1, 4)
+        if channels[picoscope_index][channel_index]
+    ]
+
+
+class ImpedanceMerger:
+    """
+    Short description:
+    ----------
+    Collects the processed impedances of a run, per channel, and writes them to
+    the total_mmfiles.
+
+    Main methods:
+    ----------
+    - add :
+        Adds the frequencies and impedances of one processed file and channel.
+    - add_folder :
+        Adds the save files in a folder that are not already added.
+    - write :
+        Writes all the total_mmfiles and Parameters.txt.
+    """
+
+    def __init__(self, selected_frequencies, log=print):
+        """
+        Parameters:
+        ----------
+        - selected_frequencies: str or list of float
+            The frequencies of the run, as a comma separated string or a list
+        - log: function(str)
+            A loging function that takes a string as input
+        """
+        if isinstance(selected_frequencies, str):
+            selected_frequencies = selected_frequencies.split(",")
+        self.selected_frequencies = np.sort(np.array(selected_frequencies, dtype=float))
+        self.log = log
+        # channel number -> list of (frequency, impedance) arrays
+        self.records = {}
+        self.added_paths = set()
+
+    def add(self, channel, frequencies, impedance, save_path=None):
+        """
+        Parameters:
+        ----------
+        - channel: int
+            The voltage index of the impedance, the number ending the save file
+        - frequencies: array of float
+            The frequencies of the found peaks
+        - impedance: array of complex
+            The impedance at the peaks
+        - save_path: str, default None
+            The file the impedance is saved to, if given add_folder will not read
+            a file with the same name again
+        """
+        self.records.setdefault(channel, []).append(
+            (np.atleast_1d(np.asarray(frequencies, dtype=float)), np.atleast_1d(np.asarray(impedance, dtype=complex)))
+        )
+        if save_path is not None:
+            self.added_paths.add(os.path.basename(save_path))
+
+    def add_folder(self, save_folder):
+        """
+        Reads the save files in the folder that are not already added. The folder
+        is only listed once and the channel is found from the last number in
+        the filename.
+        """
+        for filename in os.listdir(save_folder):
+            file_path = os.path.join(save_folder, filename)
+            numbers = re.findall(r"\d+", filename)
+            if len(numbers) == 0 or filename in self.added_paths:
+                continue
+            with open(file_path, "r") as tiny_file:
+                lines = tiny_file.read().splitlines()[1:]
+            if len(lines) == 0:
+                self.log(f"File {file_path} do not have any values.")
+                continue
+            if len(lines) > 1:
+                self.log(f"File {file_path} has more than 1 line with values. The number of peaks are {len(lines)}. All will be added to the merged file.")
+            values = np.array([line.split("\t") for line in lines], dtype=float)
+            # Set separately so the sign of a zero imaginary part is kept
+            impedance = np.empty(len(values), dtype=complex)
+            impedance.real = values[:, 1]
+            impedance.imag = values[:, 2]
+            self.add(int(numbers[-1]), values[:, 0], impedance, save_path=file_path)
+
+    def channel_data(self, channel):
+        """
+        Returns the frequencies and impedances of the channel sorted from low to high
+        frequency, keeping only those within FREQUENCY_TOLERANCE of a selected frequency.
+        """
+        frequencies = np.concatenate([record[0] for record in self.records[channel]])
+        impedance = np.concatenate([record[1] for record in self.records[channel]])
+        order = np.argsort(frequencies, kind="stable")
+        frequencies, impedance = frequencies[order], impedance[order]
+
+        # Relative distance to the closest selected frequency
+        closest = np.searchsorted(self.selected_frequencies, frequencies)
+        below = self.selected_frequencies[np.clip(closest - 1, 0, len(self.selected_frequencies) - 1)]
+        above = self.selected_frequencies[np.clip(closest, 0, len(self.selected_frequencies) - 1)]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            distance = np.minimum(np.abs(frequencies - below), np.abs(frequencies - above)) / np.abs(frequencies)
+        keep = distance < FREQUENCY_TOLERANCE
+        return frequencies[keep], impedance[keep]
+
+    def write(self, total_mm_folder, run_name, save_metadata, channel_numbers=None):
+        """
+        Parameters:
+        ----------
+        - total_mm_folder: str
+            The folder the merged files are written to, made if it does not exist
+        - run_name: str
+            The name of the run, on the format YYYY-MM-DD-HHMM-SS
+        - save_metadata: dict
+            The metadata written to Parameters.txt
+        - channel_numbers: list of int, default None
+            The channels to write, if None all channels with data are written
+
+        Does:
+        ----------
+        Writes total_mmfile_<channel>.mmfile for every channel with data and Parameters.txt.
+        """
+        os.makedirs(total_mm_folder, exist_ok=True)
+        if channel_numbers is None:
+            channel_numbers = sorted(self.records)
+        for channel in channel_numbers:
+            if channel not in self.records:
+                continue
+            frequencies, impedance = self.channel_data(channel)
+            with open(os.path.join(total_mm_folder, f"total_mmfile_{channel}.mmfile"), "w") as fil:
+                fil.write("Frequency\tReal\tImaginary\n")
+                fil.writelines(
+                    f"{freq}\t{imp.real}\t{imp.imag}\n" for freq, imp in zip(frequencies, impedance)
+                )
+            self.log(f"Made .mm file for channel: {channel}")
+        write_parameters(total_mm_folder, run_name, save_metadata)
+
+
+def merge_run(
+    save_folder: str,
+    total_mm_folder: str,
+    run_name: str,
+    num_picoscopes: int,
+    channels,
+    save_metadata: dict,
+    log=print,
+):
+    """
+    Parameters:
+    ----------
+    - save_folder: str
+        The folder with the per frequency .mmfiles of the run
+    - total_mm_folder: str
+        The folder the merged files are written to, made if it does not exist
+    - run_name: str
+        The name of the run, on the format YYYY-MM-DD-HHMM-SS
+    - num_picoscopes: int
+        The number of picoscopes used
+    - channels: np.ndarray of bool with shape (num_picoscopes, 4)
+        The active channels of each picoscope
+    - save_metadata: dict
+        The metadata of the run, with the selected_frequencies as a comma
+        separated string and the keys written to Parameters.txt
+    - log: function(str)
+        A loging function that takes a string as input
+
+    Does:
+    ----------
+    Reads all the save files of the run and writes the merged files, see ImpedanceMerger.
+    """
+    merger = ImpedanceMerger(save_metadata["selected_frequencies"], log=log)
+    merger.add_folder(save_folder)
+    merger.write(
+        total_mm_folder,
+        run_name,
+        save_metadata,
+        channel_numbers=active_channel_numbers(num_picoscopes, channels),
+    )
+
+
+def write_parameters(total_mm_folder: str, run_name: str, save_metadata: dict):
+    """Generate the Parameters.txt file that helps for plotting"""
+    with open(os.path.join(total_mm_folder, "Parameters.txt"), "w") as fil:
+        fil.write(f"Date:\t{run_name[:10]}\n")
+        fil.write(f"Time:\t{run_name[11:]}\n\n")
+
+        fil.write(f"Cell numbers:\t{save_metadata['cell_numbers']}\n")
+        fil.write(f"Area:\t{save_metadata['area']}\n")
+        fil.write(f"Temperature:\t{save_metadata['temperature']}\n")
+        fil.write(f"Pressure:\t{save_metadata['pressure']}\n")
+        fil.write(f"DC current:\t{save_metadata['DC_current']}\n")
+        fil.write(f"AC current:\t{save_metadata['AC_current']}\n")
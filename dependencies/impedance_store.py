@@ -0,0 +1,268 @@
+"""
+Impedance store
+
+Short description:
+----------
+One file per run, Total_mm/<run>/impedance_store.tsv, that holds all the processed
+impedances of the run instead of one small .mmfile per frequency and channel. The
+file starts with the run metadata on lines beginning with "#", followed by a tab
+separated table with one row per found peak:
+
+    channel  cell  peak  frequency  z_real  z_imag  z_std  voltage_amplitude  current_amplitude  frequency_error  source
+
+where peak numbers the peaks found in the same file and channel, starting at 0,
+and z_std is the standard deviation of the impedance, nan if the estimator does
+not give one. Stores made before z_std was added keep their columns.
+
+New rows are appended at the end, so the file can be written to while the run is
+processed. If a raw file is processed again the last rows of it are the ones used.
+The whole run is loaded with one read. The legacy files (freq..Hzv_N.mmfile,
+total_mmfile_N.mmfile and Parameters.txt) can be exported from the store.
+
+Contains:
+----------
+- ImpedanceStore: Reading, appending and exporting of the store
+"""
+import io
+import os
+import numpy as np
+import pandas as pd
+from dependencies.impedance_merge import ImpedanceMerger
+
+STORE_FILENAME = "impedance_store.tsv"
+COLUMNS = [
+    "channel",
+    "cell",
+    "peak",
+    "frequency",
+    "z_real",
+    "z_imag",
+    "z_std",
+    "voltage_amplitude",
+    "current_amplitude",
+    "frequency_error",
+    "source",
+]
+# The metadata keys written to the top of the store
+METADATA_KEYS = [
+    "run",
+    "channels",
+    "cell_numbers",
+    "area",
+    "temperature",
+    "pressure",
+    "DC_current",
+    "AC_current",
+    "selected_frequencies",
+]
+
+
+class ImpedanceStore:
+    """
+    Short description:
+    ----------
+    The impedance store of one run.
+
+    Main methods:
+    ----------
+    - create :
+        Makes the store with the run metadata, if it does not exist.
+    - append_sample :
+        Appends the impedances of a processed EIS_Sample.
+    - read :
+        Returns the metadata and the table, with only the newest rows of each
+        raw file and channel.
+    - export_total_mm :
+        Writes the total_mmfiles and Parameters.txt used by the fitting dashboard.
+    - export_mmfiles :
+        Writes the per frequency .mmfiles of the data processor.
+    """
+
+    def __init__(self, folder: str):
+        """
+        Parameters:
+        ----------
+        - folder: str
+            The Total_mm folder of the run, the store is the file impedance_store.tsv in it
+        """
+        self.folder = folder
+        self.path = os.path.join(folder, STORE_FILENAME)
+        self.metadata = None
+        self.columns = COLUMNS
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def create(self, run_name: str, save_metadata: dict, channel_numbers: list) -> None:
+        """
+        Parameters:
+        ----------
+        - run_name: str
+            The name of the run, on the format YYYY-MM-DD-HHMM-SS
+        - save_metadata: dict
+            The metadata of the run, as given by the main GUI or EIS_Sample.read_header
+        - channel_numbers: list of int
+            The voltage channels of the run, in the order of the cell numbers
+
+        Does:
+        ----------
+        Writes the metadata and the column names if the store does not exist.
+        If it exists the metadata in it is kept.
+        """
+        if self.exists():
+            self.metadata = self.read_metadata()
+            return
+        metadata = {key: str(save_metadata.get(key, "")) for key in METADATA_KEYS}
+        metadata["run"] = run_name
+        metadata["channels"] = ",".join(str(channel) for channel in channel_numbers)
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.path, "w") as f:
+            for key in METADATA_KEYS:
+                f.write(f"# {key}:\t{metadata[key]}\n")
+            f.write("\t".join(COLUMNS) + "\n")
+        self.metadata = metadata
+
+    def read_metadata(self) -> dict:
+        """Returns the metadata from the top of the store, and reads the columns of it"""
+        metadata = {}
+        with open(self.path, "r") as f:
+            for line in f:
+                if not line.startswith("#"):
+                    self.columns = line.rstrip("\n").split("\t")
+                    break
+                key, _, value = line[1:].partition(":\t")
+                metadata[key.strip()] = value.rstrip("\n")
+        return metadata
+
+    def cell_of_channel(self, channel: int) -> str:
+        """Returns the cell number measured by the voltage channel, "" if not known"""
+        if self.metadata is None:
+            self.metadata = self.read_metadata()
+        channels = self.channel_numbers()
+        cells = self.metadata["cell_numbers"].split(",")
+        if channel in channels and channels.index(channel) < len(cells):
+            return cells[channels.index(channel)].strip()
+        return ""
+
+    def append_sample(self, sample, channel: int, source: str) -> None:
+        """
+        Parameters:
+        ----------
+        - sample: EIS_Sample
+            The sample with the fft done
+        - channel: int
+            The voltage index of the sample
+        - source: str
+            The raw file the sample is made from
+
+        Does:
+        ----------
+        Appends one row for each peak found in the sample. The amplitudes are the
+        single sided amplitudes of the voltage and current at the peak, as found
+        by the estimator of the sample, and the
+        frequency error is the relative distance to the frequency of the file.
+        """
+        frequencies = np.atleast_1d(sample.fft_frequencies)
+        impedance = np.atleast_1d(sample.impedance)
+        voltage_amplitude = np.atleast_1d(sample.voltage_amplitude)
+        current_amplitude = np.atleast_1d(sample.current_amplitude)
+        z_std = np.atleast_1d(getattr(sample, "z_std", np.full(len(frequencies), np.nan)))
+        frequency_error = (frequencies - sample.frequency_now) / sample.frequency_now
+        cell = self.cell_of_channel(channel)
+        source = os.path.basename(source)
+        with open(self.path, "a") as f:
+            for i in range(len(frequencies)):
+                row = {
+                    "channel": channel,
+                    "cell": cell,
+                    "peak": i,
+                    "frequency": frequencies[i],
+                    "z_real": impedance[i].real,
+                    "z_imag": impedance[i].imag,
+                    "z_std": z_std[i],
+                    "voltage_amplitude": voltage_amplitude[i],
+                    "current_amplitude": current_amplitude[i],
+                    "frequency_error": frequency_error[i],
+                    "source": source,
+                }
+                f.write("\t".join(str(row[column]) for column in self.columns) + "\n")
+
+    def read(self):
+        """
+        Returns:
+        ----------
+        The metadata as a dict and the table as a pandas DataFrame. If a raw file
+        and channel is in the store several times only the last rows are kept.
+        """
+        with open(self.path, "r") as f:
+            text = f.read()
+        lines = text.splitlines(keepends=True)
+        start = 0
+        metadata = {}
+        while start < len(lines) and lines[start].startswith("#"):
+            key, _, value = lines[start][1:].partition(":\t")
+            metadata[key.strip()] = value.rstrip("\n")
+            start += 1
+        table = pd.read_csv(
+            io.StringIO("".join(lines[start:])),
+            sep="\t",
+            dtype={"cell": str, "source": str},
+            keep_default_na=False,
+        )
+        # The rows written for one file and channel start with peak 0, so a new block
+        # starts there. Only the newest block of each file and channel is kept.
+        block = (table["peak"] == 0).cumsum()
+        newest_block = block.groupby([table["source"], table["channel"]]).transform("max")
+        table = table.loc[block == newest_block].reset_index(drop=True)
+        if "z_std" not in table:
+            table["z_std"] = np.nan
+        self.metadata = metadata
+        return metadata, table
+
+    @staticmethod
+    def mmfile_name(source: str, channel: int) -> str:
+        """Returns the name of the per frequency .mmfile of a raw file and channel"""
+        return os.path.splitext(os.path.basename(source))[0] + f"v_{channel}.mmfile"
+
+    def add_to(self, merger: ImpedanceMerger) -> None:
+        """Adds the impedances in the store that are not already in the merger"""
+        _, table = self.read()
+        for (source, channel), rows in table.groupby(["source", "channel"], sort=False):
+            mmfile_name = self.mmfile_name(source, channel)
+            if mmfile_name in merger.added_paths:
+                continue
+            impedance = np.empty(len(rows), dtype=complex)
+            impedance.real = rows["z_real"].to_numpy()
+            impedance.imag = rows["z_imag"].to_numpy()
+            merger.add(int(channel), rows["frequency"].to_numpy(), impedance, save_path=mmfile_name)
+
+    def merger(self, log=print) -> ImpedanceMerger:
+        """Returns an ImpedanceMerger with all the impedances in the store added"""
+        if self.metadata is None:
+            self.metadata = self.read_metadata()
+        merger = ImpedanceMerger(self.metadata["selected_frequencies"], log=log)
+        self.add_to(merger)
+        return merger
+
+    def channel_numbers(self) -> list:
+        """Returns the voltage channels of the run"""
+        if self.metadata is None:
+            self.metadata = self.read_metadata()
+        return [int(number) for number in self.metadata["channels"].split(",") if number != ""]
+
+    def export_total_mm(self, folder: str = None, log=print) -> None:
+        """Writes total_mmfile_<channel>.mmfile and Parameters.txt to the folder, default the folder of the store"""
+        if folder is None:
+            folder = self.folder
+        merger = self.merger(log=log)
+        merger.write(folder, self.metadata["run"], self.metadata, channel_numbers=self.channel_numbers())
+
+    def export_mmfiles(self, save_folder: str) -> None:
+        """Writes one freq<frequency>Hzv_<channel>.mmfile per raw file and channel to the save folder"""
+        _, table = self.read()
+        os.makedirs(save_folder, exist_ok=True)
+        for (source, channel), rows in table.groupby(["source", "channel"], sort=False):
+            with open(os.path.join(save_folder, self.mmfile_name(source, channel)), "w") as f:
+                f.write("Frequency\tReal\tImaginary")
+                for frequency, z_real, z_imag in zip(rows["frequency"], rows["z_real"], rows["z_imag"]):
+                    f.write(f"\n{frequency}\t{z_real}\t{z_imag}")
@@ -0,0 +1,127 @@
+"""
+Kernel quadrature
+
+Short description:
+----------
+This is a helper file to GP_DRT.py. It computes the integrals in the kernel
+matrices of the GP-DRT, eqs (18b), (18d) and the derivative of (18d) with respect
+to ell, for all the differences delta_xi at once. GP_DRT.py used to call
+scipy's quad once for every difference, with a scalar Python integrand, every
+time the negative marginal log-likelihood was evaluated.
+
+All the integrands are the squared exponential kernel exp(-x^2 / (2 ell^2)) times
+a smooth function of x:
+    L_im:        1 / (2 cosh(delta_xi - x))
+    L2_im:       y / (2 sinh(y)), y = x + delta_xi
+    der_ell:     x^2 y / (2 sinh(y))
+These are analytic in a strip of half width pi/2 around the real axis and decay
+exponentially, and for such functions the trapezoidal rule on a uniform grid
+converges exponentially with the number of points. One grid, wide enough for
+the Gaussian and fine enough for both the Gaussian and the strip, is used for all
+the differences, so the integrals are one matrix of integrand values and a sum.
+The functions of x are written with exp(-|.|) so they do not overflow.
+
+Contains:
+----------
+- GAUSSIAN_HALF_WIDTH: The half width of the grid in units of ell
+- TAIL_HALF_WIDTH: The distance from delta_xi where the integrands are negligible
+- MAX_STEP: The largest step of the grid
+- POINTS_PER_ELL: The smallest number of steps per ell
+- grid: The points and weight of the trapezoidal rule for an ell
+- L_im_integrals: The integrals of eq (18b)
+- L2_im_integrals: The integrals of eq (18d)
+- der_ell_L2_im_integrals: The integrals of the derivative of eq (18d) with respect to ell
+- pairwise: The matrix of integrals for all the pairs of two sets of log frequencies
+"""
+import numpy as np
+
+# exp(-x^2 / (2 ell^2)) is below 1e-21 outside this many ell
+GAUSSIAN_HALF_WIDTH = 10
+# The hyperbolic parts are below 1e-17 this far from delta_xi
+TAIL_HALF_WIDTH = 40
+# The error of the trapezoidal rule is about exp(-2 pi (pi / 2) / step), 1e-17 for this step
+MAX_STEP = 0.25
+# Points per ell, the error for the Gaussian is about exp(-2 pi^2 (ell / step)^2)
+POINTS_PER_ELL = 2
+
+
+def grid(ell, max_abs_delta_xi=0.0):
+    """
+    Returns the points x and the weight (the step) of the trapezoidal rule for
+    the integrals with this ell, for differences up to max_abs_delta_xi. The
+    points are symmetric around 0 and the integrands are negligible at the ends.
+    """
+    half_width = min(GAUSSIAN_HALF_WIDTH * ell, max_abs_delta_xi + TAIL_HALF_WIDTH)
+    step = min(MAX_STEP, ell / POINTS_PER_ELL)
+    num_steps = int(np.ceil(half_width / step))
+    return np.arange(-num_steps, num_steps + 1) * step, step
+
+
+def _half_sech(a):
+    """1 / (2 cosh(a)), without overflow"""
+    e = np.exp(-np.abs(a))
+    return e / (1.0 + e * e)
+
+
+def _half_y_csch(y):
+    """y / (2 sinh(y)), 1/2 at y = 0, without overflow"""
+    abs_y = np.abs(y)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        value = abs_y * np.exp(-abs_y) / -np.expm1(-2 * abs_y)
+    return np.where(abs_y > 1e-8, value, 0.5)
+
+
+def _integrate(delta_xi, ell, integrand):
+    """Returns the integral of exp(-x^2 / (2 ell^2)) integrand(x, delta_xi) over x for each delta_xi, with the shape of delta_xi"""
+    delta_xi = np.asarray(delta_xi, dtype=float)
+    if ell <= 0 or delta_xi.size == 0:
+        return np.zeros(delta_xi.shape)
+    x, step = grid(ell, np.max(np.abs(delta_xi)))
+    gaussian = np.exp(-0.5 / (ell**2) * x**2)
+    values = integrand(x[np.newaxis, :], delta_xi.reshape(-1, 1))
+    return (step * (values @ gaussian)).reshape(delta_xi.shape)
+
+
+def L_im_integrals(delta_xi, ell):
+    """The integral of integrand_L_im in GP_DRT.py for each delta_xi, an array of any shape"""
+    return _integrate(delta_xi, ell, lambda x, delta: _half_sech(delta - x))
+
+
+def L2_im_integrals(delta_xi, ell):
+    """The integral of integrand_L2_im in GP_DRT.py for each delta_xi = xi_prime - xi, an array of any shape"""
+    return _integrate(delta_xi, ell, lambda x, delta: _half_y_csch(x + delta))
+
+
+def der_ell_L2_im_integrals(delta_xi, ell):
+    """
+    The integral of integrand_der_ell_L2_im in GP_DRT.py times exp(delta_xi), for
+    each delta_xi = xi_prime - xi, an array of any shape. The factor exp(delta_xi)
+    is the one der_ell_matrix_L2_im_K multiplies with, taken inside the integral,
+    where it makes the integrand x^2 y / (2 sinh(y)).
+    """
+    return _integrate(delta_xi, ell, lambda x, delta: x**2 * _half_y_csch(x + delta))
+
+
+def pairwise(integrals, xi_n_vec, xi_m_vec, ell, shift=0.0):
+    """
+    Parameters:
+    ----------
+    - integrals: function
+        One of the integral functions above
+    - xi_n_vec, xi_m_vec: array like
+        The log frequencies of the rows and the columns of the matrix
+    - ell: float
+        The length scale of the kernel
+    - shift: float, default 0.0
+        Added to every difference, log(2 pi) for eq (18b)
+
+    Returns:
+    ----------
+    The matrix of the integrals for delta_xi = xi_m_vec[m] - xi_n_vec[n] + shift.
+    Each different delta_xi is integrated once, so for log frequencies with a
+    constant spacing, the usual case, it is 2N - 1 integrals and not N^2.
+    """
+    delta_xi = np.ravel(xi_m_vec)[np.newaxis, :] - np.ravel(xi_n_vec)[:, np.newaxis] + shift
+    # Rounded so the same difference between different pairs of frequencies is recognised
+    unique_delta_xi, inverse = np.unique(np.round(delta_xi, 12), return_inverse=True)
+    return integrals(unique_delta_xi, ell)[inverse].reshape(delta_xi.shape)
@@ -0,0 +1,288 @@
+"""
+Kernel tables
+
+Short description:
+----------
+This is a helper file to GP_DRT.py. It keeps tables of the kernel integrals of
+kernel_quadrature.py over both the difference delta_xi and the length scale ell,
+so the matrices of the GP-DRT are interpolated from a table instead of integrated
+every time the negative marginal log-likelihood is evaluated. Every evaluation in
+the hyperparameter search has a new ell, so a table for one ell would not be used
+again, but a table over ell is made once and used for every spectrum.
+
+A table holds the integrals divided by ell (by ell^3 for the derivative), which
+makes the values about 1 for all ell, on a uniform grid of delta_xi and sqrt(ell),
+in which the integrals are the smoothest. The derivatives at the grid points are
+taken from a cubic spline through the values, and the integrals are interpolated
+with cubic Hermite polynomials, first along sqrt(ell) and then along delta_xi,
+which is only a few array operations for all the differences at one ell.
+The table is checked against kernel_quadrature.py halfway between the grid points
+in both directions, and the grid is made finer in the direction where the error is
+above TOLERANCE, until it is below. Made tables are stored in CACHE_FOLDER, and a
+table is only made again if the file is missing or was made with other settings.
+Making the tables takes some seconds, so the fits call prepare first, which logs
+it before the fitting starts. Differences and length scales outside the table are
+integrated directly.
+
+Contains:
+----------
+- TABLE_VERSION: Changed when the tables give other values, so old files are not used
+- CACHE_FOLDER: The folder the tables are stored in
+- MAX_ABS_DELTA_XI: The largest difference in the tables
+- ELL_RANGE: The smallest and largest length scale in the tables
+- TOLERANCE: The largest error of the interpolated values, divided by the power of ell
+- START_POINTS: The number of differences and length scales of the first grid
+- MAX_REFINEMENTS: The most times the grid is made finer before the table is not used
+- INTEGRALS: The integrals with a table, and the power of ell they are divided by
+- hermite: Cubic Hermite interpolation between two points
+- locate: The interval of a uniform grid a point is in
+- KernelTable: The interpolated integrals of one kind
+- prepare: Reads or makes all the tables, logging the ones that are made
+- integrals: The table of the integrals, or the direct integrals if there is none
+"""
+import os
+import warnings
+import numpy as np
+from scipy.interpolate import RectBivariateSpline
+from dependencies import kernel_quadrature
+
+TABLE_VERSION = 1
+# Next to Processing_cache, outside the data folders
+CACHE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Kernel_cache")
+# 2 pi times the ratio of the highest and lowest frequency, times 2 pi for eq (18b), is below exp(30) for 12 decades
+MAX_ABS_DELTA_XI = 30.0
+ELL_RANGE = (0.01, 5.0)
+# The values divided by the power of ell are at most about 1.25
+TOLERANCE = 1e-8
+START_POINTS = (1601, 161)
+MAX_REFINEMENTS = 4
+INTEGRALS = {
+    "L_im": (kernel_quadrature.L_im_integrals, 1),
+    "L2_im": (kernel_quadrature.L2_im_integrals, 1),
+    "der_ell_L2_im": (kernel_quadrature.der_ell_L2_im_integrals, 3),
+}
+
+# name -> KernelTable, or None if the table could not be made, for this process
+_tables = {}
+
+
+def hermite(y_0, y_1, slope_0, slope_1, t):
+    """
+    Returns the cubic through y_0 at t = 0 and y_1 at t = 1, with the slopes
+    slope_0 and slope_1 there (per unit of t), at t in [0, 1]. All the arguments
+    are arrays of the same shape or scalars.
+    """
+    t_2 = t * t
+    t_3 = t_2 * t
+    return (
+        (2 * t_3 - 3 * t_2 + 1) * y_0
+        + (t_3 - 2 * t_2 + t) * slope_0
+        + (3 * t_2 - 2 * t_3) * y_1
+        + (t_3 - t_2) * slope_1
+    )
+
+
+def locate(points, grid):
+    """Returns the index of the interval of the uniform grid each point is in, and where in it, from 0 to 1"""
+    position = np.clip((points - grid[0]) / (grid[1] - grid[0]), 0, len(grid) - 1)
+    index = np.minimum(position.astype(int), len(grid) - 2)
+    return index, position - index
+
+
+class KernelTable:
+    """
+    Short description:
+    ----------
+    The integrals of one of INTEGRALS on a grid of delta_xi and sqrt(ell), with
+    their derivatives. Called like the integral functions of kernel_quadrature.py,
+    with an array of differences and a length scale.
+
+    Main methods:
+    ----------
+    - interpolate :
+        The values of the table for one sqrt(ell).
+    - build :
+        Makes the table, with the grid refined until the error is below TOLERANCE.
+    - load :
+        Reads a table stored by save, None if there is no valid file.
+    - save :
+        Stores the grid and the values.
+    """
+
+    def __init__(self, name, delta_xi, root_ell, values):
+        """
+        Parameters:
+        ----------
+        - name: str
+            A key of INTEGRALS
+        - delta_xi, root_ell: array like
+            The grid of differences and square roots of the length scale
+        - values: array like
+            The integrals divided by the power of ell, with shape (len(delta_xi), len(root_ell))
+        """
+        self.name = name
+        self.direct, self.ell_power = INTEGRALS[name]
+        self.delta_xi = np.asarray(delta_xi, dtype=float)
+        self.root_ell = np.asarray(root_ell, dtype=float)
+        self.values = np.asarray(values, dtype=float)
+        # The derivatives times the steps of the grid, the slopes per interval
+        spline = RectBivariateSpline(self.delta_xi, self.root_ell, self.values, kx=3, ky=3, s=0)
+        delta_xi_step, root_ell_step = self.delta_xi[1] - self.delta_xi[0], self.root_ell[1] - self.root_ell[0]
+        self.slopes_delta_xi = spline(self.delta_xi, self.root_ell, dx=1) * delta_xi_step
+        self.slopes_root_ell = spline(self.delta_xi, self.root_ell, dy=1) * root_ell_step
+        self.slopes_both = spline(self.delta_xi, self.root_ell, dx=1, dy=1) * delta_xi_step * root_ell_step
+
+    def interpolate(self, delta_xi, root_ell):
+        """Returns the values of the table at the differences delta_xi, within the table, for one sqrt(ell)"""
+        i, t = locate(delta_xi, self.delta_xi)
+        j, u = locate(root_ell, self.root_ell)
+
+        def along_root_ell(values, slopes, rows):
+            return hermite(values[rows, j], values[rows, j + 1], slopes[rows, j], slopes[rows, j + 1], u)
+
+        return hermite(
+            along_root_ell(self.values, self.slopes_root_ell, i),
+            along_root_ell(self.values, self.slopes_root_ell, i + 1),
+            along_root_ell(self.slopes_delta_xi, self.slopes_both, i),
+            along_root_ell(self.slopes_delta_xi, self.slopes_both, i + 1),
+            t,
+        )
+
+    @staticmethod
+    def grid_values(name, delta_xi, root_ell):
+        """Returns the integrals divided by the power of ell for all the differences and square roots of ell"""
+        direct, ell_power = INTEGRALS[name]
+        return np.array([direct(delta_xi, root**2) / root ** (2 * ell_power) for root in root_ell]).T
+
+    @classmethod
+    def build(cls, name):
+        """
+        Does:
+        ----------
+        Makes the table on a grid of START_POINTS, and compares it with the
+        direct integrals halfway between the grid points. The number of steps is
+        doubled in the direction where the error is above TOLERANCE, at most
+        MAX_REFINEMENTS times.
+
+        Returns:
+        ----------
+        The table, or None if the error is still above TOLERANCE.
+        """
+        num_delta_xi, num_ell = START_POINTS
+        root_ell_range = np.sqrt(ELL_RANGE)
+        for _ in range(MAX_REFINEMENTS + 1):
+            delta_xi = np.linspace(-MAX_ABS_DELTA_XI, MAX_ABS_DELTA_XI, num_delta_xi)
+            root_ell = np.linspace(*root_ell_range, num_ell)
+            table = cls(name, delta_xi, root_ell, cls.grid_values(name, delta_xi, root_ell))
+            middle_delta_xi = (delta_xi[:-1] + delta_xi[1:]) / 2
+            middle_root_ell = (root_ell[:-1] + root_ell[1:]) / 2
+            delta_xi_error = np.max(np.abs(
+                np.array([table.interpolate(middle_delta_xi, root) for root in root_ell]).T
+                - cls.grid_values(name, middle_delta_xi, root_ell)
+            ))
+            ell_error = np.max(np.abs(
+                np.array([table.interpolate(delta_xi, root) for root in middle_root_ell]).T
+                - cls.grid_values(name, delta_xi, middle_root_ell)
+            ))
+            if delta_xi_error < TOLERANCE and ell_error < TOLERANCE:
+                return table
+            if delta_xi_error >= TOLERANCE:
+                num_delta_xi = 2 * num_delta_xi - 1
+            if ell_error >= TOLERANCE:
+                num_ell = 2 * num_ell - 1
+        warnings.warn(f"The table of the {name} integrals is not within {TOLERANCE}, they are integrated directly")
+        return None
+
+    @staticmethod
+    def settings():
+        """The settings a stored table has to have been made with"""
+        return np.array([TABLE_VERSION, MAX_ABS_DELTA_XI, *ELL_RANGE, TOLERANCE])
+
+    @staticmethod
+    def file_path(name, folder):
+        """Returns the path to the stored table of the integrals"""
+        return os.path.join(folder, f"{name}_v{TABLE_VERSION}.npz")
+
+    @classmethod
+    def load(cls, name, folder):
+        """Returns the table stored in the folder, or None if there is none or it was made with other settings"""
+        try:
+            with np.load(cls.file_path(name, folder)) as stored:
+                if not np.array_equal(stored["settings"], cls.settings()):
+                    return None
+                return cls(name, stored["delta_xi"], stored["root_ell"], stored["values"])
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def save(self, folder):
+        """Stores the table in the folder, replacing an older one"""
+        file_path = self.file_path(self.name, folder)
+        os.makedirs(folder, exist_ok=True)
+        # Written to a temporary file first so a half written table is never read,
+        # named after the process since several workers may make the table at once
+        temporary_path = f"{file_path[:-4]}.{os.getpid()}.tmp.npz"
+        np.savez(temporary_path, settings=self.settings(), delta_xi=self.delta_xi, root_ell=self.root_ell, values=self.values)
+        os.replace(temporary_path, file_path)
+
+    def __call__(self, delta_xi, ell):
+        """The integrals for each delta_xi, an array of any shape, interpolated where they are in the table"""
+        delta_xi = np.asarray(delta_xi, dtype=float)
+        if not ELL_RANGE[0] <= ell <= ELL_RANGE[1]:
+            return self.direct(delta_xi, ell)
+        inside = np.abs(delta_xi) <= MAX_ABS_DELTA_XI
+        values = np.empty(delta_xi.shape)
+        values[inside] = self.interpolate(delta_xi[inside], np.sqrt(ell)) * ell**self.ell_power
+        if not np.all(inside):
+            values[~inside] = self.direct(delta_xi[~inside], ell)
+        return values
+
+
+def prepare(log=print, folder=CACHE_FOLDER):
+    """
+    Parameters:
+    ----------
+    - log: function, default print
+        Called with a message before a table is made
+    - folder: str, default CACHE_FOLDER
+        The folder the tables are stored in
+
+    Does:
+    ----------
+    Reads the tables of all the INTEGRALS, or makes and stores them, as
+    integrals does the first time. Called before the fits, so the time spent the
+    first time, about 15 s in all, is logged instead of hidden in the first fit.
+    """
+    for name in INTEGRALS:
+        integrals(name, folder, log)
+
+
+def integrals(name, folder=CACHE_FOLDER, log=None):
+    """
+    Parameters:
+    ----------
+    - name: str
+        A key of INTEGRALS
+    - folder: str, default CACHE_FOLDER
+        The folder the table is stored in
+    - log: function, default None
+        Called with a message before the table is made, if not None
+
+    Returns:
+    ----------
+    The KernelTable of the integrals, read from the folder or made and stored
+    there the first time in a process, or the integral function of
+    kernel_quadrature.py if the table could not be made.
+    """
+    if name not in _tables:
+        table = KernelTable.load(name, folder)
+        if table is None:
+            if log is not None:
+                log(f"Making the table of the {name} kernel integrals, this is only done once.")
+            table = KernelTable.build(name)
+            if table is not None:
+                try:
+                    table.save(folder)
+                except OSError:
+                    pass
+        _tables[name] = table
+    return _tables[name] or INTEGRALS[name][0]
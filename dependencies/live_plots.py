@@ -0,0 +1,265 @@
+"""
+Live plots
+
+Short description:
+----------
+This is a helper file to the data processor (data_processor.py). It contains the
+class LiveImpedancePlots, which shows the processed impedances in the nyquist, bode
+and fft spectrum canvases while a run is being processed.
+
+Instead of clearing and redrawing the figures for every processed channel, the
+artists are made once and the new points are appended to them. Adding a sample
+only stores the data, the drawing is done by draw, which is meant to be called
+through a GUI_helper.PlotScheduler so that it is run at a fixed frame rate. The
+draw is done with blitting, and a full redraw is only done when the new points
+fall outside the current axis limits.
+
+Contains:
+----------
+- LiveImpedancePlots: The live nyquist, bode and fft spectrum plots
+"""
+import numpy as np
+from matplotlib.colors import LogNorm
+from dependencies.GUI_helper import PlotCanvas
+from dependencies.profiling import timed
+
+# Markers used to tell the voltage channels apart
+CHANNEL_MARKERS = ["o", "s", "^", "D", "v", "P", "X", "*"]
+
+
+def _limits(values, log_scale, margin=0.1):
+    """Returns the (low, high) limits with a margin around the finite values"""
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    if log_scale:
+        values = values[values > 0]
+    if len(values) == 0:
+        return None
+    low, high = values.min(), values.max()
+    if log_scale:
+        low, high = np.log10(low), np.log10(high)
+    span = high - low
+    if span == 0:
+        span = abs(high) if high != 0 else 1
+    low, high = low - margin * span, high + margin * span
+    if log_scale:
+        return 10**low, 10**high
+    return low, high
+
+
+def _covers(current, wanted):
+    """Returns True if the current limits includes the wanted limits"""
+    current_low, current_high = min(current), max(current)
+    return current_low <= wanted[0] and wanted[1] <= current_high
+
+
+class LiveImpedancePlots:
+    """
+    Short description:
+    ----------
+    Keeps the artists of the three canvases of the data processor and the data
+    shown in them.
+
+    Main methods:
+    ----------
+    - add_sample :
+        Appends the impedances of a processed sample and sets it as the sample
+        shown in the fft spectrum. Does not draw.
+    - draw :
+        Updates the artists and draws them, with blitting if the limits are unchanged.
+    - reset :
+        Removes all the points, used when a new run is processed.
+    """
+
+    def __init__(self, nyquist_canvas: PlotCanvas, bode_canvas: PlotCanvas, fft_canvas: PlotCanvas):
+        """
+        Parameters:
+        ----------
+        - nyquist_canvas: PlotCanvas with one axis
+        - bode_canvas: PlotCanvas with two vertical axes
+        - fft_canvas: PlotCanvas with two vertical axes
+        """
+        self.nyquist_canvas = nyquist_canvas
+        self.bode_canvas = bode_canvas
+        self.fft_canvas = fft_canvas
+        self.reset()
+
+    def reset(self) -> None:
+        """Clears the canvases and sets up the axes and empty artists"""
+        # Data per voltage channel
+        self.frequencies = {}
+        self.impedances = {}
+        self.channel_artists = {}
+        self.latest_sample = None
+        self.changed = False
+        # The axes that have got their limits from the data
+        self.limited_axes = set()
+
+        for canvas in (self.nyquist_canvas, self.bode_canvas, self.fft_canvas):
+            canvas.clear()
+            canvas.animated_artists = []
+            canvas.background = None
+
+        axis = self.nyquist_canvas.get_axis()
+        axis.set_xlabel(r"Re$Z$  [$\Omega$]")
+        axis.set_ylabel(r"-Im$Z$ [$\Omega$]")
+        axis.grid()
+        axis.set_aspect("equal", adjustable="box")
+
+        axises = self.bode_canvas.get_axis()
+        for bode_axis in axises:
+            bode_axis.set_xscale("log")
+            bode_axis.grid()
+        axises[0].set_yscale("log")
+        axises[1].set_xlabel("Frequency [Hz]")
+        axises[0].set_ylabel(r"$|Z|$ [$\Omega$]")
+        axises[1].set_ylabel(r"$\angle Z$ [deg]")
+
+        axises = self.fft_canvas.get_axis()
+        self.fft_lines = []
+        self.fft_peaks = []
+        self.fft_used = []
+        for fft_axis, label in zip(axises, ("fft Voltage", "fft Current")):
+            fft_axis.set_xscale("log")
+            fft_axis.set_yscale("log")
+            fft_axis.grid()
+            fft_axis.set_ylabel(label)
+            (line,) = fft_axis.plot([], [])
+            self.fft_lines.append(self.fft_canvas.add_animated(line))
+            self.fft_peaks.append(
+                self.fft_canvas.add_animated(fft_axis.scatter([], [], c="r", marker="x"))
+            )
+            self.fft_used.append(
+                self.fft_canvas.add_animated(fft_axis.scatter([], [], c=[], norm=LogNorm()))
+            )
+        axises[1].set_xlabel("Frequency [Hz]")
+
+        for canvas in (self.nyquist_canvas, self.bode_canvas, self.fft_canvas):
+            canvas.get_figure().tight_layout()
+            canvas.update()
+
+    def _make_channel_artists(self, channel) -> None:
+        """Makes the nyquist and bode scatter artists of a new voltage channel"""
+        marker = CHANNEL_MARKERS[len(self.channel_artists) % len(CHANNEL_MARKERS)]
+        bode_axises = self.bode_canvas.get_axis()
+        self.channel_artists[channel] = [
+            self.nyquist_canvas.add_animated(
+                self.nyquist_canvas.get_axis().scatter([], [], c=[], norm=LogNorm(), marker=marker)
+            ),
+            self.bode_canvas.add_animated(
+                bode_axises[0].scatter([], [], c=[], norm=LogNorm(), marker=marker)
+            ),
+            self.bode_canvas.add_animated(
+                bode_axises[1].scatter([], [], c=[], norm=LogNorm(), marker=marker)
+            ),
+        ]
+
+    def add_sample(self, sample, channel) -> None:
+        """
+        Parameters:
+        ----------
+        - sample: EIS_Sample with the fft done
+        - channel: The voltage index of the sample, points from each channel are
+            drawn with their own marker
+        """
+        if channel not in self.channel_artists:
+            self._make_channel_artists(channel)
+            self.frequencies[channel] = np.array([])
+            self.impedances[channel] = np.array([], dtype=complex)
+        self.frequencies[channel] = np.append(self.frequencies[channel], sample.fft_frequencies)
+        self.impedances[channel] = np.append(self.impedances[channel], sample.impedance)
+        self.latest_sample = sample
+        self.changed = True
+
+    @staticmethod
+    def _set_points(artist, x, y, color=None) -> None:
+        """Replaces the points of a scatter artist, and the values it is colored by if given"""
+        artist.set_offsets(np.column_stack((x, y)))
+        if color is not None:
+            artist.set_array(np.asarray(color, dtype=float))
+            if len(color) > 0:
+                artist.norm.vmin = None
+                artist.norm.vmax = None
+                artist.autoscale()
+
+    def _expand_limits(self, axis, x, y) -> bool:
+        """
+        Expands the limits of the axis to contain the points. The limits are never
+        shrunk, so they only change a few times during a run. Returns True if the
+        limits are changed, meaning a full redraw is needed.
+        """
+        changed = False
+        limited = axis in self.limited_axes
+        x_limits = _limits(x, axis.get_xscale() == "log", margin=0)
+        if x_limits is not None and (not limited or not _covers(axis.get_xlim(), x_limits)):
+            # The margin is taken of the new total span, so the number of expansions stay small
+            if limited:
+                x_limits = x_limits + tuple(axis.get_xlim())
+            axis.set_xlim(_limits(x_limits, axis.get_xscale() == "log"))
+            changed = True
+        y_limits = _limits(y, axis.get_yscale() == "log", margin=0)
+        if y_limits is not None and (not limited or not _covers(axis.get_ylim(), y_limits)):
+            if limited:
+                y_limits = y_limits + tuple(axis.get_ylim())
+            axis.set_ylim(_limits(y_limits, axis.get_yscale() == "log"))
+            changed = True
+        if changed:
+            self.limited_axes.add(axis)
+        return changed
+
+    @timed
+    def draw(self) -> None:
+        """Moves the stored data to the artists and draws the canvases that changed"""
+        if not self.changed:
+            return
+        self.changed = False
+
+        nyquist_axis = self.nyquist_canvas.get_axis()
+        bode_axises = self.bode_canvas.get_axis()
+        nyquist_redraw = False
+        bode_redraw = False
+        for channel, (nyquist_artist, amplitude_artist, angle_artist) in self.channel_artists.items():
+            frequencies = self.frequencies[channel]
+            impedance = self.impedances[channel]
+            angle = np.angle(impedance) * 180 / np.pi
+            self._set_points(nyquist_artist, impedance.real, -impedance.imag, frequencies)
+            self._set_points(amplitude_artist, frequencies, np.abs(impedance), frequencies)
+            self._set_points(angle_artist, frequencies, angle, frequencies)
+            nyquist_redraw |= self._expand_limits(nyquist_axis, impedance.real, -impedance.imag)
+            bode_redraw |= self._expand_limits(bode_axises[0], frequencies, np.abs(impedance))
+            bode_redraw |= self._expand_limits(bode_axises[1], frequencies, angle)
+
+        fft_redraw = False
+        sample = self.latest_sample
+        if sample is not None:
+            fft_axises = self.fft_canvas.get_axis()
+            for i, (fft, peak_indicies) in enumerate(
+                (
+                    (sample.all_fft_voltage, sample.voltage_indicies),
+                    (sample.all_fft_current, sample.current_indicies),
+                )
+            ):
+                amplitude = np.abs(fft)
+                self.fft_lines[i].set_data(sample.all_fft_frequencies, amplitude)
+                self._set_points(
+                    self.fft_peaks[i],
+                    sample.all_fft_frequencies[peak_indicies],
+                    amplitude[peak_indicies],
+                )
+                self._set_points(
+                    self.fft_used[i],
+                    sample.fft_frequencies,
+                    amplitude[sample.indicies],
+                    sample.fft_frequencies,
+                )
+                fft_redraw |= self._expand_limits(fft_axises[i], sample.all_fft_frequencies, amplitude)
+
+        for canvas, redraw in (
+            (self.nyquist_canvas, nyquist_redraw),
+            (self.bode_canvas, bode_redraw),
+            (self.fft_canvas, fft_redraw),
+        ):
+            if redraw:
+                canvas.redraw()
+            else:
+                canvas.blit()
@@ -0,0 +1,81 @@
+"""
+Model selection
+
+Short description:
+----------
+This is a helper file to compare_circuits (fitting_algorithms.py). It ranks the
+circuits fitted to each spectrum, so the circuits can be compared in one run
+instead of fitting the whole dataset once for each circuit.
+
+The circuits are ranked by one of three criteria, the lowest being the best:
+    chiN: The chi/N value of the fit, as in the output data of the circuit handlers
+    AIC:  Akaike's information criterion, n ln(RSS / n) + 2 k
+    BIC:  The Bayesian information criterion, n ln(RSS / n) + k ln(n)
+where RSS is the sum of squared residuals, n the number of residuals (the real
+and imaginary parts at every frequency) and k the number of parameters. chiN
+favours the circuit with the most parameters, AIC and BIC penalise parameters
+that do not improve the fit enough, BIC more so the more frequencies there are.
+
+Contains:
+----------
+- CRITERIA: The criteria the circuits can be ranked by
+- information_criteria: chiN, AIC and BIC of a fit
+- rank_models: Ranks the circuits of each spectrum
+"""
+import numpy as np
+
+CRITERIA = ["chiN", "AIC", "BIC"]
+
+
+def information_criteria(chiN, num_frequencies, num_parameters):
+    """
+    Parameters:
+    ----------
+    - chiN: float or array like
+        The chi/N value of the fit, sqrt(RSS / N) / N for N frequencies, see store_fit in circuit_handler.py
+    - num_frequencies: int or array like
+        The number of frequencies of the spectrum
+    - num_parameters: int or array like
+        The number of parameters of the circuit
+
+    Returns:
+    ----------
+    A dict with the values of the CRITERIA.
+    """
+    chiN = np.asarray(chiN, dtype=float)
+    num_frequencies = np.asarray(num_frequencies, dtype=float)
+    num_parameters = np.asarray(num_parameters, dtype=float)
+    num_residuals = 2 * num_frequencies
+    rss = chiN**2 * num_frequencies**3
+    with np.errstate(divide="ignore"):
+        log_likelihood_term = num_residuals * np.log(rss / num_residuals)
+    return {
+        "chiN": chiN,
+        "AIC": log_likelihood_term + 2 * num_parameters,
+        "BIC": log_likelihood_term + num_parameters * np.log(num_residuals),
+    }
+
+
+def rank_models(model_df, criterion):
+    """
+    Parameters:
+    ----------
+    - model_df: pandas DataFrame
+        One row per spectrum and circuit, with the columns path_to_file and the CRITERIA
+    - criterion: str
+        One of CRITERIA
+
+    Returns:
+    ----------
+    model_df with the column rank, 1 for the best circuit of each spectrum, and
+    the column best, True for the best circuit. Fits without a value of the
+    criterion are ranked last.
+    """
+    if criterion not in CRITERIA:
+        raise ValueError(f"Unknown criterion {criterion}, use one of {CRITERIA}")
+    model_df = model_df.copy()
+    if len(model_df) == 0:
+        return model_df
+    model_df["rank"] = model_df.groupby("path_to_file")[criterion].rank(method="first", na_option="bottom").astype(int)
+    model_df["best"] = model_df["rank"] == 1
+    return model_df
@@ -0,0 +1,149 @@
+"""
+Multi-start
+
+Short description:
+----------
+This is a helper file to the circuit handlers (circuit_handler.py). It finds the
+parameters the first fit of a circuit handler starts from. The later fits start
+from the parameters of the fit before, so a first fit that ends in a bad local
+minimum makes the whole chain bad. The global_opt option of the impedance module
+(scipy's basinhopping) finds a better minimum, but takes far too long.
+
+Here many starts are spread over the parameter space with a Latin hypercube, so
+every parameter is sampled over its whole range, and fitted at the same time with
+fit_batch (batch_fitting.py), which takes about as long as a few single fits. The
+starts are fitted in rounds, and the search stops as soon as enough of them end in
+the same, best, minimum. The best parameters are then the initial guess of the
+ordinary first fit.
+
+The parameters are sampled on a log scale within get_bounds of the handler and a
+range given by the spectrum: the resistances from a thousandth to ten times the
+largest impedance, the capacitances and CPE Qs from time constants a decade outside
+the measured frequencies, and the CPE alphas on a linear scale from 0.5 to 1.
+
+Contains:
+----------
+- STARTS_PER_ROUND: The number of starts fitted together
+- MAX_ROUNDS: The most rounds before the best start so far is used
+- AGREEING_STARTS: The number of starts in the best minimum that stops the search
+- AGREEMENT_TOLERANCE: How close the sums of squares of starts in the same minimum are
+- MAX_ITERATIONS: The most steps taken from each start
+- start_ranges: The range of each parameter the starts are sampled from
+- latin_hypercube: Starts spread over the ranges
+- multistart_guess: The best parameters found from the starts
+"""
+import numpy as np
+from dependencies.batch_fitting import fit_batch
+
+STARTS_PER_ROUND = 16
+MAX_ROUNDS = 4
+AGREEING_STARTS = 3
+# Starts whose sums of squares are this close relative to the best are taken to be in the same minimum
+AGREEMENT_TOLERANCE = 1e-3
+# The starts only have to find the minimum, the first fit of the handler polishes the best one
+MAX_ITERATIONS = 50
+
+
+def start_ranges(model, frequencies, impedance, bounds):
+    """
+    Parameters:
+    ----------
+    - model: CircuitModel
+        The circuit, see circuit_models.py
+    - frequencies: array like
+        The frequencies of the spectrum in Hz
+    - impedance: array like
+        The complex impedance of the spectrum
+    - bounds: tuple of two array likes
+        The lower and upper bounds of the parameters
+
+    Returns:
+    ----------
+    The lower and upper ends of the range of each parameter, within the bounds,
+    and a boolean array that is True for the parameters sampled on a log scale.
+    """
+    frequencies = np.asarray(frequencies, dtype=float)
+    largest = np.max(np.abs(impedance))
+    smallest_resistance, largest_resistance = 1e-3 * largest, 10 * largest
+    shortest_time = 0.1 / (2 * np.pi * np.max(frequencies))
+    longest_time = 10 / (2 * np.pi * np.min(frequencies))
+    ranges = {
+        "R": (smallest_resistance, largest_resistance),
+        "C": (shortest_time / largest_resistance, longest_time / smallest_resistance),
+        "Q": (shortest_time / largest_resistance, longest_time / smallest_resistance),
+        "L": (shortest_time * smallest_resistance, longest_time * largest_resistance),
+        "alpha": (0.5, 1),
+    }
+    low, high = np.array([ranges[kind] for kind in model.parameter_kinds]).T
+    lower, upper = (np.asarray(bound, dtype=float) for bound in bounds)
+    low, high = np.clip(low, lower, upper), np.clip(high, lower, upper)
+    log_scale = np.array([kind != "alpha" for kind in model.parameter_kinds]) & (low > 0)
+    return low, high, log_scale
+
+
+def latin_hypercube(low, high, log_scale, num_starts, rng):
+    """
+    Returns num_starts starts with shape (num_starts, P), where each parameter has
+    one start in each of num_starts equally wide parts of its range, on a log
+    scale where log_scale is True.
+    """
+    num_parameters = len(low)
+    strata = np.argsort(rng.random((num_starts, num_parameters)), axis=0)
+    unit = (strata + rng.random((num_starts, num_parameters))) / num_starts
+    starts = low + unit * (high - low)
+    logarithmic = np.exp(np.log(np.where(log_scale, low, 1)) + unit * np.log(np.where(log_scale, high / low, 1)))
+    return np.where(log_scale, logarithmic, starts)
+
+
+def multistart_guess(model, frequencies, impedance, initial_guess, bounds, seed=0):
+    """
+    Parameters:
+    ----------
+    - model: CircuitModel
+        The circuit, see circuit_models.py
+    - frequencies: array like
+        The frequencies of the spectrum in Hz
+    - impedance: array like
+        The complex impedance of the spectrum
+    - initial_guess: array like
+        The fixed initial guess of the handler, which is always one of the starts
+    - bounds: tuple of two array likes
+        The lower and upper bounds of the parameters
+    - seed: int, default 0
+        The seed of the starts, fixed so that the same spectrum gets the same guess
+
+    Does:
+    ----------
+    Fits rounds of STARTS_PER_ROUND starts at the same time, until AGREEING_STARTS
+    of them are in the best minimum found or MAX_ROUNDS rounds are done.
+
+    Returns:
+    ----------
+    The fitted parameters of the best start.
+    """
+    frequencies = np.asarray(frequencies, dtype=float)
+    impedance = np.asarray(impedance, dtype=complex)
+    rng = np.random.default_rng(seed)
+    low, high, log_scale = start_ranges(model, frequencies, impedance, bounds)
+    costs, parameters = [], []
+    for round_number in range(MAX_ROUNDS):
+        starts = latin_hypercube(low, high, log_scale, STARTS_PER_ROUND, rng)
+        if round_number == 0:
+            starts[0] = initial_guess
+        fitted, _, _ = fit_batch(
+            model,
+            frequencies,
+            np.broadcast_to(impedance, (STARTS_PER_ROUND, len(impedance))),
+            starts,
+            bounds,
+            max_iterations=MAX_ITERATIONS,
+        )
+        residuals = model.impedance(frequencies, fitted) - impedance
+        round_costs = np.sum(residuals.real**2 + residuals.imag**2, axis=-1)
+        costs.append(np.where(np.isfinite(round_costs), round_costs, np.inf))
+        parameters.append(fitted)
+        all_costs = np.concatenate(costs)
+        best = np.min(all_costs)
+        if np.sum(all_costs <= best * (1 + AGREEMENT_TOLERANCE)) >= AGREEING_STARTS:
+            break
+    return np.concatenate(parameters)[np.argmin(all_costs)]
@@ -0,0 +1,211 @@
+"""
+Parallel fitting
+
+Short description:
+----------
+This is a helper file to fit_with_circuit (fitting_algorithms.py). It fits the
+impedance spectra of all the runs and cells to a circuit in a pool of worker
+processes instead of one run after the other.
+
+A circuit handler fits its files in order and uses the parameters of one fit as
+the initial guess of the next (the warm start), which makes the fits both faster
+and more stable when the spectra change slowly. The spectra of the same cell in
+runs after each other are the most alike, so the work is split into one chain per
+cell, with the runs in time order, and each chain is fitted by one handler in one
+worker. The chains are independent, so they can run at the same time. A file that
+can not be loaded or fitted only leaves out that file, the rest of its chain is
+still fitted, see fail_file in circuit_handler.py.
+
+With batch fitting (see do_batch_steps in circuit_handler.py) the files are not
+fitted in order, so the chains are joined to one per worker, which makes the
+batches as large as possible.
+
+To compare circuits the chains are fitted to every circuit, with all the chains
+of all the circuits in the same pool, see fit_models.
+
+Contains:
+----------
+- FILES_PER_WORKER: The number of files that makes starting another worker worth it
+- cell_chains: The files of each cell in time order
+- merge_chains: Joins the chains to a given number of chains
+- fit_chain: The function that is run by the workers
+- fit_chains: Fits the chains, in the pool if there are more than one worker
+- fit_models: Fits the chains to several circuits in the same pool
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dependencies.circuit_handler import get_circuit_handler
+
+# A new worker has to import scipy before its first fit, which takes as
+# long as many fits, so there is at most one worker for this many files
+FILES_PER_WORKER = 20
+
+
+def cell_chains(df):
+    """
+    Parameters:
+    ----------
+    - df: pandas DataFrame
+        With the columns cell_name, dir_name and path_to_file, as made by retrieve_data
+
+    Returns:
+    ----------
+    A dict from the cell name to the total_mmfiles of the cell, sorted on the
+    run folder name, which starts with the date and time of the run.
+    """
+    files = df[["cell_name", "dir_name", "path_to_file"]].drop_duplicates()
+    return {
+        cell_name: cell_files.sort_values("dir_name")["path_to_file"].tolist()
+        for cell_name, cell_files in files.groupby("cell_name", sort=False)
+    }
+
+
+def merge_chains(chains, num_chains):
+    """
+    Returns the chains joined to at most num_chains chains with about the same
+    number of files, named after the chains in them. The files of a chain are
+    kept together and in order.
+    """
+    groups = [[] for _ in range(max(min(num_chains, len(chains)), 1))]
+    sizes = [0] * len(groups)
+    for name in sorted(chains, key=lambda name: -len(chains[name])):
+        smallest = sizes.index(min(sizes))
+        groups[smallest].append(name)
+        sizes[smallest] += len(chains[name])
+    return {
+        ", ".join(names): [file_path for name in names for file_path in chains[name]]
+        for names in groups
+        if len(names) > 0
+    }
+
+
+def fit_chain(circuit_string, file_paths, batch_fit=False, warm_start=None):
+    """
+    Parameters:
+    ----------
+    - circuit_string: str
+        A key of IMPLEMENTED_CIRCUITS in circuit_handler.py
+    - file_paths: list of str
+        The total_mmfiles that are fitted, in the order of the warm start
+    - batch_fit: bool, default False
+        If the files are fitted all at once, see do_batch_steps in circuit_handler.py
+    - warm_start: list of float, default None
+        The parameters the first fit starts from, the initial guess of the handler if None
+
+    Does:
+    ----------
+    Fits the files in order with the circuit handler, the same way as
+    BaseCircuitHandler.process does for the files of a folder. Raises the
+    exception of the last file if none of the files could be fitted.
+
+    Returns:
+    ----------
+    A dict with the keys output_data, variables, files and Z_fits, the values
+    returned by BaseCircuitHandler.process, parameters, the fitted circuit
+    parameters of each file, and failed, the message of the exception of each
+    file that could not be fitted. The rows of output_data of the failed files
+    are NaN and they are not in Z_fits or parameters.
+    """
+    handler_class = get_circuit_handler(circuit_string)
+    if handler_class is None:
+        raise IndexError(f"The circuit you are using ({circuit_string}) have not been implemented.")
+    circuit_handler = handler_class("", "", lambda message: None)
+    circuit_handler.files_in_watch = list(file_paths)
+    circuit_handler.batch_fit = batch_fit
+    circuit_handler.warm_start = warm_start
+    output_data, variables, files, Z_fits = circuit_handler.process()
+    return {
+        "output_data": output_data,
+        "variables": variables,
+        "files": files,
+        "Z_fits": Z_fits,
+        "parameters": circuit_handler.fitted_parameters,
+        "failed": {file_path: str(error) for file_path, error in circuit_handler.failed_files.items()},
+    }
+
+
+def fit_chains(circuit_string, chains, num_workers=None, batch_fit=False, warm_starts=None):
+    """
+    Parameters:
+    ----------
+    - circuit_string: str
+        A key of IMPLEMENTED_CIRCUITS in circuit_handler.py
+    - chains: dict
+        From a name to the list of files fitted in order, see cell_chains
+    - num_workers: int, default None
+        The most worker processes used. If None the number of cores is used.
+        Fewer are used for few files, see FILES_PER_WORKER, and with one worker
+        the chains are fitted in this process.
+    - batch_fit: bool, default False
+        If the files are fitted in batches instead of in order. The chains are
+        then joined to one for each worker, see merge_chains.
+    - warm_starts: dict, default None
+        From the first file of a chain to the parameters its first fit starts from
+
+    Returns:
+    ----------
+    A generator of (name, result, error) in the order the chains finish, where
+    result is the dict returned by fit_chain, or None if the fit raised the
+    exception error.
+    """
+    fitted = fit_models([circuit_string], chains, num_workers, batch_fit, {circuit_string: warm_starts or {}})
+    for _, name, result, error in fitted:
+        yield name, result, error
+
+
+def fit_models(circuit_strings, chains, num_workers=None, batch_fit=False, warm_starts=None):
+    """
+    Parameters:
+    ----------
+    - circuit_strings: list of str
+        Keys of IMPLEMENTED_CIRCUITS in circuit_handler.py, every chain is fitted to each of them
+    - chains: dict
+        From a name to the list of files fitted in order, see cell_chains
+    - num_workers: int, default None
+        The most worker processes used, see fit_chains. The chains of all the
+        circuits share the same pool.
+    - batch_fit: bool, default False
+        If the files are fitted in batches, see fit_chains. The chains of each
+        circuit are then joined so there is about one for each worker in all.
+    - warm_starts: dict, default None
+        From a circuit string to a dict from the first file of a chain to the
+        parameters its first fit starts from
+
+    Returns:
+    ----------
+    A generator of (circuit_string, name, result, error) in the order the
+    chains finish, see fit_chains.
+    """
+    if num_workers is None or num_workers < 1:
+        num_workers = os.cpu_count() or 1
+    num_files = sum(len(file_paths) for file_paths in chains.values())
+    num_workers = min(num_workers, len(chains) * len(circuit_strings), num_files * len(circuit_strings) // FILES_PER_WORKER)
+    circuit_chains = {
+        circuit_string: merge_chains(chains, max(num_workers // len(circuit_strings), 1)) if batch_fit else chains
+        for circuit_string in circuit_strings
+    }
+    warm_starts = {} if warm_starts is None else warm_starts
+    # The longest chains are fitted first, so no worker is left with a long one at the end
+    tasks = sorted(
+        (
+            (circuit_string, name, file_paths, warm_starts.get(circuit_string, {}).get(file_paths[0]))
+            for circuit_string, named_chains in circuit_chains.items()
+            for name, file_paths in named_chains.items()
+        ),
+        key=lambda task: -len(task[2]),
+    )
+    if num_workers <= 1:
+        for circuit_string, name, file_paths, warm_start in tasks:
+            try:
+                yield circuit_string, name, fit_chain(circuit_string, file_paths, batch_fit, warm_start), None
+            except Exception as error:
+                yield circuit_string, name, None, error
+        return
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {
+            executor.submit(fit_chain, circuit_string, file_paths, batch_fit, warm_start): (circuit_string, name)
+            for circuit_string, name, file_paths, warm_start in tasks
+        }
+        for future in as_completed(futures):
+            error = future.exception()
+            yield *futures[future], None if error else future.result(), error
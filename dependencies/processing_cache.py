@@ -0,0 +1,210 @@
+"""
+Processing cache
+
+Short description:
+----------
+This is a helper file to the processing engine (processing_engine.py). It keeps
+the results of processing a raw file and channel pair, so processing a run again
+with the same settings does not redo the fft. An entry is found from the path of
+the raw file, the channel pair and the processing parameters, and it is only used
+if the raw file has the same size and modification time (or content hash) as when
+the entry was made. Changing a setting thus only misses the entries made with the
+old value, and those are still there if the setting is changed back.
+
+Each entry is a .npz file with the results of EIS_Sample.fft, in a sub folder of
+the cache folder named after the run (the folder of the raw file).
+
+Contains:
+----------
+- file_fingerprint: The size and modification time, or content hash, of a raw file
+- settings_key: The part of the processing parameters that changes the result
+- ProcessingCache: Looking up and storing the results
+"""
+import os
+import json
+import hashlib
+import numpy as np
+from dependencies.eis_sample import EIS_Sample
+
+# Change when the processing gives other results for the same input, so old entries are not used
+CACHE_VERSION = 1
+# The processing parameters the result depends on, see process_channel
+PROCESSING_KEYS = [
+    "time_loc",
+    "voltage_prominence",
+    "current_prominence",
+    "correction_factor_current",
+    "filter_apply",
+    "filter_type",
+    "beta_factor",
+    "estimator",
+]
+NUMERIC_KEYS = [
+    "time_loc",
+    "voltage_prominence",
+    "current_prominence",
+    "correction_factor_current",
+    "beta_factor",
+]
+# The values set by EIS_Sample.fft that are stored
+RESULT_FIELDS = [
+    "all_fft_frequencies",
+    "all_fft_voltage",
+    "all_fft_current",
+    "voltage_indicies",
+    "current_indicies",
+    "indicies",
+    "fft_frequencies",
+    "impedance",
+    "voltage_amplitude",
+    "current_amplitude",
+    "z_std",
+]
+
+
+def file_fingerprint(file_path, content_hash=False):
+    """
+    Returns a string that changes when the raw file changes, the size and the
+    modification time, or the sha1 of the content if content_hash is True.
+    """
+    if content_hash:
+        digest = hashlib.sha1()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    stat = os.stat(file_path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def settings_key(settings, current_loc, voltage_loc):
+    """Returns the processing parameters and channel pair as a string, numbers written the same way however they are given"""
+    values = {
+        key: float(settings[key]) if key in NUMERIC_KEYS else settings[key]
+        for key in PROCESSING_KEYS
+    }
+    values["current_loc"] = int(current_loc)
+    values["voltage_loc"] = int(voltage_loc)
+    values["version"] = CACHE_VERSION
+    return json.dumps(values, sort_keys=True)
+
+
+class ProcessingCache:
+    """
+    Short description:
+    ----------
+    The processed results of the raw files, stored in a folder.
+
+    Main methods:
+    ----------
+    - fingerprint :
+        The fingerprint of a raw file, found once and passed to get and put.
+    - get :
+        Returns the cached EIS_Sample, or None if there is no valid entry.
+    - put :
+        Stores the results of a processed EIS_Sample.
+    - process :
+        Returns the cached sample or processes the channel and stores it.
+    """
+
+    def __init__(self, folder, content_hash=False):
+        """
+        Parameters:
+        ----------
+        - folder: str
+            The folder the entries are stored in, made when the first entry is stored.
+            Should not be in Total_mm, where every folder is taken as a run.
+        - content_hash: bool, default False
+            If True the raw files are checked by their content hash instead of
+            their size and modification time
+        """
+        self.folder = folder
+        self.content_hash = content_hash
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, file_path, settings, current_loc, voltage_loc):
+        """Returns the path to the entry of the raw file, parameters and channel pair"""
+        key = os.path.abspath(file_path) + "\n" + settings_key(settings, current_loc, voltage_loc)
+        run_name = os.path.basename(os.path.dirname(os.path.abspath(file_path)))
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        return os.path.join(self.folder, run_name, f"{name}_{hashlib.sha1(key.encode()).hexdigest()[:20]}.npz")
+
+    def fingerprint(self, file_path):
+        """
+        Returns the fingerprint of the raw file. With content_hash the whole file
+        is read, so it should be found once per file and passed to get and put
+        for every channel pair.
+        """
+        return file_fingerprint(file_path, self.content_hash)
+
+    def get(self, file_path, settings, current_loc, voltage_loc, fingerprint=None):
+        """
+        Parameters:
+        ----------
+        - fingerprint: str, default None
+            The fingerprint of the raw file, found with fingerprint if None
+
+        Returns:
+        ----------
+        A EIS_Sample with the results of fft set and no time signals, or None if
+        there is no entry or the raw file has changed since it was made.
+        """
+        entry_path = self.entry_path(file_path, settings, current_loc, voltage_loc)
+        try:
+            with np.load(entry_path) as entry:
+                if fingerprint is None:
+                    fingerprint = self.fingerprint(file_path)
+                if str(entry["fingerprint"]) != fingerprint:
+                    self.misses += 1
+                    return None
+                sample = EIS_Sample(
+                    np.empty(0),
+                    np.empty(0),
+                    int(entry["sample_frequency"]),
+                    voltage_proportion=float(settings["voltage_prominence"]),
+                    current_proportion=float(settings["current_prominence"]),
+                    filter_apply=settings["filter_apply"],
+                    filter_type=settings["filter_type"],
+                    beta_factor=settings["beta_factor"],
+                    frequency_now=float(entry["frequency_now"]),
+                    estimator=settings["estimator"],
+                )
+                for field in RESULT_FIELDS:
+                    setattr(sample, field, entry[field])
+        except (OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return sample
+
+    def put(self, file_path, settings, current_loc, voltage_loc, sample, fingerprint=None):
+        """
+        Stores the results of the processed sample, replacing an older entry. The
+        fingerprint should be the one found before the file was processed, and
+        is found with fingerprint if None.
+        """
+        if fingerprint is None:
+            fingerprint = self.fingerprint(file_path)
+        entry_path = self.entry_path(file_path, settings, current_loc, voltage_loc)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        # Written to a temporary file first so a half written entry is never read
+        temporary_path = entry_path[:-4] + ".tmp.npz"
+        np.savez(
+            temporary_path,
+            fingerprint=fingerprint,
+            sample_frequency=sample.sample_frequency,
+            frequency_now=sample.frequency_now,
+            **{field: getattr(sample, field) for field in RESULT_FIELDS},
+        )
+        os.replace(temporary_path, entry_path)
+
+    def process(self, file_path, settings, current_loc, voltage_loc, process_channel, fingerprint=None):
+        """Returns the cached sample, or processes it with process_channel and stores it"""
+        if fingerprint is None:
+            fingerprint = self.fingerprint(file_path)
+        sample = self.get(file_path, settings, current_loc, voltage_loc, fingerprint)
+        if sample is None:
+            sample = process_channel(file_path, settings, current_loc, voltage_loc)
+            self.put(file_path, settings, current_loc, voltage_loc, sample, fingerprint)
+        return sample
@@ -0,0 +1,297 @@
+"""
+Processing engine
+
+Short description:
+----------
+This is a helper file to the data processor (data_processor.py). It contains a
+class called ProcessingEngine that computes the impedance of picoscope text files
+in a pool of worker processes instead of on the tkinter thread. Every file is
+fanned out into one job per current/voltage channel pair and the finished jobs
+are handed back in the order they complete, so the GUI can display them as soon
+as they are ready.
+
+With a ProcessingCache the jobs that are already in the cache are not sent to
+the workers, their results are handed back at once, and the results of the
+other jobs are stored in the cache as they are collected.
+
+The workers only do the reading and the fft. The save files are written by the
+process that owns the engine, and since the name and content of every save file
+only depends on the raw file and the channel, the result on disk does not depend
+on the order the jobs finish in.
+
+Contains:
+----------
+- channel_pairs: The (current_loc, voltage_loc) pairs that should be processed in a file
+- channel_columns: The current and voltage columns of the raw file from the active channels
+- frequency_from_filename: The frequency coded into the raw data filename
+- process_channel: The function that is run by the workers
+- ProcessingEngine: The pool of workers
+"""
+import os
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from dependencies.eis_sample import EIS_Sample
+
+
+def channel_pairs(current_locs, voltage_locs):
+    """
+    Parameters:
+    ----------
+    - current_locs: list of int
+        The column indicies of the current channels in the raw file
+    - voltage_locs: list of int
+        The column indicies of the voltage channels in the raw file
+
+    Returns:
+    ----------
+    A list of (current_loc, voltage_loc) tuples. Each voltage channel is paired
+    with the current channel of the same picoscope, i.e. one of the three columns
+    following the current column.
+    """
+    return [
+        (current_loc, voltage_loc)
+        for current_loc in current_locs
+        for voltage_loc in range(current_loc + 1, current_loc + 4)
+        if voltage_loc in voltage_locs
+    ]
+
+
+def channel_columns(channels):
+    """
+    Parameters:
+    ----------
+    - channels: np.ndarray of bool with shape (num_picoscopes, 4)
+        The active channels of each picoscope, the first being the current channel
+
+    Returns:
+    ----------
+    The column indicies of the current and the voltage channels in the raw file,
+    as two lists (current_locs, voltage_locs). Column 0 is the time.
+    """
+    current_locs = []
+    voltage_locs = []
+    channel_index_in_file = 1
+    for picoscope_index in range(len(channels)):
+        current_locs.append(channel_index_in_file)
+        channel_index_in_file += 1
+        for channel_index in range(1, 4):
+            if channels[picoscope_index][channel_index]:
+                voltage_locs.append(channel_index_in_file)
+                channel_index_in_file += 1
+    return current_locs, voltage_locs
+
+
+def frequency_from_filename(file_path):
+    """Returns the frequency from a raw data file named as freq<frequency>Hz.txt"""
+    return float(os.path.basename(file_path).split("freq")[1].split("Hz.txt")[0])
+
+
+def process_channel(file_path, settings, current_loc, voltage_loc):
+    """
+    Parameters:
+    ----------
+    - file_path: str
+        The absolute path to the raw picoscope text file
+    - settings: dict
+        The processing parameters, with the keys time_loc, voltage_prominence,
+        current_prominence, correction_factor_current, filter_apply, filter_type,
+        beta_factor and estimator, and optionally memory_map
+    - current_loc: int
+        The column of the current in the file
+    - voltage_loc: int
+        The column of the voltage in the file
+
+    Does:
+    ----------
+    Loads the file and does the fft for one channel pair. The time signals are
+    removed from the sample before it is returned, as they are not needed for
+    saving or plotting and would only have to be sent back to the main process.
+
+    With the "Segmented" estimator the file is read in chunks instead, so the
+    whole capture is never in memory.
+
+    Returns:
+    ----------
+    The EIS_Sample with the fft done.
+    """
+    if settings["estimator"] == "Segmented":
+        return EIS_Sample.from_file_segmented(
+            file_path,
+            time_loc=settings["time_loc"],
+            voltage_loc=voltage_loc,
+            current_loc=current_loc,
+            correction_factor_current=settings["correction_factor_current"],
+            frequency_now=frequency_from_filename(file_path),
+            memory_map=settings.get("memory_map", False),
+        )
+    sample = EIS_Sample.from_file(
+        file_path,
+        time_loc=settings["time_loc"],
+        voltage_loc=voltage_loc,
+        current_loc=current_loc,
+        voltage_proportion=settings["voltage_prominence"],
+        current_proportion=settings["current_prominence"],
+        correction_factor_current=settings["correction_factor_current"],
+        filter_apply=settings["filter_apply"],
+        filter_type=settings["filter_type"],
+        beta_factor=settings["beta_factor"],
+        estimator=settings["estimator"],
+        frequency_now=frequency_from_filename(file_path),
+        memory_map=settings.get("memory_map", False),
+    )
+    sample.fft()
+    sample.voltage = None
+    sample.current = None
+    sample.voltage_window = None
+    sample.current_window = None
+    return sample
+
+
+class ProcessingEngine:
+    """
+    Short description:
+    ----------
+    A pool of worker processes that processes raw files channel by channel.
+
+    Main methods:
+    ----------
+    - submit_file :
+        Queues one job per channel pair of a file.
+    - collect :
+        Returns the jobs that have finished since the last call, in the order
+        they finished. Does not block, so it can be polled from tkinter with after().
+    - shutdown :
+        Stops the workers, jobs that have not started are cancelled. The engine
+        can not be used after this.
+
+    submit_file and collect can be called from different threads.
+    """
+
+    def __init__(self, num_workers=None, cache=None):
+        """
+        Parameters:
+        ----------
+        - num_workers: int, default None
+            The number of worker processes. If None the number of cores is used.
+        - cache: ProcessingCache, default None
+            The cache of processed results, if None everything is processed
+        """
+        if num_workers is None or num_workers < 1:
+            num_workers = os.cpu_count() or 1
+        self.num_workers = num_workers
+        self.cache = cache
+        self.executor = None
+        self.finished = queue.SimpleQueue()
+        self.jobs_left = {}
+        # Files can be submitted from other threads than the one collecting
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def start(self):
+        """Starts the worker processes if they are not already running"""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.num_workers)
+
+    def submit_file(self, file_path, settings, pairs):
+        """
+        Parameters:
+        ----------
+        - file_path: str
+            The raw file that should be processed
+        - settings: dict
+            The processing parameters, see process_channel
+        - pairs: list of (current_loc, voltage_loc)
+            The channel pairs that should be processed, see channel_pairs. Nothing
+            is queued if there are none.
+        """
+        # Found once for all the channel pairs, and outside the lock, as with a
+        # content hash the whole file is read
+        fingerprint = None
+        if self.cache is not None and len(pairs) > 0:
+            try:
+                fingerprint = self.cache.fingerprint(file_path)
+            except OSError:
+                # The jobs fail on the file and report it through collect
+                pass
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("The processing engine is shut down")
+            if len(pairs) == 0:
+                # No job would ever finish and remove the file, so busy would stay True
+                return
+            self.jobs_left[file_path] = self.jobs_left.get(file_path, 0) + len(pairs)
+            for current_loc, voltage_loc in pairs:
+                sample = None
+                if self.cache is not None:
+                    sample = self.cache.get(file_path, settings, current_loc, voltage_loc, fingerprint)
+                if sample is not None:
+                    future = Future()
+                    future.set_result(sample)
+                    self.finished.put(((file_path, current_loc, voltage_loc, settings, fingerprint, True), future))
+                    continue
+                self.start()
+                future = self.executor.submit(
+                    process_channel, file_path, settings, current_loc, voltage_loc
+                )
+                # The callback is run when the job is done, so the queue is filled in
+                # completion order
+                future.add_done_callback(
+                    lambda future, job=(file_path, current_loc, voltage_loc, settings, fingerprint, False): self.finished.put(
+                        (job, future)
+                    )
+                )
+
+    def busy(self):
+        """Returns True if there are jobs that are not yet collected"""
+        return len(self.jobs_left) > 0
+
+    def collect(self):
+        """
+        Returns:
+        ----------
+        A list of dicts, one for each finished job, with the keys
+        - file_path, current_loc, voltage_loc : What was processed
+        - sample : The EIS_Sample, None if the job failed
+        - error : The exception raised by the job, None if it succeeded
+        - file_done : True if this was the last job of the file
+        - cached : True if the sample was found in the cache
+        """
+        results = []
+        while True:
+            try:
+                (file_path, current_loc, voltage_loc, settings, fingerprint, cached), future = self.finished.get_nowait()
+            except queue.Empty:
+                break
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if error is None and not cached and self.cache is not None:
+                self.cache.put(file_path, settings, current_loc, voltage_loc, future.result(), fingerprint)
+            with self.lock:
+                self.jobs_left[file_path] -= 1
+                file_done = self.jobs_left[file_path] == 0
+                if file_done:
+                    del self.jobs_left[file_path]
+            results.append(
+                {
+                    "file_path": file_path,
+                    "current_loc": current_loc,
+                    "voltage_loc": voltage_loc,
+                    "sample": None if error else future.result(),
+                    "error": error,
+                    "file_done": file_done,
+                    "cached": cached,
+                }
+            )
+        return results
+
+    def shutdown(self):
+        """Stops the workers and cancels the jobs that are not started"""
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+            self.jobs_left = {}
+            self.finished = queue.SimpleQueue()
+            self.closed = True
@@ -0,0 +1,154 @@
+"""
+Processing manifest
+
+Short description:
+----------
+This is a helper file to the process function of the dashboard
+(dashboard_for_plotting_and_fitting.py). It keeps track of which spectra the
+circuit fitting, the DRT fitting and the impedance prediction have been done for,
+and with which settings, so the auto-run only has to do the new or changed ones and
+merge the results into the dataframes it already has.
+
+A spectrum is one cell in one run, named by its path_to_file. Runs in an impedance
+store have no file of their own for each spectrum, so a spectrum is recognized by
+a hash of its data (frequencies and impedance as retrieved) rather than by the
+modification time of a file. The settings are the values the results of an
+algorithm depend on, e.g. the circuit string, as a string. A spectrum has to be
+processed again if its hash or the settings changed since it was processed last.
+
+Contains:
+----------
+- spectrum_hashes: The hash of each spectrum in the retrieved data
+- ProcessingManifest: What each algorithm has processed
+- replace_rows: Merges new results into a dataframe of earlier results
+- with_results: The spectra an algorithm gave results for, the ones to record
+"""
+import json
+import hashlib
+import pandas as pd
+
+# The columns of the dataframe made by retrieve_data that the results depend on
+DATA_COLUMNS = ["frequencies", "realvalues", "imaginaryvalues", "area"]
+
+
+def spectrum_hashes(df):
+    """Returns a dict from the path_to_file of each spectrum in df to a hash of its data"""
+    hashes = {}
+    for path_to_file, rows in df.groupby("path_to_file", sort=False):
+        digest = hashlib.sha1()
+        for column in DATA_COLUMNS:
+            digest.update(rows[column].to_numpy().astype(str if column == "area" else float).tobytes())
+        hashes[path_to_file] = digest.hexdigest()
+    return hashes
+
+
+class ProcessingManifest:
+    """
+    Short description:
+    ----------
+    The hash and settings of the spectra processed by each algorithm, e.g.
+    "circuit", "DRT" and "Z_pred".
+
+    Main methods:
+    ----------
+    - changed :
+        The spectra that are new or changed since they were processed.
+    - removed :
+        The processed spectra that are no longer in the data.
+    - record :
+        Notes that spectra have been processed.
+    """
+
+    def __init__(self):
+        # algorithm -> path_to_file -> (hash, settings)
+        self.entries = {}
+
+    @staticmethod
+    def settings_key(settings):
+        """Returns the settings, a dict, as a string that is the same for the same values"""
+        return json.dumps(settings, sort_keys=True, default=str)
+
+    def changed(self, algorithm, hashes, settings):
+        """Returns the paths in hashes that the algorithm has not processed with the same data and settings"""
+        entries = self.entries.get(algorithm, {})
+        key = self.settings_key(settings)
+        return [path for path, digest in hashes.items() if entries.get(path) != (digest, key)]
+
+    def removed(self, algorithm, hashes):
+        """Returns the paths the algorithm has processed that are not in hashes"""
+        return [path for path in self.entries.get(algorithm, {}) if path not in hashes]
+
+    def record(self, algorithm, hashes, settings, paths):
+        """Notes that the algorithm has processed the paths with the data in hashes and the settings"""
+        entries = self.entries.setdefault(algorithm, {})
+        key = self.settings_key(settings)
+        for path in paths:
+            entries[path] = (hashes[path], key)
+
+    def forget(self, algorithm, paths):
+        """Removes the paths from what the algorithm has processed"""
+        entries = self.entries.get(algorithm, {})
+        for path in paths:
+            entries.pop(path, None)
+
+    def clear(self):
+        """Forgets everything, so the next process does all the spectra"""
+        self.entries = {}
+
+
+def replace_rows(old_df, new_df, keys, key_columns):
+    """
+    Parameters:
+    ----------
+    - old_df: pandas DataFrame
+        The earlier results
+    - new_df: pandas DataFrame or None
+        The new results, None if there are none
+    - keys: iterable
+        The values of key_columns, as tuples if there are several, of the rows in
+        old_df that are replaced or removed
+    - key_columns: list of str
+        The columns that identify the spectrum of a row, e.g. ["path_to_file"]
+
+    Returns:
+    ----------
+    old_df without the rows of the keys, with the rows of new_df added.
+    """
+    if len(old_df) > 0:
+        index = pd.MultiIndex.from_frame(old_df[key_columns]) if len(key_columns) > 1 else old_df[key_columns[0]]
+        old_df = old_df.loc[~index.isin(list(keys))]
+    if new_df is None or len(new_df) == 0:
+        return old_df.copy()
+    if len(old_df) == 0:
+        return new_df.copy()
+    return pd.concat([old_df, new_df], ignore_index=True)
+
+
+def with_results(paths, keys, new_df, key_columns, value_column, count=1):
+    """
+    Parameters:
+    ----------
+    - paths: list of str
+        The spectra that were processed
+    - keys: list
+        The values of key_columns of each of the paths, as tuples if there are several
+    - new_df: pandas DataFrame or None
+        The new results, None if there are none
+    - key_columns: list of str
+        The columns that identify the spectrum of a row, see replace_rows
+    - value_column: str
+        A column of the results that is NaN in the rows of a failed fit
+    - count: int, default 1
+        The number of rows with a value a spectrum should have, e.g. one for each circuit
+
+    Returns:
+    ----------
+    The paths with at least count rows in new_df where value_column is not NaN.
+    Only these should be recorded, so the spectra the algorithm failed for are
+    still changed and are tried again.
+    """
+    if new_df is None or len(new_df) == 0 or value_column not in new_df.columns:
+        return []
+    rows = new_df.loc[new_df[value_column].notna()]
+    counts = rows.groupby(key_columns[0] if len(key_columns) == 1 else key_columns).size()
+    return [path for path, key in zip(paths, keys) if counts.get(key, 0) >= count]
@@ -0,0 +1,193 @@
+"""
+Profiling
+
+Short description:
+----------
+Stage timers for the whole program. A stage is a named part of the work, marked
+with the context manager stage or the decorator timed, and for every stage the
+number of calls, the wall time, the cpu time and the peak memory allocated while
+it ran are summed up.
+
+Nothing is recorded unless the environment variable EIS_PROFILE is set when the
+program starts. If it is not set, timed returns the functions as they are and
+stage does nothing, so the stages can stay in the code:
+
+    EIS_PROFILE=1       The stage table is written when the program exits
+    EIS_PROFILE=memory  Also the peak memory of the stages, with tracemalloc
+    EIS_PROFILE=full    Also a cProfile of the whole run and a tracemalloc snapshot
+
+tracemalloc makes code with many small allocations several times slower, so the
+times are best taken with EIS_PROFILE=1.
+
+The files are written to the folder in EIS_PROFILE_DIR, default Profiles, named
+after the time and process id. Only the main process is profiled, the jobs run
+by the worker processes of the processing engine are not included.
+
+Contains:
+----------
+- ENABLED, MEMORY, FULL: If the stages are recorded, with memory, and with profiles dumped
+- stage: Context manager recording a stage
+- timed: Decorator recording every call of a function as a stage
+- summary: The table of the recorded stages
+- write_report: Writes the table and the profiles to the profile folder
+"""
+import os
+import time
+import atexit
+import inspect
+import cProfile
+import multiprocessing
+import threading
+import functools
+import contextlib
+import tracemalloc
+from datetime import datetime
+
+_SETTING = os.environ.get("EIS_PROFILE", "").strip().lower()
+# Only the main process records, the worker processes would never write their report
+ENABLED = _SETTING not in ("", "0", "false", "no") and multiprocessing.parent_process() is None
+FULL = _SETTING == "full"
+MEMORY = FULL or _SETTING == "memory"
+PROFILE_DIR = os.environ.get("EIS_PROFILE_DIR", "Profiles")
+
+# stage name -> [calls, wall time, cpu time, peak memory]
+_stats = {}
+_lock = threading.Lock()
+_local = threading.local()
+_profiler = None
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+@contextlib.contextmanager
+def _recorded_stage(name):
+    stack = _stack()
+    current, peak = tracemalloc.get_traced_memory()
+    if len(stack) > 0:
+        # The peak is reset for this stage, so the peak so far is kept by the outer one
+        stack[-1][1] = max(stack[-1][1], peak)
+    tracemalloc.reset_peak()
+    frame = [current, current]
+    stack.append(frame)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        frame[1] = max(frame[1], tracemalloc.get_traced_memory()[1])
+        stack.pop()
+        if len(stack) > 0:
+            stack[-1][1] = max(stack[-1][1], frame[1])
+        with _lock:
+            stats = _stats.setdefault(name, [0, 0.0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += wall
+            stats[2] += cpu
+            stats[3] = max(stats[3], frame[1] - frame[0])
+
+
+def stage(name):
+    """
+    Parameters:
+    ----------
+    - name: str
+        The name the stage is recorded as, e.g. "data_processor.save_total_mm"
+
+    Returns:
+    ----------
+    A context manager that records the time and memory of the code in it:
+
+        with stage("fitting.retrieve_data"):
+            ...
+    """
+    if not ENABLED:
+        return contextlib.nullcontext()
+    return _recorded_stage(name)
+
+
+def timed(name=None):
+    """
+    Decorator that records every call of the function as a stage, named after the
+    module and function unless a name is given. Works on async functions too.
+
+        @timed
+        def fft(self): ...
+
+        @timed("experiment.run_one_freq")
+        async def run_one_freq(self, freq): ...
+
+    If profiling is not enabled the function is returned as it is.
+    """
+    if callable(name):
+        return timed()(name)
+
+    def decorator(function):
+        if not ENABLED:
+            return function
+        stage_name = name or f"{function.__module__.split('.')[-1]}.{function.__qualname__}"
+
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with _recorded_stage(stage_name):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with _recorded_stage(stage_name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def summary():
+    """Returns the recorded stages as a table, sorted by the total wall time"""
+    with _lock:
+        rows = sorted(_stats.items(), key=lambda item: item[1][1], reverse=True)
+    lines = [f"{'stage':50s}{'calls':>8s}{'wall [s]':>12s}{'cpu [s]':>12s}{'per call [ms]':>15s}"]
+    if MEMORY:
+        lines[0] += f"{'peak [MB]':>11s}"
+    for stage_name, (calls, wall, cpu, peak) in rows:
+        line = f"{stage_name:50s}{calls:8d}{wall:12.3f}{cpu:12.3f}{1000 * wall / calls:15.2f}"
+        if MEMORY:
+            line += f"{peak / 1e6:11.1f}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def write_report():
+    """
+    Writes the stage table, and with EIS_PROFILE=full the cProfile stats and the
+    tracemalloc snapshot, to the profile folder. Called when the program exits.
+    """
+    if not ENABLED:
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base_name = os.path.join(PROFILE_DIR, f"profile_{datetime.now().strftime('%Y-%m-%d-%H%M-%S')}_{os.getpid()}")
+    with open(base_name + ".txt", "w") as f:
+        f.write(summary() + "\n")
+    if FULL:
+        _profiler.disable()
+        _profiler.dump_stats(base_name + ".prof")
+        tracemalloc.take_snapshot().dump(base_name + ".tracemalloc")
+    print(f"Profile written to {base_name}.txt")
+
+
+if ENABLED:
+    if MEMORY:
+        tracemalloc.start()
+    if FULL:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    atexit.register(write_report)
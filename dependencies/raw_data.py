@@ -0,0 +1,164 @@
+"""
+Raw data
+
+Short description:
+----------
+This is a helper file to EIS_Sample (eis_sample.py). It gives random access to the
+columns of a raw picoscope text file without loading all of it. A text file can not
+be indexed by row, so the first time the data is needed it is converted, a chunk at
+the time, to a binary .npy file next to it (the index). The index is memory mapped,
+so taking a column, a slice or every n-th sample only reads those parts from disk,
+and the operating system keeps the parts in use in memory as long as there is room.
+
+The index is stored column by column, in base units (the milli- columns are
+converted), so a column is one contiguous block. It is made again if the raw file
+is newer than it. Things that only need the start of the file, as the sample
+frequency, are read from the text without making the index.
+
+Contains:
+----------
+- HEADER_ROWS: The number of rows before the data in the raw files
+- count_rows: Counts the data rows of a raw file
+- RawCapture: The columns of a raw file
+"""
+import os
+import numpy as np
+from numpy.lib.format import open_memmap
+from dependencies.segmented_estimator import read_chunks
+
+# See EIS_experiment.saveData, the names are on row 21, the units on row 22 and the data start on row 24
+HEADER_ROWS = 23
+
+
+def count_rows(file_path):
+    """Returns the number of data rows in the raw file, blank lines not counted"""
+    rows = 0
+    with open(file_path, "rb") as f:
+        for _ in range(HEADER_ROWS):
+            f.readline()
+        for line in f:
+            if not line.isspace():
+                rows += 1
+    return rows
+
+
+class RawCapture:
+    """
+    Short description:
+    ----------
+    The columns of a raw picoscope text file, memory mapped from the index.
+
+    Main methods:
+    ----------
+    - column :
+        A read only view of a whole column.
+    - slice :
+        A read only view of part of a column.
+    - preview :
+        Every n-th sample of a column, at most a given number of samples.
+    - chunks :
+        Copies of some columns a block of rows at the time.
+    """
+
+    def __init__(self, file_path, time_loc=0, index_folder=None, chunk_rows=200000):
+        """
+        Parameters:
+        ----------
+        - file_path : str
+            The relative/absolute filepath to pico text file
+        - time_loc : int, default 0
+            The column of the time loging in the file (zero indexed)
+        - index_folder : str, default None
+            The folder the index is stored in, next to the raw file if None
+        - chunk_rows : int, default 200000
+            The number of rows of the text in memory at the time when making the index
+
+        Does:
+        ----------
+        Reads the names and units of the columns and the first two time values.
+        The rest of the file is not read before the data is used.
+        """
+        self.file_path = file_path
+        self.chunk_rows = chunk_rows
+        folder = os.path.dirname(os.path.abspath(file_path)) if index_folder is None else index_folder
+        self.index_path = os.path.join(folder, os.path.splitext(os.path.basename(file_path))[0] + ".npy")
+        self._data = None
+
+        with open(file_path, "r") as f:
+            lines = [f.readline() for _ in range(HEADER_ROWS + 2)]
+        self.names = lines[HEADER_ROWS - 3].rstrip("\n").split("\t")
+        self.units = lines[HEADER_ROWS - 2].split()
+        self.scale = np.array([0.001 if "m" in unit else 1.0 for unit in self.units])
+        first_rows = [line for line in lines[HEADER_ROWS:] if line.strip()]
+        if len(first_rows) < 2:
+            raise ValueError(f"The file {file_path} has {len(first_rows)} samples, at least two are needed")
+        first_times = np.array([float(line.split()[time_loc]) for line in first_rows]) * self.scale[time_loc]
+        self.time_step = first_times[1] - first_times[0]
+        self.sample_frequency = int(np.round(1 / self.time_step))
+
+    @property
+    def num_columns(self):
+        return len(self.units)
+
+    def index_is_current(self):
+        """Returns True if the index exists and is not older than the raw file"""
+        return (
+            os.path.exists(self.index_path)
+            and os.path.getmtime(self.index_path) >= os.path.getmtime(self.file_path)
+        )
+
+    def make_index(self):
+        """
+        Does:
+        ----------
+        Converts the data of the raw file to the index, reading chunk_rows rows
+        at the time. The index is written to a temporary file first, so a
+        process reading it never sees half of it, even if several make it at
+        the same time.
+        """
+        num_rows = count_rows(self.file_path)
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        temporary_path = f"{self.index_path}.{os.getpid()}.tmp"
+        index = open_memmap(temporary_path, mode="w+", dtype=np.float64, shape=(self.num_columns, num_rows))
+        start = 0
+        for chunk in read_chunks(self.file_path, list(range(self.num_columns)), self.chunk_rows):
+            index[:, start : start + len(chunk)] = chunk.T
+            start += len(chunk)
+        index.flush()
+        del index
+        os.replace(temporary_path, self.index_path)
+
+    @property
+    def data(self):
+        """The memory mapped index, read only with shape (num_columns, num_rows)"""
+        if self._data is None:
+            if not self.index_is_current():
+                self.make_index()
+            self._data = np.load(self.index_path, mmap_mode="r")
+        return self._data
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    def column(self, loc):
+        """Returns the column loc (zero indexed) in base units, as a read only view"""
+        return self.data[loc]
+
+    def slice(self, loc, start, stop):
+        """Returns the rows start to stop of the column loc, as a read only view"""
+        return self.data[loc, start:stop]
+
+    def preview(self, loc, max_points=10000):
+        """
+        Returns every n-th sample of the column loc, with n chosen so there are
+        at most max_points, as a read only view. Taking the same rows of the time
+        column gives the time axis of the preview.
+        """
+        step = max(int(np.ceil(len(self) / max_points)), 1)
+        return self.data[loc, ::step]
+
+    def chunks(self, columns, chunk_rows=None):
+        """Returns a generator of arrays with shape (rows, len(columns)) in the same way as read_chunks"""
+        chunk_rows = self.chunk_rows if chunk_rows is None else chunk_rows
+        for start in range(0, len(self), chunk_rows):
+            yield self.data[columns, start : start + chunk_rows].T
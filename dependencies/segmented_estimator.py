@@ -0,0 +1,179 @@
+"""
+Segmented estimator
+
+Short description:
+----------
+This is a helper file to EIS_Sample (eis_sample.py). It estimates the impedance at
+one frequency from a long capture without doing one fft over the whole capture.
+The capture is cut into overlapping Hann windowed segments, in the style of Welch,
+and for each segment the voltage and current are projected onto the frequency.
+Only the sums of the cross and auto spectra at the frequency are kept, so the
+memory used only depends on the segment and chunk lengths, not the capture.
+
+The impedance is the cross spectrum over the current auto spectrum, and since
+every segment is an independent look at the same impedance, the spread between
+them gives a standard deviation of it through the coherence.
+
+Contains:
+----------
+- SEGMENT_PERIODS: The default number of periods in a segment
+- read_chunks: Reads the columns of a raw file a block of rows at the time
+- SegmentedEstimator: Accumulates the spectra of the segments
+"""
+import itertools
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.fft import rfft, rfftfreq
+
+SEGMENT_PERIODS = 10
+
+
+def read_chunks(file_path, columns, chunk_rows=200000):
+    """
+    Parameters:
+    ----------
+    - file_path : str
+        The relative/absolute filepath to pico text file
+    - columns : list of int
+        The columns to read
+    - chunk_rows : int, default 200000
+        The number of rows read at the time
+
+    Does:
+    ----------
+    Reads the file the same way as EIS_Sample.from_file, with the units on row 21
+    and the data from row 23, but only chunk_rows rows are in memory at the time.
+    Columns in milli- units are converted to base units.
+
+    Returns:
+    ----------
+    A generator of arrays with shape (rows, len(columns)).
+    """
+    with open(file_path, "r") as f:
+        for _ in range(21):
+            f.readline()
+        units = f.readline().split()
+        f.readline()
+        scale = np.array([0.001 if "m" in units[column] else 1.0 for column in columns])
+        while True:
+            lines = list(itertools.islice(f, chunk_rows))
+            if len(lines) == 0:
+                break
+            yield np.loadtxt(lines, ndmin=2)[:, columns] * scale
+
+
+class SegmentedEstimator:
+    """
+    Short description:
+    ----------
+    Accumulates the cross and auto spectra of overlapping segments at one frequency.
+
+    Main methods:
+    ----------
+    - add :
+        Adds the next part of the voltage and current, can be called any number of times.
+    - result :
+        Returns the impedance, its standard deviation and the averaged spectrum.
+    """
+
+    def __init__(self, sample_frequency, frequency, segment_periods=SEGMENT_PERIODS, overlap=0.5):
+        """
+        Parameters:
+        ----------
+        - sample_frequency: float
+            The sample frequency in Hertz
+        - frequency: float
+            The frequency the impedance is found at in Hertz
+        - segment_periods: float, default SEGMENT_PERIODS
+            The number of periods in each segment
+        - overlap: float, default 0.5
+            The part of a segment that overlaps the next one
+        """
+        self.sample_frequency = sample_frequency
+        self.frequency = frequency
+        self.segment_length = max(int(round(segment_periods * sample_frequency / frequency)), 8)
+        self.step = max(int(self.segment_length * (1 - overlap)), 1)
+        self.buffer = np.empty((0, 2))
+        self.segments = 0
+        self.cross = 0j
+        self.voltage_power = 0.0
+        self.current_power = 0.0
+        self.voltage_spectrum = 0.0
+        self.current_spectrum = 0.0
+        self._set_length(self.segment_length)
+
+    def _set_length(self, length):
+        """Makes the window and the projection onto the frequency for segments of the length"""
+        self.segment_length = length
+        self.window = np.hanning(length) if length > 2 else np.ones(length)
+        self.kernel = self.window * np.exp(
+            -2j * np.pi * self.frequency * np.arange(length) / self.sample_frequency
+        )
+
+    def add(self, voltage, current):
+        """Adds the samples and processes all the complete segments"""
+        self.buffer = np.concatenate([self.buffer, np.column_stack([voltage, current])])
+        if len(self.buffer) < self.segment_length:
+            return
+        num_segments = (len(self.buffer) - self.segment_length) // self.step + 1
+        # Shape (num_segments, 2, segment_length), a view so nothing is copied
+        segments = sliding_window_view(self.buffer, self.segment_length, axis=0)[:: self.step][:num_segments]
+        self._accumulate(segments)
+        self.buffer = self.buffer[num_segments * self.step :]
+
+    def _accumulate(self, segments):
+        segments = segments - segments.mean(axis=-1, keepdims=True)
+        phasors = segments @ self.kernel
+        voltage, current = phasors[:, 0], phasors[:, 1]
+        self.cross += np.sum(voltage * np.conj(current))
+        self.voltage_power += np.sum(np.abs(voltage) ** 2)
+        self.current_power += np.sum(np.abs(current) ** 2)
+        power = np.sum(np.abs(rfft(segments * self.window, axis=-1)) ** 2, axis=0)
+        self.voltage_spectrum = self.voltage_spectrum + power[0]
+        self.current_spectrum = self.current_spectrum + power[1]
+        self.segments += len(segments)
+
+    def result(self):
+        """
+        Returns:
+        ----------
+        A dict with the keys
+        - frequency : The frequency of the estimate
+        - impedance : The cross spectrum over the current auto spectrum
+        - z_std : The standard deviation of the complex impedance, from the
+          coherence as |Z| * sqrt((1 - coherence) / (segments * coherence)). The
+          segments overlap, so this is somewhat too small. nan with one segment.
+        - voltage_amplitude, current_amplitude : The single sided amplitudes
+        - coherence : The squared coherence between voltage and current
+        - segments : The number of segments
+        - all_fft_frequencies, all_fft_voltage, all_fft_current : The averaged
+          amplitude spectrum of the segments, normalized as in EIS_Sample.fft
+        - index : The index of the frequency in the spectrum
+        """
+        if self.segments == 0:
+            # The capture is shorter than one segment, so all of it is one segment
+            if len(self.buffer) < 2:
+                raise ValueError("Not enough samples for the segmented estimator")
+            self._set_length(len(self.buffer))
+            self._accumulate(self.buffer.T[np.newaxis])
+        window_sum = np.sum(self.window)
+        impedance = self.cross / self.current_power
+        coherence = np.abs(self.cross) ** 2 / (self.voltage_power * self.current_power)
+        if self.segments > 1 and coherence > 0:
+            z_std = np.abs(impedance) * np.sqrt(max(1 - coherence, 0) / (self.segments * coherence))
+        else:
+            z_std = np.nan
+        all_fft_frequencies = rfftfreq(self.segment_length, 1 / self.sample_frequency)
+        return {
+            "frequency": self.frequency,
+            "impedance": impedance,
+            "z_std": z_std,
+            "voltage_amplitude": 2 * np.sqrt(self.voltage_power / self.segments) / window_sum,
+            "current_amplitude": 2 * np.sqrt(self.current_power / self.segments) / window_sum,
+            "coherence": coherence,
+            "segments": self.segments,
+            "all_fft_frequencies": all_fft_frequencies,
+            "all_fft_voltage": np.sqrt(self.voltage_spectrum / self.segments) / window_sum,
+            "all_fft_current": np.sqrt(self.current_spectrum / self.segments) / window_sum,
+            "index": int(np.argmin(np.abs(all_fft_frequencies - self.frequency))),
+        }
@@ -16,6 +16,7 @@ import tkinter as tk
 from tkinter import ttk
 import pandas as pd
 import dependencies.circuit_handler as ch 
+from dependencies.model_selection import CRITERIA
 
 
 class tkinter_class():
@@ -168,6 +169,33 @@ class tkinter_class():
         self.circuit_menu = tk.OptionMenu(self.root, self.circuit_string, *list(ch.IMPLEMENTED_CIRCUITS.keys()), command=self.choose_circuit)
         self.circuit_menu.grid(row=self.currentrow, column=1, columnspan=3, padx=self.padx, pady=self.pady, sticky="ew")
 
+        # Checkbox for fitting the spectra in batches instead of one after the other
+        self.currentrow += 1
+        self.batch_fit_label = tk.Label(self.root, text="Fit spectra in batches:")
+        self.batch_fit_label.config(fg=self.text_color, font=self.font)
+        self.batch_fit_label.grid(row=self.currentrow, column=0, padx=self.padx, pady=self.pady, sticky="W")
+        self.batch_fit_checkbox_var = tk.IntVar()
+        self.batch_fit_checkbox_var.set(0) #Default value
+        self.batch_fit_checkbox = tk.Checkbutton(self.root, variable=self.batch_fit_checkbox_var, onvalue=1, offvalue=0)
+        self.batch_fit_checkbox.grid(row=self.currentrow, column=1, padx=self.padx, pady=self.pady, sticky="W")
+
+        # Checkbox for fitting all the circuits and ranking them for each spectrum, and the criterion they are ranked by
+        self.currentrow += 1
+        self.compare_circuits_label = tk.Label(self.root, text="Compare all circuits:")
+        self.compare_circuits_label.config(fg=self.text_color, font=self.font)
+        self.compare_circuits_label.grid(row=self.currentrow, column=0, padx=self.padx, pady=self.pady, sticky="W")
+        self.compare_circuits_checkbox_var = tk.IntVar()
+        self.compare_circuits_checkbox_var.set(0) #Default value
+        self.compare_circuits_checkbox = tk.Checkbutton(self.root, variable=self.compare_circuits_checkbox_var, onvalue=1, offvalue=0)
+        self.compare_circuits_checkbox.grid(row=self.currentrow, column=1, padx=self.padx, pady=self.pady, sticky="W")
+        self.model_criterion_label = tk.Label(self.root, text="Rank by:")
+        self.model_criterion_label.config(fg=self.text_color, font=self.font)
+        self.model_criterion_label.grid(row=self.currentrow, column=2, padx=self.padx, pady=self.pady, sticky="E")
+        self.model_criterion = tk.StringVar(self.root)
+        self.model_criterion.set("BIC")
+        self.model_criterion_menu = tk.OptionMenu(self.root, self.model_criterion, *CRITERIA)
+        self.model_criterion_menu.grid(row=self.currentrow, column=3, padx=self.padx, pady=self.pady, sticky="ew")
+
 
         ################ DRT-FITTING SETTINGS ################
         self.currentrow += 1
@@ -377,7 +405,7 @@ class tkinter_class():
             self.use_prev_data_alert.grid() # Alert
         else:
             try:
-                files_retrieved = [False, False, False, False, False]
+                files_retrieved = [False, False, False, False, False, False]
                 # Retrieve the DataFrames from the text files in the folder
                 for filename in os.listdir(folderpath):
                     file_path = os.path.join(folderpath, filename)
@@ -398,6 +426,9 @@ class tkinter_class():
                         elif filename == 'predicted_impedance.txt':
                             self.interface.Z_pred_df = pd.read_csv(file_path, sep='\t')
                             files_retrieved[4] = True
+                        elif filename == 'model_selection.txt':
+                            self.interface.model_df = pd.read_csv(file_path, sep='\t')
+                            files_retrieved[5] = True
 
                 if files_retrieved[0] == False:
                     self.interface.df = pd.DataFrame(data={})
@@ -409,6 +440,8 @@ class tkinter_class():
                     self.interface.DRT_df = pd.DataFrame(data={})
                 elif files_retrieved[4] == False:
                     self.interface.Z_pred_df = pd.DataFrame(data={})
+                elif files_retrieved[5] == False:
+                    self.interface.model_df = pd.DataFrame(data={})
 
                 # For loop that ideally should have been avoided, but needs to run for the plots to be properly generated
                 self.interface.circuit_base_variables = []
@@ -427,6 +460,12 @@ class tkinter_class():
                 self.data_folder_button['state']                = tk.DISABLED
                 self.select_circuit_label['state']              = tk.DISABLED
                 self.circuit_menu['state']                      = tk.DISABLED
+                self.batch_fit_label['state']                   = tk.DISABLED
+                self.batch_fit_checkbox['state']                = tk.DISABLED
+                self.compare_circuits_label['state']            = tk.DISABLED
+                self.compare_circuits_checkbox['state']         = tk.DISABLED
+                self.model_criterion_label['state']             = tk.DISABLED
+                self.model_criterion_menu['state']              = tk.DISABLED
                 self.normalize_label['state']                   = tk.DISABLED
                 self.normalize_checkbox['state']                = tk.DISABLED
                 self.process_button['state']                    = tk.DISABLED
@@ -472,6 +511,12 @@ class tkinter_class():
         self.data_folder_button['state']                    = tk.NORMAL
         self.select_circuit_label['state']                  = tk.NORMAL
         self.circuit_menu['state']                          = tk.NORMAL
+        self.batch_fit_label['state']                       = tk.NORMAL
+        self.batch_fit_checkbox['state']                    = tk.NORMAL
+        self.compare_circuits_label['state']                = tk.NORMAL
+        self.compare_circuits_checkbox['state']             = tk.NORMAL
+        self.model_criterion_label['state']                 = tk.NORMAL
+        self.model_criterion_menu['state']                  = tk.NORMAL
         self.normalize_label['state']                       = tk.NORMAL
         self.normalize_checkbox['state']                    = tk.NORMAL
         self.process_button['state']                        = tk.NORMAL
@@ -525,6 +570,8 @@ class tkinter_class():
                         os.remove(os.path.join(folderpath, 'impedance_from_fitting.txt'))
                     if os.path.isfile(os.path.join(folderpath, 'predicted_impedance.txt')):
                         os.remove(os.path.join(folderpath, 'predicted_impedance.txt'))
+                    if os.path.isfile(os.path.join(folderpath, 'model_selection.txt')):
+                        os.remove(os.path.join(folderpath, 'model_selection.txt'))
 
                     if not self.interface.df.empty:
                         self.interface.df.to_csv(os.path.join(folderpath, 'cells.txt'), sep='\t', index=False)
@@ -536,6 +583,8 @@ class tkinter_class():
                         self.interface.DRT_df.to_csv(os.path.join(folderpath, 'DRT.txt'), sep='\t', index=False)
                     if not self.interface.Z_pred_df.empty:
                         self.interface.Z_pred_df.to_csv(os.path.join(folderpath, 'predicted_impedance.txt'), sep='\t', index=False)
+                    if not self.interface.model_df.empty:
+                        self.interface.model_df.to_csv(os.path.join(folderpath, 'model_selection.txt'), sep='\t', index=False)
 
                     # self.interface.df.to_csv(filepath, sep='\t', index=False)
                     self.save_data.configure(bg=self.generate_interface_color, text="DATA SAVED")
@@ -0,0 +1,131 @@
+"""
+Warm start store
+
+Short description:
+----------
+This is a helper file to fit_with_circuit (fitting_algorithms.py). It keeps the
+fitted circuit parameters of every cell and run between the sessions of the
+dashboard, so the first fit of a cell can start from the parameters of an earlier
+fit of the same cell instead of the fixed initial guess of the circuit handler.
+Starting close to the solution the first fit takes a few iterations instead of
+hundreds, and it is less likely to end in another local minimum than the rest of
+the chain.
+
+The store is one file, warm_start_store.json, in the Total_mm folder. For each
+circuit string and cell it has one record per run, with the time of the run, the
+conditions (temperature, pressure, DC and AC current) and the fitted parameters.
+A fit is seeded from the record with the same conditions that is closest in time
+before the run, see WarmStartStore.lookup.
+
+Contains:
+----------
+- STORE_FILENAME: The name of the store in the Total_mm folder
+- CONDITION_KEYS: The columns of the data that make up the conditions of a run
+- WarmStartStore: Reading, looking up and updating the store
+"""
+import os
+import json
+from datetime import datetime
+
+STORE_FILENAME = "warm_start_store.json"
+# Change when the meaning of the stored parameters changes, so old stores are not used
+STORE_VERSION = 1
+# The columns of the dataframe made by retrieve_data that describe the conditions of a run
+CONDITION_KEYS = ["temp", "pressure", "dc", "ac"]
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class WarmStartStore:
+    """
+    Short description:
+    ----------
+    The fitted parameters of the cells of the runs in a Total_mm folder.
+
+    Main methods:
+    ----------
+    - lookup :
+        The parameters of the best earlier fit of a cell.
+    - update :
+        Adds the parameters of a fit.
+    - save :
+        Writes the store.
+    """
+
+    def __init__(self, folder):
+        """
+        Parameters:
+        ----------
+        - folder: str
+            The Total_mm folder, the store is the file warm_start_store.json in it
+
+        Does:
+        ----------
+        Reads the store if it exists. A store that can not be read, or is made by
+        another version, is started over.
+        """
+        self.path = os.path.join(folder, STORE_FILENAME)
+        self.circuits = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    content = json.load(f)
+                if content.get("version") == STORE_VERSION:
+                    self.circuits = content["circuits"]
+            except (OSError, ValueError, KeyError, AttributeError):
+                self.circuits = {}
+
+    def lookup(self, circuit_string, cell_name, run_time, conditions, num_parameters=None):
+        """
+        Parameters:
+        ----------
+        - circuit_string: str
+            The circuit that is fitted
+        - cell_name: str
+            The cell, e.g. "Cell 2"
+        - run_time: str
+            The time of the run that is fitted, as "YYYY-MM-DD HH:MM:SS"
+        - conditions: dict
+            The values of CONDITION_KEYS of the run
+        - num_parameters: int, default None
+            If given, only parameters of this length are used
+
+        Returns:
+        ----------
+        The stored parameters of the cell from the run with the fewest conditions
+        different from the given ones, and of those the closest in time before the
+        run (the run itself if it has been fitted before). Runs after are only used
+        if no run before has as few different conditions. None if nothing is stored
+        for the cell.
+        """
+        records = self.circuits.get(circuit_string, {}).get(cell_name, {})
+        time = datetime.strptime(run_time, TIME_FORMAT)
+
+        def distance(record):
+            seconds = (time - datetime.strptime(record["time"], TIME_FORMAT)).total_seconds()
+            different = sum(record["conditions"].get(key) != conditions.get(key) for key in CONDITION_KEYS)
+            return (different, seconds < 0, abs(seconds))
+
+        candidates = [
+            record
+            for record in records.values()
+            if num_parameters is None or len(record["parameters"]) == num_parameters
+        ]
+        if len(candidates) == 0:
+            return None
+        return list(min(candidates, key=distance)["parameters"])
+
+    def update(self, circuit_string, cell_name, dir_name, run_time, conditions, parameters):
+        """Stores the fitted parameters of the cell in the run dir_name, replacing an earlier fit of the same run"""
+        cells = self.circuits.setdefault(circuit_string, {})
+        cells.setdefault(cell_name, {})[dir_name] = {
+            "time": run_time,
+            "conditions": {key: conditions.get(key) for key in CONDITION_KEYS},
+            "parameters": [float(parameter) for parameter in parameters],
+        }
+
+    def save(self):
+        """Writes the store, to a temporary file first so a crash does not leave half of it"""
+        temporary_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump({"version": STORE_VERSION, "circuits": self.circuits}, f, indent=1)
+        os.replace(temporary_path, self.path)
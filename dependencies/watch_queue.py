@@ -0,0 +1,212 @@
+"""
+Watch queue
+
+Short description:
+----------
+This is a helper file to the data processor (data_processor.py). It contains the
+class WatchQueue that sits between the Watchdog, which runs on the observer thread
+of watchdog, and the processing. The observer thread only puts the file path in
+the queue, which never blocks, and dispatcher threads take the files out, wait
+until they are completely written and hand them to the processing.
+
+The queue is bounded. When it is full new files are kept in an overflow list that
+is moved into the queue as it empties, so no file is lost and the observer is
+never held up. A file is only queued once, even if several events are received
+for it. The number of files that are being processed at the same time is also
+limited, so the dispatchers wait instead of flooding the worker pool.
+
+Contains:
+----------
+- file_ready: Checks that a file is completely written
+- WatchQueue: The queue and its dispatcher threads
+"""
+import os
+import time
+import queue
+import threading
+
+
+def file_ready(file_path, settle_time=0.2):
+    """
+    Parameters:
+    ----------
+    - file_path: str
+        The file to check
+    - settle_time: float, default 0.2
+        The time in seconds the size has to be unchanged
+
+    Returns:
+    ----------
+    True if the file exists, is not empty and has the same size before and after
+    settle_time, i.e. the writing of it is done.
+    """
+    try:
+        size = os.path.getsize(file_path)
+        time.sleep(settle_time)
+        return size > 0 and os.path.getsize(file_path) == size
+    except OSError:
+        return False
+
+
+class WatchQueue:
+    """
+    Short description:
+    ----------
+    A bounded, de-duplicating queue of files to process, with dispatcher threads.
+
+    Main methods:
+    ----------
+    - put :
+        Adds a file, never blocks. Called from the observer thread.
+    - start :
+        Starts the dispatcher threads, which call submit(file_path) for each ready file.
+    - done :
+        Tells the queue that a submitted file is finished, so a new one can be submitted.
+    - stop :
+        Stops the dispatcher threads.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 64,
+        max_in_flight: int = 8,
+        num_dispatchers: int = 2,
+        settle_time: float = 0.2,
+        max_wait: float = 60,
+        log=print,
+    ):
+        """
+        Parameters:
+        ----------
+        - maxsize: int, default 64
+            The number of files the queue holds before new ones go to the overflow
+        - max_in_flight: int, default 8
+            The number of files that can be submitted but not done at the same time
+        - num_dispatchers: int, default 2
+            The number of dispatcher threads
+        - settle_time: float, default 0.2
+            See file_ready
+        - max_wait: float, default 60
+            Seconds to wait for a file to be completely written before it is dropped
+        - log: function(str)
+            A loging function that takes a string as input, must be safe to call
+            from other threads than the tkinter thread
+        """
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.overflow = []
+        self.seen = set()
+        self.lock = threading.Lock()
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.num_dispatchers = num_dispatchers
+        self.settle_time = settle_time
+        self.max_wait = max_wait
+        self.log = log
+        self.threads = []
+        self.running = False
+
+    def put(self, file_path: str) -> bool:
+        """
+        Adds the file to the queue if it has not been added before. Returns True
+        if it was added. Never blocks, if the queue is full the file is put in
+        the overflow.
+        """
+        file_path = os.path.normpath(file_path)
+        with self.lock:
+            if file_path in self.seen:
+                return False
+            self.seen.add(file_path)
+            if len(self.overflow) > 0:
+                self.overflow.append(file_path)
+                return True
+            try:
+                self.queue.put_nowait(file_path)
+            except queue.Full:
+                self.overflow.append(file_path)
+        return True
+
+    def mark_seen(self, file_paths) -> list:
+        """
+        Marks files that are processed some other way, so they are not queued by
+        events. Returns the files that were not already seen, which are the ones
+        the caller should process.
+        """
+        new_files = []
+        with self.lock:
+            for file_path in file_paths:
+                if os.path.normpath(file_path) not in self.seen:
+                    self.seen.add(os.path.normpath(file_path))
+                    new_files.append(file_path)
+        return new_files
+
+    def _refill(self) -> None:
+        """Moves files from the overflow to the queue while there is room"""
+        with self.lock:
+            while len(self.overflow) > 0:
+                try:
+                    self.queue.put_nowait(self.overflow[0])
+                except queue.Full:
+                    break
+                self.overflow.pop(0)
+
+    def start(self, submit) -> None:
+        """
+        Parameters:
+        ----------
+        - submit: function(file_path)
+            Called by the dispatcher threads for each file that is ready
+        """
+        self.running = True
+        for _ in range(self.num_dispatchers):
+            thread = threading.Thread(target=self._dispatch, args=(submit,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _dispatch(self, submit) -> None:
+        """The loop of the dispatcher threads"""
+        while self.running:
+            try:
+                file_path = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self._refill()
+            if file_path is None:
+                break
+
+            # Waiting until the file is completely written
+            start = time.time()
+            while self.running and not file_ready(file_path, self.settle_time):
+                if time.time() - start > self.max_wait:
+                    self.log(f"Gave up waiting for {os.path.basename(file_path)} to be written")
+                    break
+            else:
+                # Backpressure, waits until there is room for one more file in the processing
+                while self.running and not self.in_flight.acquire(timeout=0.5):
+                    pass
+                if self.running:
+                    try:
+                        submit(file_path)
+                    except Exception as e:
+                        self.in_flight.release()
+                        self.log(f"Could not process {os.path.basename(file_path)}: {e}")
+
+    def done(self, file_path: str) -> None:
+        """Called when a submitted file is finished"""
+        try:
+            self.in_flight.release()
+        except ValueError:
+            pass
+
+    def pending(self) -> int:
+        """Returns the number of files waiting in the queue and overflow"""
+        with self.lock:
+            return self.queue.qsize() + len(self.overflow)
+
+    def stop(self) -> None:
+        """Stops the dispatcher threads, files still in the queue are dropped"""
+        self.running = False
+        for _ in self.threads:
+            try:
+                self.queue.put_nowait(None)
+            except queue.Full:
+                pass
+        self.threads = []